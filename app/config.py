@@ -13,6 +13,7 @@ class Settings(BaseSettings):
     TELEGRAM_API_HASH: Optional[str] = None
     TELEGRAM_SESSION_PATH: Optional[str] = None
     REDIS_URL: Optional[str] = None
+    REDIS_UNIX_SOCKET_PATH: Optional[str] = None
     OUTPUT_DIR_PATH: Optional[str] = None
     LOG_LEVEL: str = "INFO"
     RQ_QUEUE_NAME: str = "default"
@@ -1,14 +1,36 @@
+import atexit
 import logging
+import logging.handlers
+import queue
 import structlog
 import sys
+from typing import Optional
 
-def setup_logging(settings):
+LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s [%(process)d]: %(message)s"
+
+def setup_logging(settings, queued: bool = False) -> Optional[logging.handlers.QueueListener]:
+    """
+    Configure stdlib and structlog logging.
+
+    With queued=True the root logger only gets a QueueHandler and a
+    QueueListener thread does the actual stdout writes, so logging from the
+    event loop never blocks on I/O. Only for long-lived single processes: a
+    forked child (e.g. an RQ work-horse) would inherit the handler but not
+    the listener thread. Returns the started listener, stopped at exit.
+    """
     try:
-        logging.basicConfig(
-            level=getattr(logging, getattr(settings, "LOG_LEVEL", "INFO").upper(), logging.INFO),
-            format="%(asctime)s %(levelname)s %(name)s [%(process)d]: %(message)s",
-            handlers=[logging.StreamHandler(sys.stdout)],
-        )
+        level = getattr(logging, getattr(settings, "LOG_LEVEL", "INFO").upper(), logging.INFO)
+        stream_handler = logging.StreamHandler(sys.stdout)
+        listener = None
+        if queued:
+            stream_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+            log_queue = queue.SimpleQueue()
+            listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+            listener.start()
+            atexit.register(listener.stop)
+            logging.basicConfig(level=level, handlers=[logging.handlers.QueueHandler(log_queue)])
+        else:
+            logging.basicConfig(level=level, format=LOG_FORMAT, handlers=[stream_handler])
         structlog.configure(
             wrapper_class=structlog.make_filtering_bound_logger(logging.getLevelName(settings.LOG_LEVEL)),
             processors=[
@@ -17,6 +39,8 @@ def setup_logging(settings):
             ]
         )
         logging.getLogger().info("Structured logging initialized successfully")
+        return listener
     except Exception as e:
         logging.basicConfig(level="ERROR")
         logging.error(f"Falling back to basic logging due to error: {e}", exc_info=True)
+        return None
@@ -33,7 +33,7 @@ async def add_process_time_header(request: Request, call_next: Callable):
         endpoint = request.url.path
         status_code = response.status_code
         if not endpoint.startswith('/health'):
-            MetricsCollector.record_api_metrics(endpoint, process_time, status_code)
+            MetricsCollector.record_api_metrics_nowait(endpoint, process_time, status_code)
         logger.info(f"API response: {endpoint} status={status_code} time={process_time:.3f}s")
         logger.debug(f"[EXIT] Middleware: {endpoint} X-Process-Time={process_time:.3f}s")
         return response
@@ -122,7 +122,7 @@ async def component_health():
 async def system_metrics(days: int = 1, interval_minutes: int = 5):
     logger.info(f"System metrics endpoint called: days={days}, interval_minutes={interval_minutes}")
     try:
-        metrics = MetricsRetriever.get_system_metrics(days, interval_minutes)
+        metrics = await MetricsRetriever.aget_system_metrics(days, interval_minutes)
         logger.info("System metrics endpoint success")
         return {"metrics": metrics}
     except Exception as e:
@@ -133,7 +133,7 @@ async def system_metrics(days: int = 1, interval_minutes: int = 5):
 async def api_metrics(days: int = 1, endpoints: Optional[List[str]] = None):
     logger.info(f"API metrics endpoint called: days={days}, endpoints={endpoints}")
     try:
-        metrics = MetricsRetriever.get_api_metrics(days, endpoints)
+        metrics = await MetricsRetriever.aget_api_metrics(days, endpoints)
         logger.info("API metrics endpoint success")
         return {"metrics": metrics}
     except Exception as e:
@@ -0,0 +1,82 @@
+"""
+Adaptive backoff support for retry decorators.
+
+Keeps a sliding window of successful call latencies per callable so
+retry delays can be anchored to how slow the remote currently is.
+"""
+import os
+import random
+import threading
+import logging
+import itertools
+from collections import deque
+from typing import Deque, Dict, Optional
+
+logger = logging.getLogger("adaptive_backoff")
+
+LATENCY_WINDOW = 256
+LATENCY_QUANTILE = 0.99
+SAFETY_FACTOR = 1.5
+
+class LatencyTracker:
+    """Ring buffer of the most recent successful call durations (seconds)"""
+
+    def __init__(self, size: int = LATENCY_WINDOW):
+        self._samples: Deque[float] = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def quantile(self, q: float = LATENCY_QUANTILE) -> Optional[float]:
+        """Nearest-rank quantile of the window, or None before any sample"""
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+JITTER_TABLE_SIZE = 4096  # power of two, indexed with a mask
+
+# Uniform [0, 1) fractions drawn once; retries walk the table instead of
+# touching the RNG state on every sleep
+_JITTER_TABLE = [random.random() for _ in range(JITTER_TABLE_SIZE)]
+_jitter_idx = itertools.count(random.randrange(JITTER_TABLE_SIZE))
+
+def _reseed_jitter_after_fork() -> None:
+    # Forked RQ work-horses would otherwise replay the parent's exact sequence
+    global _jitter_idx
+    _jitter_idx = itertools.count(random.randrange(JITTER_TABLE_SIZE))
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reseed_jitter_after_fork)
+
+def jitter_fraction() -> float:
+    """Next pseudo-random fraction in [0, 1) from the precomputed table"""
+    return _JITTER_TABLE[next(_jitter_idx) & (JITTER_TABLE_SIZE - 1)]
+
+_trackers: Dict[str, LatencyTracker] = {}
+_trackers_lock = threading.Lock()
+
+def get_tracker(name: str) -> LatencyTracker:
+    tracker = _trackers.get(name)
+    if tracker is None:
+        with _trackers_lock:
+            tracker = _trackers.setdefault(name, LatencyTracker())
+    return tracker
+
+def adaptive_base(tracker: LatencyTracker, delay: float) -> float:
+    """Initial retry delay: the configured delay, raised to the observed P99 if slower"""
+    p99 = tracker.quantile()
+    if p99 is None:
+        return delay
+    return max(delay, p99 * SAFETY_FACTOR)
+
+def decorrelated_jitter(base: float, prev_sleep: float, cap: float) -> float:
+    """AWS "decorrelated jitter": uniform between base and three times the last sleep"""
+    high = max(base, prev_sleep * 3)
+    return min(cap, base + (high - base) * jitter_fraction())
@@ -8,7 +8,6 @@ import time
 import socket
 import os
 import psutil
-from telethon.sync import TelegramClient
 from telethon.errors import AuthKeyError, ServerError
 from redis.exceptions import RedisError
 from typing import Dict, List, Tuple, Any, Optional
@@ -111,10 +110,13 @@ async def check_telegram_health(test_connection: bool = True) -> Dict[str, Any]:
         
         if test_connection:
             # Attempt an actual connection (lightweight)
+            # Shared with the running userbot when in the same process
             client = get_telethon_client(config.settings)
+            was_connected = client.is_connected()
             
             try:
-                await client.connect()
+                if not was_connected:
+                    await client.connect()
                 me = await client.get_me() if await client.is_user_authorized() else None
                 
                 if me:
@@ -136,7 +138,7 @@ async def check_telegram_health(test_connection: bool = True) -> Dict[str, Any]:
                 status = HealthStatus.ERROR
                 details["error"] = f"Connection error: {str(e)}"
             finally:
-                if client.is_connected():
+                if not was_connected and client.is_connected():
                     await client.disconnect()
     
     except Exception as e:
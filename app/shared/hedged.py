@@ -0,0 +1,57 @@
+"""
+Hedged requests for latency-sensitive, idempotent async calls.
+
+If the first attempt is still outstanding after the callable's observed
+P95 latency, a second identical attempt is started; whichever succeeds
+first wins and the other is cancelled. Only use this for calls that are
+safe to run twice (reads, or edits to the same content) - never for
+sends that would be delivered twice.
+"""
+import asyncio
+import time
+import logging
+from typing import Any, Awaitable, Callable, Optional
+
+from app.shared.adaptive_backoff import get_tracker
+
+logger = logging.getLogger("hedged")
+
+HEDGE_QUANTILE = 0.95
+HEDGE_MIN_SAMPLES = 20
+
+async def hedged(coro_factory: Callable[[], Awaitable[Any]], delay: Optional[float]) -> Any:
+    """
+    Await coro_factory(), starting a second attempt if the first has not
+    finished after delay seconds. With delay None the call is not hedged.
+    """
+    if delay is None:
+        return await coro_factory()
+    tasks = {asyncio.ensure_future(coro_factory())}
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if not done:
+            logger.debug(f"Hedging call still outstanding after {delay:.3f}s")
+            tasks.add(asyncio.ensure_future(coro_factory()))
+        error = None
+        while tasks:
+            done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in tasks:
+            task.cancel()
+
+async def hedged_call(name: str, coro_factory: Callable[[], Awaitable[Any]]) -> Any:
+    """
+    hedged() with the delay taken from the P95 of name's recent successful
+    latencies; calls are not hedged until enough samples have been seen.
+    """
+    tracker = get_tracker(name)
+    delay = tracker.quantile(HEDGE_QUANTILE) if len(tracker) >= HEDGE_MIN_SAMPLES else None
+    started = time.perf_counter()
+    result = await hedged(coro_factory, delay)
+    tracker.record(time.perf_counter() - started)
+    return result
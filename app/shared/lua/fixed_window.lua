@@ -0,0 +1,16 @@
+-- Fixed-window rate limit counter.
+--
+-- KEYS[1] = counter key for the current window
+-- ARGV[1] = period (seconds), ARGV[2] = "1" to record this request, "0" to only peek
+--
+-- Returns the number of requests recorded in the window
+
+if ARGV[2] ~= '1' then
+    return tonumber(redis.call('GET', KEYS[1]) or '0')
+end
+
+local count = redis.call('INCR', KEYS[1])
+if count == 1 then
+    redis.call('EXPIRE', KEYS[1], ARGV[1])
+end
+return count
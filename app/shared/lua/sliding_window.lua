@@ -0,0 +1,71 @@
+-- Sliding-window rate limit over a sorted set of request timestamps.
+--
+-- KEYS[1] = rate limit key, KEYS[2] = window metadata hash:
+--   seq    = member sequence counter
+--   period = window period in seconds, as reported by get_rate_limits
+--
+-- Only KEYS are touched, and callers give both keys the same hash tag
+-- (see rate_limiter.py) so the script is routable on Redis Cluster.
+-- ARGV[1] = period (seconds), ARGV[2] = limit,
+-- ARGV[3] = "1" to record this request, "0" to only peek
+--
+-- Scores are unix milliseconds taken from the server clock, so every
+-- worker shares one time source regardless of local clock drift.
+--
+-- Returns {allowed (1/0), current_count, reset_after_seconds}
+
+-- Needed on Redis < 5 before writing after a non-deterministic TIME call
+if redis.replicate_commands then redis.replicate_commands() end
+
+local key = KEYS[1]
+local period = tonumber(ARGV[1])
+local limit = tonumber(ARGV[2])
+local increment = ARGV[3] == '1'
+
+local t = redis.call('TIME')
+local now_ms = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local period_ms = period * 1000
+
+local cutoff = now_ms - period_ms
+local count = redis.call('ZCARD', key)
+
+-- At the limit with the oldest entry still inside the window: every entry
+-- is live, so deny without trimming (the common case under abuse)
+-- (limit <= 0 with an empty window falls through to the final deny)
+if count >= limit and count > 0 then
+    local oldest = redis.call('ZRANGE', key, 0, 0, 'WITHSCORES')
+    local oldest_ms = tonumber(oldest[2])
+    if oldest_ms > cutoff then
+        return {0, count, math.floor((oldest_ms + period_ms - now_ms) / 1000) + 1}
+    end
+end
+
+redis.call('ZREMRANGEBYSCORE', key, 0, cutoff)
+count = redis.call('ZCARD', key)
+
+if count < limit then
+    if increment then
+        -- Short integer members keep small windows in listpack encoding
+        local id = redis.call('HINCRBY', KEYS[2], 'seq', 1)
+        redis.call('ZADD', key, now_ms, id)
+        -- Refresh the TTL only when it could drop below one window, so a
+        -- busy key is not rewritten (and replicated) on every admit; a
+        -- key that keeps at least a period of TTL outlives all its members
+        if count == 0 or redis.call('PTTL', key) < period_ms then
+            redis.call('PEXPIRE', key, period_ms * 2)
+            -- Metadata lives exactly as long as the members it numbered
+            redis.call('HSET', KEYS[2], 'period', period)
+            redis.call('PEXPIRE', KEYS[2], period_ms * 2)
+        end
+        count = count + 1
+    end
+    return {1, count, period}
+end
+
+-- Nothing to age out (limit <= 0): deny for a whole period
+if count == 0 then
+    return {0, 0, period}
+end
+local oldest = redis.call('ZRANGE', key, 0, 0, 'WITHSCORES')
+local reset_after = math.floor((tonumber(oldest[2]) + period_ms - now_ms) / 1000) + 1
+return {0, count, reset_after}
@@ -1,11 +1,17 @@
+import atexit
+import hashlib
 import logging
-import json
+import orjson
 import os
+import queue
+import threading
 import time
-from typing import Optional, Dict, Any, List
-from datetime import datetime, timedelta
+from typing import Optional, Dict, Any, List, Tuple
+from datetime import date, datetime, timedelta
 
-from app.shared.redis_client import get_redis_connection
+import redis
+
+from app.shared.redis_client import get_redis_connection, get_async_redis_connection
 from app import config
 
 logger = logging.getLogger("metrics")
@@ -14,12 +20,166 @@ JOB_METRICS_KEY = "metrics:job:{job_id}"
 USER_METRICS_KEY = "metrics:user:{user_id}"
 SYSTEM_METRICS_KEY = "metrics:system:{date}"
 API_METRICS_KEY = "metrics:api:{endpoint}:{date}"
+ACTIVE_USERS_KEY = "metrics:users:active:{date}"
 
 JOB_METRICS_TTL = 60 * 60 * 24 * 7
 USER_METRICS_TTL = 60 * 60 * 24 * 31
 SYSTEM_METRICS_TTL = 60 * 60 * 24 * 7
 API_METRICS_TTL = 60 * 60 * 24 * 31
 
+# KEYS[1] = API hash, KEYS[2] = response-times list
+# ARGV[1] = response_time, ARGV[2] = status_code, ARGV[3] = ttl
+# Hash fields are kept to a few bytes: "t" total calls, "s" response-time
+# sum, and the bare status code per status counter (see _API_FIELD_NAMES).
+API_METRICS_LUA = """
+redis.call('HINCRBY', KEYS[1], 't', 1)
+redis.call('HINCRBY', KEYS[1], ARGV[2], 1)
+redis.call('HINCRBYFLOAT', KEYS[1], 's', ARGV[1])
+redis.call('LPUSH', KEYS[2], ARGV[1])
+redis.call('LTRIM', KEYS[2], 0, 999)
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+redis.call('EXPIRE', KEYS[2], ARGV[3])
+return 1
+"""
+
+# As Redis computes it, so pipelines can queue a bare EVALSHA: a Script
+# object used on a pipeline makes execute() send SCRIPT EXISTS first
+API_METRICS_SHA = hashlib.sha1(API_METRICS_LUA.encode("utf-8")).hexdigest()
+
+_api_metrics_script = None
+
+def _get_api_metrics_script(redis_conn):
+    """Register the API metrics script once per client; calls go out as EVALSHA"""
+    global _api_metrics_script
+    if _api_metrics_script is None or _api_metrics_script.registered_client is not redis_conn:
+        _api_metrics_script = redis_conn.register_script(API_METRICS_LUA)
+    return _api_metrics_script
+
+# Compact API hash field -> name reported by the retriever; numeric fields
+# are status codes. Long names written by older versions pass through.
+_API_FIELD_NAMES = {b"t": "total_calls", b"s": "response_time_sum"}
+
+# API hash fields holding floats; everything else is an integer counter
+_FLOAT_API_FIELDS = frozenset({b"s", b"avg_response_time", b"response_time_sum"})
+
+def _api_field_name(field: bytes) -> str:
+    name = _API_FIELD_NAMES.get(field)
+    if name is not None:
+        return name
+    if field.isdigit():
+        return f"status_{field.decode()}"
+    return field.decode()
+
+# (expires_at, "YYYY-MM-DD") for the current local day
+_today_cache = (0.0, "")
+
+def _today_str() -> str:
+    """Return today's local date as YYYY-MM-DD, recomputed only after midnight"""
+    global _today_cache
+    expires_at, today = _today_cache
+    if time.time() < expires_at:
+        return today
+    now = datetime.now()
+    next_midnight = datetime.combine(now.date() + timedelta(days=1), datetime.min.time())
+    today = now.strftime("%Y-%m-%d")
+    _today_cache = (next_midnight.timestamp(), today)
+    return today
+
+# Fire-and-forget writes: events queued by the *_nowait recorders are
+# drained by a daemon thread and flushed through the bulk recorders.
+METRICS_QUEUE_SIZE = 10000
+METRICS_BATCH_SIZE = 500
+METRICS_SHUTDOWN_TIMEOUT = 2.0
+
+_queue: "queue.Queue[Tuple[str, tuple]]" = queue.Queue(maxsize=METRICS_QUEUE_SIZE)
+_writer_thread: Optional[threading.Thread] = None
+_writer_lock = threading.Lock()
+
+def _ensure_writer() -> None:
+    global _writer_thread
+    if _writer_thread is not None and _writer_thread.is_alive():
+        return
+    with _writer_lock:
+        if _writer_thread is None or not _writer_thread.is_alive():
+            _writer_thread = threading.Thread(target=_writer_loop, name="metrics-writer", daemon=True)
+            _writer_thread.start()
+
+def _writer_loop() -> None:
+    while True:
+        batch = {"api": [], "user": []}
+        kind, args = _queue.get()
+        batch[kind].append(args)
+        taken = 1
+        while taken < METRICS_BATCH_SIZE:
+            try:
+                kind, args = _queue.get_nowait()
+            except queue.Empty:
+                break
+            batch[kind].append(args)
+            taken += 1
+        try:
+            if batch["api"]:
+                MetricsCollector.record_api_metrics_bulk(batch["api"])
+            if batch["user"]:
+                MetricsCollector.record_user_metrics_bulk(batch["user"])
+        except Exception as e:
+            logger.error(f"[ERROR] Metrics writer flush failed: {e}", exc_info=True)
+        finally:
+            for _ in range(taken):
+                _queue.task_done()
+
+def _enqueue(kind: str, args: tuple) -> bool:
+    _ensure_writer()
+    try:
+        _queue.put_nowait((kind, args))
+        return True
+    except queue.Full:
+        logger.warning(f"Metrics queue full, dropping {kind} metric")
+        return False
+
+def flush_metrics(timeout: float = METRICS_SHUTDOWN_TIMEOUT) -> bool:
+    """Wait up to `timeout` seconds for queued metrics to be written"""
+    with _queue.all_tasks_done:
+        return _queue.all_tasks_done.wait_for(lambda: _queue.unfinished_tasks == 0, timeout)
+
+atexit.register(flush_metrics)
+
+# Short-lived cache for dashboard reads that are polled repeatedly. Results
+# are stored as orjson bytes and decoded per hit, so every caller gets its
+# own copy and mutating a result cannot corrupt the cache
+RESPONSE_CACHE_TTL = 5.0
+RESPONSE_CACHE_SIZE = 256
+
+_response_cache: Dict[tuple, Tuple[float, bytes]] = {}
+_response_cache_lock = threading.Lock()
+
+def _cache_get(key: tuple) -> Any:
+    entry = _response_cache.get(key)
+    if entry is None:
+        return None
+    if entry[0] < time.monotonic():
+        with _response_cache_lock:
+            _response_cache.pop(key, None)
+        return None
+    return orjson.loads(entry[1])
+
+def _cache_put(key: tuple, value: Any) -> None:
+    encoded = orjson.dumps(value)
+    with _response_cache_lock:
+        _response_cache.pop(key, None)
+        while len(_response_cache) >= RESPONSE_CACHE_SIZE:
+            _response_cache.pop(next(iter(_response_cache)))
+        _response_cache[key] = (time.monotonic() + RESPONSE_CACHE_TTL, encoded)
+
+def _loads_list(items: List[bytes]) -> List[Any]:
+    """Parse a list of JSON documents with a single orjson call"""
+    return orjson.loads(b"[" + b",".join(items) + b"]")
+
+def _date_range(days: int) -> List[str]:
+    """Return the last `days` local dates as YYYY-MM-DD, newest first"""
+    end = date.today().toordinal()
+    return [date.fromordinal(end - i).isoformat() for i in range(days)]
+
 class MetricsCollector:
     """Collects and stores metrics about system usage and performance"""
 
@@ -31,8 +191,9 @@ class MetricsCollector:
             key = JOB_METRICS_KEY.format(job_id=job_id)
             if "timestamp" not in metrics:
                 metrics["timestamp"] = time.time()
-            redis_conn.hset(key, mapping={k: json.dumps(v) for k, v in metrics.items()})
+            redis_conn.hset(key, mapping={k: orjson.dumps(v) for k, v in metrics.items()})
             redis_conn.expire(key, JOB_METRICS_TTL)
+            MetricsRetriever.bust_cache(job_id)
             logger.info(f"Job metrics recorded: {job_id}")
             logger.debug(f"[EXIT] record_job_metrics: True")
             return True
@@ -40,24 +201,33 @@ class MetricsCollector:
             logger.error(f"[ERROR] Failed to record job metrics: {e}", exc_info=True)
             return False
 
+    @staticmethod
+    def _queue_user_metrics(pipe, user_id: int, action: str, metadata: Optional[Dict[str, Any]], today: str) -> None:
+        key = USER_METRICS_KEY.format(user_id=user_id)
+        data = {
+            "timestamp": time.time(),
+            "action": action
+        }
+        if metadata:
+            data.update(metadata)
+        pipe.lpush(f"{key}:{today}", orjson.dumps(data))
+        pipe.hincrby(f"{key}:counts", action, 1)
+        pipe.hincrby(f"{key}:counts:{today}", action, 1)
+        pipe.expire(f"{key}:{today}", USER_METRICS_TTL)
+        pipe.expire(f"{key}:counts", USER_METRICS_TTL)
+        pipe.expire(f"{key}:counts:{today}", USER_METRICS_TTL)
+        active_key = ACTIVE_USERS_KEY.format(date=today)
+        pipe.pfadd(active_key, user_id)
+        pipe.expire(active_key, USER_METRICS_TTL)
+
     @staticmethod
     def record_user_metrics(user_id: int, action: str, metadata: Optional[Dict[str, Any]] = None) -> bool:
         logger.debug(f"[ENTRY] record_user_metrics: user_id={user_id}, action={action}, metadata={metadata}")
         try:
             redis_conn = get_redis_connection(config.settings)
-            key = USER_METRICS_KEY.format(user_id=user_id)
-            today = datetime.now().strftime("%Y-%m-%d")
-            data = {
-                "timestamp": time.time(),
-                "action": action
-            }
-            if metadata:
-                data.update(metadata)
-            redis_conn.lpush(f"{key}:{today}", json.dumps(data))
-            redis_conn.hincrby(f"{key}:counts", action, 1)
-            redis_conn.hincrby(f"{key}:counts", f"{action}:{today}", 1)
-            redis_conn.expire(f"{key}:{today}", USER_METRICS_TTL)
-            redis_conn.expire(f"{key}:counts", USER_METRICS_TTL)
+            pipe = redis_conn.pipeline(transaction=False)
+            MetricsCollector._queue_user_metrics(pipe, user_id, action, metadata, _today_str())
+            pipe.execute()
             logger.info(f"User metrics recorded: user_id={user_id}, action={action}")
             logger.debug(f"[EXIT] record_user_metrics: True")
             return True
@@ -65,13 +235,38 @@ class MetricsCollector:
             logger.error(f"[ERROR] Failed to record user metrics: {e}", exc_info=True)
             return False
 
+    @staticmethod
+    def record_user_metrics_bulk(events: List[Tuple[int, str, Optional[Dict[str, Any]]]]) -> bool:
+        """Record many (user_id, action, metadata) events in a single pipelined round trip"""
+        logger.debug(f"[ENTRY] record_user_metrics_bulk: events={len(events)}")
+        if not events:
+            return True
+        try:
+            redis_conn = get_redis_connection(config.settings)
+            today = _today_str()
+            pipe = redis_conn.pipeline(transaction=False)
+            for user_id, action, metadata in events:
+                MetricsCollector._queue_user_metrics(pipe, user_id, action, metadata, today)
+            pipe.execute()
+            logger.info(f"User metrics recorded in bulk: events={len(events)}")
+            logger.debug(f"[EXIT] record_user_metrics_bulk: True")
+            return True
+        except Exception as e:
+            logger.error(f"[ERROR] Failed to record user metrics in bulk: {e}", exc_info=True)
+            return False
+
+    @staticmethod
+    def record_user_metrics_nowait(user_id: int, action: str, metadata: Optional[Dict[str, Any]] = None) -> bool:
+        """Queue a user metric for the background writer; returns False if it was dropped"""
+        return _enqueue("user", (user_id, action, metadata))
+
     @staticmethod
     def record_system_metrics() -> bool:
         logger.debug("[ENTRY] record_system_metrics")
         try:
             import psutil
             redis_conn = get_redis_connection(config.settings)
-            today = datetime.now().strftime("%Y-%m-%d")
+            today = _today_str()
             key = SYSTEM_METRICS_KEY.format(date=today)
             cpu_percent = psutil.cpu_percent(interval=0.1)
             memory = psutil.virtual_memory()
@@ -88,7 +283,7 @@ class MetricsCollector:
                 "active_workers": worker_count,
                 "load_avg": os.getloadavg()[0]
             }
-            redis_conn.lpush(key, json.dumps(data))
+            redis_conn.lpush(key, orjson.dumps(data))
             redis_conn.ltrim(key, 0, 1439)
             redis_conn.expire(key, SYSTEM_METRICS_TTL)
             logger.info("System metrics recorded")
@@ -103,21 +298,8 @@ class MetricsCollector:
         logger.debug(f"[ENTRY] record_api_metrics: endpoint={endpoint}, response_time={response_time}, status_code={status_code}")
         try:
             redis_conn = get_redis_connection(config.settings)
-            today = datetime.now().strftime("%Y-%m-%d")
-            key = API_METRICS_KEY.format(endpoint=endpoint, date=today)
-            redis_conn.hincrby(key, "total_calls", 1)
-            redis_conn.hincrby(key, f"status_{status_code}", 1)
-            redis_conn.lpush(f"{key}:response_times", response_time)
-            redis_conn.ltrim(f"{key}:response_times", 0, 999)
-            current_count = int(redis_conn.hget(key, "total_calls") or 0)
-            current_avg = float(redis_conn.hget(key, "avg_response_time") or 0)
-            if current_count == 1:
-                new_avg = response_time
-            else:
-                new_avg = ((current_avg * (current_count - 1)) + response_time) / current_count
-            redis_conn.hset(key, "avg_response_time", new_avg)
-            redis_conn.expire(key, API_METRICS_TTL)
-            redis_conn.expire(f"{key}:response_times", API_METRICS_TTL)
+            key = API_METRICS_KEY.format(endpoint=endpoint, date=_today_str())
+            _get_api_metrics_script(redis_conn)(keys=[key, f"{key}:response_times"], args=[response_time, status_code, API_METRICS_TTL])
             logger.info(f"API metrics recorded: endpoint={endpoint}, status_code={status_code}")
             logger.debug(f"[EXIT] record_api_metrics: True")
             return True
@@ -125,10 +307,59 @@ class MetricsCollector:
             logger.error(f"[ERROR] Failed to record API metrics: {e}", exc_info=True)
             return False
 
+    @staticmethod
+    def record_api_metrics_bulk(events: List[Tuple[str, float, int]]) -> bool:
+        """Record many (endpoint, response_time, status_code) events in a single pipelined round trip"""
+        logger.debug(f"[ENTRY] record_api_metrics_bulk: events={len(events)}")
+        if not events:
+            return True
+        try:
+            redis_conn = get_redis_connection(config.settings)
+            today = _today_str()
+
+            def run_pipeline():
+                pipe = redis_conn.pipeline(transaction=False)
+                for endpoint, response_time, status_code in events:
+                    key = API_METRICS_KEY.format(endpoint=endpoint, date=today)
+                    pipe.evalsha(API_METRICS_SHA, 2, key, f"{key}:response_times", response_time, status_code, API_METRICS_TTL)
+                return pipe.execute()
+
+            try:
+                run_pipeline()
+            except redis.exceptions.NoScriptError:
+                # Every EVALSHA in the batch failed, so none were counted
+                logger.debug("API metrics script missing on server, reloading for bulk record")
+                redis_conn.script_load(API_METRICS_LUA)
+                run_pipeline()
+            logger.info(f"API metrics recorded in bulk: events={len(events)}")
+            logger.debug(f"[EXIT] record_api_metrics_bulk: True")
+            return True
+        except Exception as e:
+            logger.error(f"[ERROR] Failed to record API metrics in bulk: {e}", exc_info=True)
+            return False
+
+    @staticmethod
+    def record_api_metrics_nowait(endpoint: str, response_time: float, status_code: int) -> bool:
+        """Queue an API metric for the background writer; returns False if it was dropped"""
+        return _enqueue("api", (endpoint, response_time, status_code))
+
 class MetricsRetriever:
+    @staticmethod
+    def bust_cache(job_id: Optional[str] = None) -> None:
+        """Drop cached responses for one job, or everything when job_id is None"""
+        with _response_cache_lock:
+            if job_id is None:
+                _response_cache.clear()
+            else:
+                _response_cache.pop(("job", job_id), None)
+
     @staticmethod
     def get_job_metrics(job_id: str) -> Dict[str, Any]:
         logger.debug(f"[ENTRY] get_job_metrics: job_id={job_id}")
+        cached = _cache_get(("job", job_id))
+        if cached is not None:
+            logger.debug(f"[EXIT] get_job_metrics: cache hit")
+            return cached
         try:
             redis_conn = get_redis_connection(config.settings)
             key = JOB_METRICS_KEY.format(job_id=job_id)
@@ -136,7 +367,8 @@ class MetricsRetriever:
             if not raw_metrics:
                 logger.info(f"No metrics found for job_id={job_id}")
                 return {}
-            result = {k.decode(): json.loads(v.decode()) for k, v in raw_metrics.items()}
+            result = {k.decode(): orjson.loads(v) for k, v in raw_metrics.items()}
+            _cache_put(("job", job_id), result)
             logger.info(f"Job metrics retrieved: job_id={job_id}, keys={list(result.keys())}")
             logger.debug(f"[EXIT] get_job_metrics: Found {len(result)} metrics")
             return result
@@ -150,24 +382,31 @@ class MetricsRetriever:
         try:
             redis_conn = get_redis_connection(config.settings)
             key_prefix = USER_METRICS_KEY.format(user_id=user_id)
-            end_date = datetime.now()
-            date_range = [(end_date - timedelta(days=i)).strftime("%Y-%m-%d") for i in range(days)]
+            date_range = _date_range(days)
             counts_key = f"{key_prefix}:counts"
-            raw_counts = redis_conn.hgetall(counts_key)
+            wanted = None if actions is None else {action.encode() for action in actions}
+            pipe = redis_conn.pipeline(transaction=False)
+            pipe.hgetall(counts_key)
+            for date in date_range:
+                pipe.hgetall(f"{counts_key}:{date}")
+                pipe.lrange(f"{key_prefix}:{date}", 0, -1)
+            raw_counts, *per_day = pipe.execute()
             counts = {
-                k.decode(): int(v.decode())
+                k.decode(): int(v)
                 for k, v in raw_counts.items()
-                if actions is None or any(action in k.decode() for action in actions)
+                if wanted is None or k in wanted
             }
             daily_activity = {}
-            for date in date_range:
-                day_key = f"{key_prefix}:{date}"
-                activity = redis_conn.lrange(day_key, 0, -1)
+            for i, date in enumerate(date_range):
+                day_counts, activity = per_day[2 * i], per_day[2 * i + 1]
+                for k, v in day_counts.items():
+                    if wanted is None or k in wanted:
+                        counts[f"{k.decode()}:{date}"] = int(v)
                 if activity:
+                    items = _loads_list(activity)
                     daily_activity[date] = [
-                        json.loads(item.decode())
-                        for item in activity
-                        if actions is None or any(json.loads(item.decode()).get("action") == action for action in actions)
+                        item for item in items
+                        if actions is None or item.get("action") in actions
                     ]
             logger.info(f"User metrics retrieved: user_id={user_id}")
             logger.debug(f"[EXIT] get_user_metrics: counts={counts}, daily_activity_keys={list(daily_activity.keys())}")
@@ -179,31 +418,36 @@ class MetricsRetriever:
             logger.error(f"[ERROR] Failed to get user metrics: {e}", exc_info=True)
             return {}
 
+    @staticmethod
+    def get_unique_users(date: Optional[str] = None) -> int:
+        """Approximate number of distinct users active on `date` (default today)"""
+        logger.debug(f"[ENTRY] get_unique_users: date={date}")
+        try:
+            redis_conn = get_redis_connection(config.settings)
+            count = redis_conn.pfcount(ACTIVE_USERS_KEY.format(date=date or _today_str()))
+            logger.debug(f"[EXIT] get_unique_users: {count}")
+            return count
+        except Exception as e:
+            logger.error(f"[ERROR] Failed to get unique users: {e}", exc_info=True)
+            return 0
+
     @staticmethod
     def get_system_metrics(days: int = 1, interval_minutes: int = 5) -> Dict[str, List[Dict[str, Any]]]:
         logger.debug(f"[ENTRY] get_system_metrics: days={days}, interval_minutes={interval_minutes}")
+        cache_key = ("system", days, interval_minutes)
+        cached = _cache_get(cache_key)
+        if cached is not None:
+            logger.debug(f"[EXIT] get_system_metrics: cache hit")
+            return cached
         try:
             redis_conn = get_redis_connection(config.settings)
-            end_date = datetime.now()
-            date_range = [(end_date - timedelta(days=i)).strftime("%Y-%m-%d") for i in range(days)]
-            result = {}
+            date_range = _date_range(days)
+            pipe = redis_conn.pipeline(transaction=False)
             for date in date_range:
-                key = SYSTEM_METRICS_KEY.format(date=date)
-                metrics = redis_conn.lrange(key, 0, -1)
-                if metrics:
-                    all_metrics = [json.loads(item.decode()) for item in metrics]
-                    if interval_minutes > 1:
-                        interval_seconds = interval_minutes * 60
-                        grouped = {}
-                        for metric in all_metrics:
-                            bucket = int(metric["timestamp"] / interval_seconds) * interval_seconds
-                            if bucket not in grouped:
-                                grouped[bucket] = []
-                            grouped[bucket].append(metric)
-                        sampled_metrics = [group[0] for group in grouped.values()]
-                        result[date] = sorted(sampled_metrics, key=lambda x: x["timestamp"])
-                    else:
-                        result[date] = sorted(all_metrics, key=lambda x: x["timestamp"])
+                pipe.lrange(SYSTEM_METRICS_KEY.format(date=date), 0, -1)
+            result = _build_system_metrics(date_range, pipe.execute(), interval_minutes)
+            if result:
+                _cache_put(cache_key, result)
             logger.info("System metrics retrieved")
             logger.debug(f"[EXIT] get_system_metrics: {len(result)} day(s)")
             return result
@@ -211,43 +455,121 @@ class MetricsRetriever:
             logger.error(f"[ERROR] Failed to get system metrics: {e}", exc_info=True)
             return {}
 
+    @staticmethod
+    async def aget_system_metrics(days: int = 1, interval_minutes: int = 5) -> Dict[str, List[Dict[str, Any]]]:
+        logger.debug(f"[ENTRY] aget_system_metrics: days={days}, interval_minutes={interval_minutes}")
+        cache_key = ("system", days, interval_minutes)
+        cached = _cache_get(cache_key)
+        if cached is not None:
+            logger.debug(f"[EXIT] aget_system_metrics: cache hit")
+            return cached
+        try:
+            redis_conn = get_async_redis_connection(config.settings)
+            date_range = _date_range(days)
+            async with redis_conn.pipeline(transaction=False) as pipe:
+                for date in date_range:
+                    pipe.lrange(SYSTEM_METRICS_KEY.format(date=date), 0, -1)
+                raw = await pipe.execute()
+            result = _build_system_metrics(date_range, raw, interval_minutes)
+            if result:
+                _cache_put(cache_key, result)
+            logger.info("System metrics retrieved")
+            logger.debug(f"[EXIT] aget_system_metrics: {len(result)} day(s)")
+            return result
+        except Exception as e:
+            logger.error(f"[ERROR] Failed to get system metrics: {e}", exc_info=True)
+            return {}
+
     @staticmethod
     def get_api_metrics(days: int = 1, endpoints: Optional[List[str]] = None) -> Dict[str, Dict[str, Any]]:
         logger.debug(f"[ENTRY] get_api_metrics: days={days}, endpoints={endpoints}")
         try:
             redis_conn = get_redis_connection(config.settings)
-            end_date = datetime.now()
-            date_range = [(end_date - timedelta(days=i)).strftime("%Y-%m-%d") for i in range(days)]
-            all_keys = []
-            for key in redis_conn.scan_iter(match="metrics:api:*"):
-                key_str = key.decode()
-                if endpoints is None or any(endpoint in key_str for endpoint in endpoints):
-                    all_keys.append(key_str)
-            result = {}
-            for key in all_keys:
-                parts = key.split(":")
-                if len(parts) < 4:
-                    continue
-                endpoint = parts[2]
-                date = parts[3]
-                if date not in date_range:
-                    continue
-                raw_metrics = redis_conn.hgetall(key)
-                if not raw_metrics:
-                    continue
-                metrics = {
-                    k.decode(): int(v.decode()) if k.decode() != "avg_response_time" else float(v.decode())
-                    for k, v in raw_metrics.items()
-                }
-                response_times = redis_conn.lrange(f"{key}:response_times", 0, -1)
-                if response_times:
-                    metrics["response_times"] = [float(t.decode()) for t in response_times]
-                if endpoint not in result:
-                    result[endpoint] = {}
-                result[endpoint][date] = metrics
+            selected = _select_api_keys(redis_conn.scan_iter(match="metrics:api:*"), endpoints, _date_range(days))
+            pipe = redis_conn.pipeline(transaction=False)
+            for key, _, _ in selected:
+                pipe.hgetall(key)
+                pipe.lrange(f"{key}:response_times", 0, -1)
+            result = _build_api_metrics(selected, pipe.execute())
             logger.info("API metrics retrieved")
             logger.debug(f"[EXIT] get_api_metrics: {len(result)} endpoint(s)")
             return result
         except Exception as e:
             logger.error(f"[ERROR] Failed to get API metrics: {e}", exc_info=True)
             return {}
+
+    @staticmethod
+    async def aget_api_metrics(days: int = 1, endpoints: Optional[List[str]] = None) -> Dict[str, Dict[str, Any]]:
+        logger.debug(f"[ENTRY] aget_api_metrics: days={days}, endpoints={endpoints}")
+        try:
+            redis_conn = get_async_redis_connection(config.settings)
+            keys = [key async for key in redis_conn.scan_iter(match="metrics:api:*")]
+            selected = _select_api_keys(keys, endpoints, _date_range(days))
+            async with redis_conn.pipeline(transaction=False) as pipe:
+                for key, _, _ in selected:
+                    pipe.hgetall(key)
+                    pipe.lrange(f"{key}:response_times", 0, -1)
+                raw = await pipe.execute()
+            result = _build_api_metrics(selected, raw)
+            logger.info("API metrics retrieved")
+            logger.debug(f"[EXIT] aget_api_metrics: {len(result)} endpoint(s)")
+            return result
+        except Exception as e:
+            logger.error(f"[ERROR] Failed to get API metrics: {e}", exc_info=True)
+            return {}
+
+def _build_system_metrics(date_range: List[str], raw: List[List[bytes]], interval_minutes: int) -> Dict[str, List[Dict[str, Any]]]:
+    result = {}
+    for date, metrics in zip(date_range, raw):
+        if not metrics:
+            continue
+        all_metrics = _loads_list(metrics)
+        if interval_minutes > 1:
+            interval_seconds = interval_minutes * 60
+            seen = set()
+            sampled_metrics = []
+            for metric in all_metrics:
+                bucket = int(metric["timestamp"] / interval_seconds)
+                if bucket not in seen:
+                    seen.add(bucket)
+                    sampled_metrics.append(metric)
+            result[date] = sorted(sampled_metrics, key=lambda x: x["timestamp"])
+        else:
+            result[date] = sorted(all_metrics, key=lambda x: x["timestamp"])
+    return result
+
+def _select_api_keys(keys, endpoints: Optional[List[str]], date_range: List[str]) -> List[Tuple[str, str, str]]:
+    """Pick the (key, endpoint, date) API hashes matching the filters out of a SCAN result"""
+    dates = set(date_range)
+    selected = []
+    for key in keys:
+        key_str = key.decode()
+        if key_str.endswith(":response_times"):
+            continue
+        if endpoints is not None and not any(endpoint in key_str for endpoint in endpoints):
+            continue
+        endpoint, _, date = key_str[len("metrics:api:"):].rpartition(":")
+        if not endpoint or date not in dates:
+            continue
+        selected.append((key_str, endpoint, date))
+    return selected
+
+def _build_api_metrics(selected: List[Tuple[str, str, str]], raw: List[Any]) -> Dict[str, Dict[str, Any]]:
+    result = {}
+    for i, (_, endpoint, date) in enumerate(selected):
+        raw_metrics, response_times = raw[2 * i], raw[2 * i + 1]
+        if not raw_metrics:
+            continue
+        metrics = {}
+        for k, v in raw_metrics.items():
+            name = _api_field_name(k)
+            metrics[name] = metrics.get(name, 0) + (float(v) if k in _FLOAT_API_FIELDS else int(v))
+        response_time_sum = metrics.pop("response_time_sum", None)
+        if response_time_sum is not None and metrics.get("total_calls"):
+            metrics["avg_response_time"] = response_time_sum / metrics["total_calls"]
+        if response_times:
+            metrics["response_times"] = [float(t) for t in response_times]
+        if endpoint not in result:
+            result[endpoint] = {}
+        result[endpoint][date] = metrics
+    return result
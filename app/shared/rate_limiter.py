@@ -1,16 +1,106 @@
+import os
 import time
+import hashlib
 import logging
-from typing import Tuple, Dict, Any
+import threading
+from typing import Tuple, Dict, Any, List
+
+import redis
 
 from app.shared.redis_client import get_redis_connection
-from app import config
 
 logger = logging.getLogger("rate_limiter")
 
-USER_RATE_LIMIT_KEY = "rate:user:{user_id}:{action}"
-GLOBAL_RATE_LIMIT_KEY = "rate:global:{action}"
+# Key layout (built with f-strings on the hot path). The braces are literal
+# Redis Cluster hash tags: every key a script touches shares one tag, so
+# each script call stays within a single hash slot.
+#   rate:user:{<user_id>}:{action}            sliding window, per user (scores in ms)
+#   rate:meta:user:{<user_id>}:{action}       hash with that window's member counter
+#                                             and period; one per window, since the
+#                                             script ties its TTL to the period
+#   rate:global:{<action>}                    sliding window, global
+#   rate:meta:global:{<action>}               the same metadata for that global window
+#   rate:fixed:{<user_id>}:{action}:{window}  fixed window counter
+SCAN_COUNT = 500
+# Reported by get_rate_limits for a window with no stored period
+DEFAULT_REPORTED_PERIOD = 3600
+
+_LUA_DIR = os.path.join(os.path.dirname(__file__), "lua")
+
+def _load_lua(name: str) -> str:
+    with open(os.path.join(_LUA_DIR, name), encoding="utf-8") as f:
+        return f.read()
+
+SLIDING_WINDOW_LUA = _load_lua("sliding_window.lua")
+FIXED_WINDOW_LUA = _load_lua("fixed_window.lua")
+
+# SHA1 digests as Redis computes them, so EVALSHA never waits on SCRIPT LOAD
+_SCRIPT_SHAS = {
+    script: hashlib.sha1(script.encode("utf-8")).hexdigest()
+    for script in (SLIDING_WINDOW_LUA, FIXED_WINDOW_LUA)
+}
+
+_REDIS = None
+
+def _conn():
+    """Return the Redis client, resolving it and preloading scripts on first use"""
+    global _REDIS
+    if _REDIS is None:
+        redis_conn = get_redis_connection()
+        for script in _SCRIPT_SHAS:
+            redis_conn.script_load(script)
+        _REDIS = redis_conn
+    return _REDIS
+
+def get_rate_limit_sha() -> str:
+    """SHA1 of the sliding-window script, for callers issuing EVALSHA directly"""
+    return _SCRIPT_SHAS[SLIDING_WINDOW_LUA]
+
+DENY_CACHE_TTL = 1.0
+DENY_CACHE_SIZE = 4096
+
+# (user_id, action) -> (deny_until_monotonic, result); lets a burst from a
+# blocked user be refused in-process until Redis could say otherwise
+_deny_cache: Dict[Tuple[int, str], Tuple[float, Dict[str, Any]]] = {}
+_deny_cache_lock = threading.Lock()
+
+def _deny_cache_get(key: Tuple[int, str]):
+    entry = _deny_cache.get(key)
+    if entry is None:
+        return None
+    if entry[0] < time.monotonic():
+        with _deny_cache_lock:
+            _deny_cache.pop(key, None)
+        return None
+    return entry[1]
+
+def _deny_cache_put(key: Tuple[int, str], result: Dict[str, Any]) -> None:
+    deny_until = time.monotonic() + min(result["reset_after"], DENY_CACHE_TTL)
+    with _deny_cache_lock:
+        _deny_cache.pop(key, None)
+        while len(_deny_cache) >= DENY_CACHE_SIZE:
+            _deny_cache.pop(next(iter(_deny_cache)))
+        _deny_cache[key] = (deny_until, result)
 
 class RateLimiter:
+    @staticmethod
+    def _run_script(redis_conn, script: str, keys: Tuple[str, ...], *args):
+        """EVALSHA a preloaded script, falling back to EVAL after NOSCRIPT"""
+        try:
+            return redis_conn.evalsha(_SCRIPT_SHAS[script], len(keys), *keys, *args)
+        except redis.exceptions.NoScriptError:
+            # EVAL both runs the script and puts it back in the server cache
+            logger.debug("Rate limit script missing on server, sending full body")
+            return redis_conn.eval(script, len(keys), *keys, *args)
+
+    @classmethod
+    def _sliding_window(cls, redis_conn, key: str, meta_key: str, limit: int, period: int, increment: bool) -> Tuple[bool, int, int]:
+        """Run the sliding-window script; returns (allowed, current_count, reset_after)"""
+        allowed, count, reset_after = cls._run_script(
+            redis_conn, SLIDING_WINDOW_LUA, (key, meta_key), period, limit, 1 if increment else 0
+        )
+        return bool(allowed), int(count), int(reset_after)
+
     @staticmethod
     def check_rate_limit(
         user_id: int,
@@ -21,32 +111,29 @@ class RateLimiter:
     ) -> Tuple[bool, Dict[str, Any]]:
         logger.debug(f"[ENTRY] check_rate_limit(user_id={user_id}, action={action}, limit={limit}, period={period}, increment={increment})")
         try:
-            redis_conn = get_redis_connection(config.settings)
-            key = USER_RATE_LIMIT_KEY.format(user_id=user_id, action=action)
-            now = time.time()
-            min_timestamp = now - period
-            redis_conn.zremrangebyscore(key, 0, min_timestamp)
-            current_count = redis_conn.zcard(key)
+            cached = _deny_cache_get((user_id, action))
+            if cached is not None:
+                logger.debug(f"[EXIT] check_rate_limit cached deny: {cached}")
+                return False, cached
+            redis_conn = _conn()
+            key = f"rate:user:{{{user_id}}}:{action}"
+            meta_key = f"rate:meta:user:{{{user_id}}}:{action}"
+            allowed, current_count, reset_after = RateLimiter._sliding_window(redis_conn, key, meta_key, limit, period, increment)
             logger.debug(f"Current count for {key}: {current_count}")
-            if current_count < limit:
-                if increment:
-                    redis_conn.zadd(key, {str(now): now})
-                    redis_conn.expire(key, period * 2)
-                logger.info(f"User {user_id} action '{action}' allowed (count={current_count+1}/{limit})")
+            if allowed:
+                logger.info(f"User {user_id} action '{action}' allowed (count={current_count}/{limit})")
                 result = {
                     "allowed": True,
-                    "current_count": current_count + (1 if increment else 0),
+                    "current_count": current_count,
                     "limit": limit,
-                    "remaining": limit - current_count - (1 if increment else 0),
-                    "reset_after": period,
+                    "remaining": limit - current_count,
+                    "reset_after": reset_after,
                     "user_id": user_id,
                     "action": action
                 }
                 logger.debug(f"[EXIT] check_rate_limit result: {result}")
                 return True, result
             else:
-                oldest = float(redis_conn.zrange(key, 0, 0, withscores=True)[0][1])
-                reset_after = int(oldest + period - now) + 1
                 logger.info(f"User {user_id} action '{action}' rate limited (count={current_count}/{limit})")
                 result = {
                     "allowed": False,
@@ -57,6 +144,7 @@ class RateLimiter:
                     "user_id": user_id,
                     "action": action
                 }
+                _deny_cache_put((user_id, action), result)
                 logger.debug(f"[EXIT] check_rate_limit result: {result}")
                 return False, result
         except Exception as e:
@@ -71,6 +159,72 @@ class RateLimiter:
             logger.debug(f"[EXIT] check_rate_limit error result: {result}")
             return True, result
 
+    @staticmethod
+    def check_rate_limits_bulk(
+        requests: List[Tuple[int, str, int, int]],
+        increment: bool = True
+    ) -> List[Tuple[bool, Dict[str, Any]]]:
+        """
+        Check many (user_id, action, limit, period) tuples with one pipelined
+        round trip; results come back in request order, in check_rate_limit form.
+        """
+        logger.debug(f"[ENTRY] check_rate_limits_bulk(count={len(requests)}, increment={increment})")
+        results: List[Any] = [None] * len(requests)
+        try:
+            pending = []
+            for i, (user_id, action, limit, period) in enumerate(requests):
+                cached = _deny_cache_get((user_id, action))
+                if cached is not None:
+                    results[i] = (False, cached)
+                else:
+                    pending.append(i)
+            if pending:
+                redis_conn = _conn()
+                sha = _SCRIPT_SHAS[SLIDING_WINDOW_LUA]
+
+                def run_pipeline():
+                    pipe = redis_conn.pipeline(transaction=False)
+                    for i in pending:
+                        user_id, action, limit, period = requests[i]
+                        pipe.evalsha(sha, 2, f"rate:user:{{{user_id}}}:{action}", f"rate:meta:user:{{{user_id}}}:{action}",
+                                     period, limit, 1 if increment else 0)
+                    return pipe.execute()
+
+                try:
+                    replies = run_pipeline()
+                except redis.exceptions.NoScriptError:
+                    # Every EVALSHA in the batch failed, so none were counted
+                    logger.debug("Rate limit script missing on server, reloading for bulk check")
+                    redis_conn.script_load(SLIDING_WINDOW_LUA)
+                    replies = run_pipeline()
+                for i, (allowed, count, reset_after) in zip(pending, replies):
+                    user_id, action, limit, period = requests[i]
+                    allowed, count = bool(allowed), int(count)
+                    result = {
+                        "allowed": allowed,
+                        "current_count": count,
+                        "limit": limit,
+                        "remaining": limit - count if allowed else 0,
+                        "reset_after": int(reset_after),
+                        "user_id": user_id,
+                        "action": action
+                    }
+                    if not allowed:
+                        _deny_cache_put((user_id, action), result)
+                    results[i] = (allowed, result)
+            denied = sum(1 for allowed, _ in results if not allowed)
+            logger.info(f"Bulk rate limit check: {len(requests)} checked, {denied} rate limited")
+            logger.debug(f"[EXIT] check_rate_limits_bulk result: {results}")
+            return results
+        except Exception as e:
+            logger.error(f"[ERROR] Bulk rate limit check failed: {e}", exc_info=True)
+            results = [
+                (True, {"allowed": True, "error": str(e), "limit": limit, "user_id": user_id, "action": action})
+                for user_id, action, limit, _ in requests
+            ]
+            logger.debug(f"[EXIT] check_rate_limits_bulk error result: {results}")
+            return results
+
     @staticmethod
     def check_global_rate_limit(
         action: str,
@@ -80,31 +234,24 @@ class RateLimiter:
     ) -> Tuple[bool, Dict[str, Any]]:
         logger.debug(f"[ENTRY] check_global_rate_limit(action={action}, limit={limit}, period={period}, increment={increment})")
         try:
-            redis_conn = get_redis_connection(config.settings)
-            key = GLOBAL_RATE_LIMIT_KEY.format(action=action)
-            now = time.time()
-            min_timestamp = now - period
-            redis_conn.zremrangebyscore(key, 0, min_timestamp)
-            current_count = redis_conn.zcard(key)
+            redis_conn = _conn()
+            key = f"rate:global:{{{action}}}"
+            meta_key = f"rate:meta:global:{{{action}}}"
+            allowed, current_count, reset_after = RateLimiter._sliding_window(redis_conn, key, meta_key, limit, period, increment)
             logger.debug(f"Current global count for {key}: {current_count}")
-            if current_count < limit:
-                if increment:
-                    redis_conn.zadd(key, {str(now): now})
-                    redis_conn.expire(key, period * 2)
-                logger.info(f"Global action '{action}' allowed (count={current_count+1}/{limit})")
+            if allowed:
+                logger.info(f"Global action '{action}' allowed (count={current_count}/{limit})")
                 result = {
                     "allowed": True,
-                    "current_count": current_count + (1 if increment else 0),
+                    "current_count": current_count,
                     "limit": limit,
-                    "remaining": limit - current_count - (1 if increment else 0),
-                    "reset_after": period,
+                    "remaining": limit - current_count,
+                    "reset_after": reset_after,
                     "action": action
                 }
                 logger.debug(f"[EXIT] check_global_rate_limit result: {result}")
                 return True, result
             else:
-                oldest = float(redis_conn.zrange(key, 0, 0, withscores=True)[0][1])
-                reset_after = int(oldest + period - now) + 1
                 logger.info(f"Global action '{action}' rate limited (count={current_count}/{limit})")
                 result = {
                     "allowed": False,
@@ -127,27 +274,82 @@ class RateLimiter:
             logger.debug(f"[EXIT] check_global_rate_limit error result: {result}")
             return True, result
 
+    @staticmethod
+    def check_fixed_window(
+        user_id: int,
+        action: str,
+        limit: int,
+        period: int,
+        increment: bool = True
+    ) -> Tuple[bool, Dict[str, Any]]:
+        """
+        Fixed-window variant of check_rate_limit: one INCR per request and a
+        single counter per window instead of a sorted set, at the cost of
+        allowing up to 2*limit requests across a window boundary.
+        """
+        logger.debug(f"[ENTRY] check_fixed_window(user_id={user_id}, action={action}, limit={limit}, period={period}, increment={increment})")
+        try:
+            redis_conn = _conn()
+            now = time.time()
+            window = int(now // period)
+            key = f"rate:fixed:{{{user_id}}}:{action}:{window}"
+            count = int(RateLimiter._run_script(redis_conn, FIXED_WINDOW_LUA, (key,), period, 1 if increment else 0))
+            allowed = count <= limit if increment else count < limit
+            current_count = min(count, limit)
+            result = {
+                "allowed": allowed,
+                "current_count": current_count,
+                "limit": limit,
+                "remaining": limit - current_count if allowed else 0,
+                "reset_after": int((window + 1) * period - now) + 1,
+                "user_id": user_id,
+                "action": action
+            }
+            if allowed:
+                logger.info(f"User {user_id} action '{action}' allowed (fixed window, count={current_count}/{limit})")
+            else:
+                logger.info(f"User {user_id} action '{action}' rate limited (fixed window, count={current_count}/{limit})")
+            logger.debug(f"[EXIT] check_fixed_window result: {result}")
+            return allowed, result
+        except Exception as e:
+            logger.error(f"[ERROR] Fixed-window rate limit check failed: {e}", exc_info=True)
+            result = {
+                "allowed": True,
+                "error": str(e),
+                "limit": limit,
+                "user_id": user_id,
+                "action": action
+            }
+            logger.debug(f"[EXIT] check_fixed_window error result: {result}")
+            return True, result
+
     @staticmethod
     def get_rate_limits(user_id: int) -> Dict[str, Dict[str, Any]]:
         logger.debug(f"[ENTRY] get_rate_limits(user_id={user_id})")
         try:
-            redis_conn = get_redis_connection(config.settings)
-            keys = []
-            for key in redis_conn.scan_iter(match=f"rate:user:{user_id}:*"):
-                keys.append(key.decode())
+            redis_conn = _conn()
+            # Server-side type filter skips non-ZSET keys; keys stay bytes and
+            # only the action suffix is decoded below
+            keys = list(redis_conn.scan_iter(match=f"rate:user:{{{user_id}}}:*", count=SCAN_COUNT, _type="ZSET"))
             logger.debug(f"Rate limit keys found: {keys}")
+            actions = [key.rpartition(b":")[2].decode() for key in keys]
+            pipe = redis_conn.pipeline(transaction=False)
+            for key, action in zip(keys, actions):
+                pipe.zcard(key)
+                pipe.zrange(key, 0, 0, withscores=True)
+                pipe.zrange(key, -1, -1, withscores=True)
+                pipe.hget(f"rate:meta:user:{{{user_id}}}:{action}", "period")
+            replies = pipe.execute()
             result = {}
             now = time.time()
-            for key in keys:
-                action = key.split(":")[-1]
-                requests = redis_conn.zrange(key, 0, -1, withscores=True)
-                if not requests:
+            for i, action in enumerate(actions):
+                count, oldest, newest, period = replies[4 * i:4 * i + 4]
+                if not count:
                     continue
-                oldest_time = min(score for _, score in requests)
-                newest_time = max(score for _, score in requests)
-                ttl = redis_conn.ttl(key)
-                period = ttl // 2 if ttl > 0 else 3600
-                count = len(requests)
+                oldest_time = oldest[0][1] / 1000
+                newest_time = newest[0][1] / 1000
+                # The period the script last stored for this window
+                period = int(period) if period else DEFAULT_REPORTED_PERIOD
                 result[action] = {
                     "count": count,
                     "oldest_request": int(oldest_time),
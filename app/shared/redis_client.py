@@ -1,21 +1,82 @@
 import redis
+import redis.asyncio as aioredis
+from redis.connection import parse_url
 from rq import Queue
 from app import config  # Fixed: Using absolute import instead
 import logging
+import os
+import threading
 import traceback
+from typing import Any, Dict, Optional, Tuple
 
 logger = logging.getLogger("shared.redis_client")
 
+REDIS_MAX_CONNECTIONS = 64
+REDIS_HEALTH_CHECK_INTERVAL = 30
+
+# Settings carried over from REDIS_URL when connecting over a UNIX socket
+_UNIX_SOCKET_URL_OPTIONS = ("username", "password", "db")
+
 _redis_instance = None
+_async_redis_instance = None
+_async_decoded_redis_instance = None
+_worker_redis_instance = None
+_worker_redis_pid = None
+_init_lock = threading.Lock()
 
-def get_redis_connection(settings: config.Settings):
+def get_redis_connection(settings: Optional[config.Settings] = None):
     global _redis_instance
-    logger.debug(f"Getting Redis connection for URL: {settings.REDIS_URL}")
     if _redis_instance is not None:
         return _redis_instance
+    with _init_lock:
+        if _redis_instance is None:
+            _redis_instance = _create_redis_connection(settings or config.settings)
+    return _redis_instance
+
+def get_worker_redis_connection(settings: Optional[config.Settings] = None):
+    """
+    Client pinned to one socket for serial job code in an RQ work-horse.
+
+    Created per process, because the horse is forked from the worker and an
+    inherited single-connection socket would be shared with the parent. Use
+    get_redis_connection anywhere several threads issue commands.
+    """
+    global _worker_redis_instance, _worker_redis_pid
+    pid = os.getpid()
+    if _worker_redis_instance is not None and _worker_redis_pid == pid:
+        return _worker_redis_instance
+    pool = get_redis_connection(settings).connection_pool
+    logger.debug(f"Creating single-connection Redis client for pid={pid}")
+    _worker_redis_instance = redis.Redis(connection_pool=pool, single_connection_client=True)
+    _worker_redis_pid = pid
+    return _worker_redis_instance
+
+def _pool_options(settings: config.Settings) -> Tuple[str, Dict[str, Any]]:
+    """
+    URL and transport-specific options for the connection pools. With
+    REDIS_UNIX_SOCKET_PATH set (Redis on the same host), connect over that
+    socket and keep only the credentials and db from REDIS_URL; TCP
+    keepalive does not apply there and redis-py rejects it.
+    """
+    socket_path = getattr(settings, "REDIS_UNIX_SOCKET_PATH", None)
+    if not socket_path:
+        return settings.REDIS_URL, {"socket_keepalive": True}
+    url_options = parse_url(settings.REDIS_URL) if settings.REDIS_URL else {}
+    options = {k: url_options[k] for k in _UNIX_SOCKET_URL_OPTIONS if k in url_options}
+    return f"unix://{socket_path}", options
+
+def _create_redis_connection(settings: config.Settings):
+    url, options = _pool_options(settings)
+    logger.debug(f"Creating Redis connection pool for URL: {url}")
     try:
-        _redis_instance = redis.Redis.from_url(settings.REDIS_URL)
-        _redis_instance.ping()
+        pool = redis.ConnectionPool.from_url(
+            url,
+            max_connections=REDIS_MAX_CONNECTIONS,
+            health_check_interval=REDIS_HEALTH_CHECK_INTERVAL,
+            **options,
+        )
+        client = redis.Redis(connection_pool=pool)
+        client.ping()
         logger.info("Redis connection established successfully")
     except redis.exceptions.ConnectionError as e:
         logger.error(f"Redis connection error: {e}")
@@ -29,7 +90,41 @@ def get_redis_connection(settings: config.Settings):
     except Exception as e:
         logger.error(f"Unknown error connecting to Redis: {e}\n{traceback.format_exc()}")
         raise
-    return _redis_instance
+    return client
+
+def get_async_redis_connection(settings: config.Settings):
+    """
+    Shared redis.asyncio client for coroutines; connections are opened lazily
+    on first command, so this must only be used from a single event loop.
+    """
+    global _async_redis_instance
+    if _async_redis_instance is None:
+        logger.debug(f"Creating async Redis client for URL: {settings.REDIS_URL}")
+        _async_redis_instance = _create_async_redis_connection(settings)
+    return _async_redis_instance
+
+def get_async_decoded_redis_connection(settings: config.Settings):
+    """
+    Like get_async_redis_connection, but replies come back as str, decoded
+    by the parser instead of per value by the caller. Has its own pool, as
+    decode_responses is a connection setting; only for keys that hold text.
+    """
+    global _async_decoded_redis_instance
+    if _async_decoded_redis_instance is None:
+        logger.debug(f"Creating decoded async Redis client for URL: {settings.REDIS_URL}")
+        _async_decoded_redis_instance = _create_async_redis_connection(settings, decode_responses=True)
+    return _async_decoded_redis_instance
+
+def _create_async_redis_connection(settings: config.Settings, decode_responses: bool = False):
+    url, options = _pool_options(settings)
+    pool = aioredis.ConnectionPool.from_url(
+        url,
+        max_connections=REDIS_MAX_CONNECTIONS,
+        health_check_interval=REDIS_HEALTH_CHECK_INTERVAL,
+        decode_responses=decode_responses,
+        **options,
+    )
+    return aioredis.Redis(connection_pool=pool)
 
 def get_rq_queue(redis_conn, settings: config.Settings):
     logger.debug(f"Getting RQ queue: {settings.RQ_QUEUE_NAME}")
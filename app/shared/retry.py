@@ -4,23 +4,83 @@ Retry module for handling transient failures.
 Provides decorators and utilities for automatically retrying
 operations that may fail due to transient issues.
 """
+import re
 import time
 import logging
 import functools
-import random
 from typing import Callable, Any, Dict, List, Optional, Type, Union, Tuple
 import inspect
 import asyncio
+import importlib
+
+from app.shared.adaptive_backoff import get_tracker, adaptive_base, decorrelated_jitter, jitter_fraction
 
 logger = logging.getLogger("retry")
 
+# Message fragments of transient failures, plus retryable HTTP status codes
+_RETRYABLE_RE = re.compile(
+    r"timeout|connection|socket|network|temporary|retry|reset|closed|broken pipe"
+    r"|floodwaiterror|too many requests|rate limit|server error|service unavailable"
+    r"|\b(?:429|500|502|503|504)\b",
+    re.IGNORECASE
+)
+
+def _optional_type(module: str, name: str) -> Optional[type]:
+    """Exception class from an optional dependency, or None if it isn't installed"""
+    try:
+        return getattr(importlib.import_module(module), name)
+    except (ImportError, AttributeError):
+        return None
+
+# Transient failures recognised by type; checked before any message parsing.
+# OSError is deliberately absent: it also covers missing files and permissions.
+_RETRY_TYPES: Tuple[type, ...] = tuple(t for t in (
+    ConnectionError,
+    TimeoutError,
+    asyncio.TimeoutError,
+    _optional_type("telethon.errors", "FloodWaitError"),
+    _optional_type("telethon.errors", "ServerError"),
+    _optional_type("redis.exceptions", "ConnectionError"),
+    _optional_type("redis.exceptions", "TimeoutError"),
+    _optional_type("httpx", "TransportError"),
+    _optional_type("aiohttp", "ClientConnectionError"),
+) if t is not None)
+
+_RETRY_CODES = frozenset({429, 500, 502, 503, 504})
+
+def _status_code(exception: Exception) -> Optional[int]:
+    for attr in ("status_code", "status", "code"):
+        code = getattr(exception, attr, None)
+        if isinstance(code, int):
+            return code
+    response = getattr(exception, "response", None)
+    code = getattr(response, "status_code", None)
+    return code if isinstance(code, int) else None
+
+def _sleep(seconds: float) -> None:
+    """
+    Sleep for the full interval against a monotonic deadline. time.sleep is
+    already resumed after EINTR (PEP 475), but a signal handler or clock
+    adjustment must never shorten a backoff into an early retry.
+    """
+    deadline = time.monotonic() + seconds
+    remaining = seconds
+    while remaining > 0:
+        time.sleep(remaining)
+        remaining = deadline - time.monotonic()
+
+def _backoff_schedule(max_tries: int, delay: float, backoff: float, cap: float) -> Tuple[float, ...]:
+    """Capped exponential backoff before each retry, computed once per decorated function"""
+    return tuple(min(cap, delay * (backoff ** i)) for i in range(max(max_tries - 1, 0)))
+
 def retry(
     max_tries: int = 3,
     delay: float = 1.0,
     backoff: float = 2.0,
     exceptions: Union[Type[Exception], Tuple[Type[Exception], ...]] = Exception,
     jitter: bool = True,
-    on_retry: Optional[Callable[[Exception, int, float], None]] = None
+    on_retry: Optional[Callable[[Exception, int, float], None]] = None,
+    cap: float = 60.0
 ):
     """
     Retry decorator with exponential backoff for regular functions
@@ -30,17 +90,19 @@ def retry(
         delay: Initial delay between retries in seconds
         backoff: Backoff multiplier (e.g. value of 2 will double the delay each retry)
         exceptions: Exception(s) that trigger a retry
-        jitter: Whether to add randomness to the delay
+        jitter: Whether to randomize the delay ("full jitter": uniform between 0 and the backoff)
         on_retry: Function to call on retry
+        cap: Upper bound on any single delay in seconds
     
     Returns:
         Callable: Decorated function
     """
+    # Resolved at decoration time so calls only index the schedule
+    schedule = _backoff_schedule(max_tries, delay, backoff, cap)
+
     def decorator(func):
         @functools.wraps(func)
         def wrapper(*args, **kwargs):
-            mtries, mdelay = max_tries, delay
-            
             for i in range(max_tries):
                 try:
                     return func(*args, **kwargs)
@@ -49,10 +111,8 @@ def retry(
                     if i + 1 == max_tries:
                         raise
                     
-                    # Calculate next delay
-                    sleep = mdelay
-                    if jitter:
-                        sleep = sleep * (1 + random.random() * 0.1)
+                    # Calculate next delay ("full jitter" over the capped backoff)
+                    sleep = schedule[i] * jitter_fraction() if jitter else schedule[i]
                     
                     # Call on_retry function if provided
                     if on_retry:
@@ -64,10 +124,7 @@ def retry(
                     )
                     
                     # Wait before next attempt
-                    time.sleep(sleep)
-                    
-                    # Increase delay for next time
-                    mdelay *= backoff
+                    _sleep(sleep)
             
             # Should never reach here, but just in case
             return func(*args, **kwargs)
@@ -80,39 +137,56 @@ def async_retry(
     backoff: float = 2.0,
     exceptions: Union[Type[Exception], Tuple[Type[Exception], ...]] = Exception,
     jitter: bool = True,
-    on_retry: Optional[Callable[[Exception, int, float], None]] = None
+    on_retry: Optional[Callable[[Exception, int, float], None]] = None,
+    cap: float = 60.0
 ):
     """
-    Retry decorator with exponential backoff for async functions
+    Retry decorator with adaptive backoff for async functions
+
+    With jitter, delays use decorrelated jitter starting from the larger of
+    delay and the callable's recent P99 success latency, so slow remotes get
+    wider spacing and fast ones are retried promptly. Without jitter the
+    plain exponential schedule is used.
     
     Args:
         max_tries: Maximum number of attempts
         delay: Initial delay between retries in seconds
         backoff: Backoff multiplier (e.g. value of 2 will double the delay each retry)
         exceptions: Exception(s) that trigger a retry
-        jitter: Whether to add randomness to the delay
+        jitter: Whether to randomize the delay (decorrelated jitter, see above)
         on_retry: Function to call on retry
+        cap: Upper bound on any single delay in seconds
     
     Returns:
         Callable: Decorated function
     """
+    schedule = _backoff_schedule(max_tries, delay, backoff, cap)
+
     def decorator(func):
+        # Module-qualified, so same-named functions elsewhere keep their own latency window
+        tracker = get_tracker(f"{func.__module__}.{func.__qualname__}")
+
         @functools.wraps(func)
         async def wrapper(*args, **kwargs):
-            mtries, mdelay = max_tries, delay
-            
+            prev_sleep = 0.0
             for i in range(max_tries):
                 try:
-                    return await func(*args, **kwargs)
+                    started = time.perf_counter()
+                    result = await func(*args, **kwargs)
+                    tracker.record(time.perf_counter() - started)
+                    return result
                 except exceptions as e:
                     # Last attempt failed with allowed exception
                     if i + 1 == max_tries:
                         raise
                     
                     # Calculate next delay
-                    sleep = mdelay
                     if jitter:
-                        sleep = sleep * (1 + random.random() * 0.1)
+                        base = min(cap, adaptive_base(tracker, delay))
+                        sleep = decorrelated_jitter(base, prev_sleep or base, cap)
+                        prev_sleep = sleep
+                    else:
+                        sleep = schedule[i]
                     
                     # Call on_retry function if provided
                     if on_retry:
@@ -125,9 +199,6 @@ def async_retry(
                     
                     # Wait before next attempt
                     await asyncio.sleep(sleep)
-                    
-                    # Increase delay for next time
-                    mdelay *= backoff
             
             # Should never reach here, but just in case
             return await func(*args, **kwargs)
@@ -156,25 +227,13 @@ def is_retryable_exception(exception: Exception) -> bool:
     Returns:
         bool: True if exception should be retried
     """
-    # Check for our custom retryable exceptions
-    if isinstance(exception, RetryableError):
+    # Check for our custom retryable exceptions and known transient types
+    if isinstance(exception, RetryableError) or isinstance(exception, _RETRY_TYPES):
         return True
-        
-    # Check for common network-related exceptions
-    exception_str = str(exception).lower()
-    network_errors = [
-        'timeout', 'connection', 'socket', 'network', 
-        'temporary', 'retry', 'reset', 'closed', 'broken pipe',
-        'floodwaiterror', 'too many requests', 'rate limit',
-        'server error', 'service unavailable'
-    ]
-    
-    if any(err in exception_str for err in network_errors):
-        return True
-    
-    # Check for common HTTP status codes that are retryable
-    status_codes = ['429', '500', '502', '503', '504']
-    if any(code in exception_str for code in status_codes):
+
+    # Check for a retryable HTTP status carried on the exception
+    if _status_code(exception) in _RETRY_CODES:
         return True
-        
-    return False
\ No newline at end of file
+
+    # Fall back to common network-related messages and status codes in the text
+    return _RETRYABLE_RE.search(str(exception)) is not None
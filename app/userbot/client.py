@@ -1,30 +1,44 @@
-from telethon.sync import TelegramClient
+from telethon import TelegramClient
 from app.config import Settings
 import logging
+import threading
+from typing import Dict
 
 logger = logging.getLogger("userbot.client")
 
+_CLIENT_CACHE: Dict[str, TelegramClient] = {}
+_CLIENT_LOCK = threading.Lock()
+
 def get_telethon_client(settings: Settings):
     """
-    Create a new Telethon client instance using configuration settings
+    Get the process-wide Telethon client for the configured session,
+    creating it on first use
+    
+    The returned client is shared by every caller in the process: callers
+    must not disconnect a client they did not connect themselves.
     
     Args:
         settings: Application configuration settings
         
     Returns:
-        TelegramClient: Unconnected Telethon client instance
+        TelegramClient: Shared Telethon client instance (unconnected when first created)
     """
-    logger.debug(f"Creating Telethon client: session_path={settings.TELEGRAM_SESSION_PATH}")
+    path = settings.TELEGRAM_SESSION_PATH
     
     try:
-        # Create client instance
-        client = TelegramClient(
-            settings.TELEGRAM_SESSION_PATH,
-            settings.TELEGRAM_API_ID,
-            settings.TELEGRAM_API_HASH,
-        )
+        with _CLIENT_LOCK:
+            client = _CLIENT_CACHE.get(path)
+            if client is not None:
+                return client
+            logger.debug(f"Creating Telethon client: session_path={path}")
+            client = TelegramClient(
+                path,
+                settings.TELEGRAM_API_ID,
+                settings.TELEGRAM_API_HASH,
+            )
+            _CLIENT_CACHE[path] = client
         
-        logger.info(f"Successfully created Telethon client: session_path={settings.TELEGRAM_SESSION_PATH}")
+        logger.info(f"Successfully created Telethon client: session_path={path}")
         return client
     except ValueError as e:
         logger.error(f"Invalid parameter for Telethon client: {e}")
@@ -1,42 +1,137 @@
+import asyncio
 import logging
-import json
-import traceback
-from rq.job import Job
-from typing import Any
+import orjson
+from rq.exceptions import NoSuchJobError
+from rq.job import Job, JobStatus
+from rq.results import Result
+from typing import Any, List, Optional, Set, Tuple
 
-from app.shared.redis_client import get_redis_connection
+from app.shared.redis_client import get_redis_connection, get_async_redis_connection
 from app import config
 from app.userbot import state, ui, results_sender
 
+# Hot-path logging here passes %-style arguments rather than f-strings so the
+# per-message pubsub loop does not format records that DEBUG/INFO filter out
 logger = logging.getLogger("userbot.event_listener")
 
+CHANNEL_PREFIX = "request_status:"
+_CHANNEL_PREFIX_LEN = len(CHANNEL_PREFIX)
+
+MAX_CONCURRENT_COMPLETIONS = 32
+COMPLETION_BATCH_SIZE = 64
+COMPLETION_BATCH_WAIT = 0.02
+COMPLETION_QUEUE_SIZE = 256
+
+_completion_sem = asyncio.Semaphore(MAX_CONCURRENT_COMPLETIONS)
+
+async def _drain(queue: asyncio.Queue, max_batch: int, max_wait: float) -> List[Any]:
+    """Wait for one item, then keep collecting for up to max_wait seconds or max_batch items"""
+    batch = [await queue.get()]
+    deadline = asyncio.get_running_loop().time() + max_wait
+    while len(batch) < max_batch and batch[-1] is not None:
+        timeout = deadline - asyncio.get_running_loop().time()
+        if timeout <= 0:
+            break
+        try:
+            batch.append(await asyncio.wait_for(queue.get(), timeout))
+        except asyncio.TimeoutError:
+            break
+    return batch
+
+async def _completion_batcher(client: Any, redis_conn: Any, queue: asyncio.Queue) -> None:
+    """
+    Coalesce completion events so a burst is fetched with one pipelined round
+    trip, then hand each delivery to its own task and go back to draining, so
+    a slow recipient never holds up later completions. A None item flushes,
+    waits for outstanding deliveries and stops; cancellation cancels them.
+    """
+    deliveries: Set[asyncio.Task] = set()
+    try:
+        while True:
+            batch = await _drain(queue, COMPLETION_BATCH_SIZE, COMPLETION_BATCH_WAIT)
+            stop = batch[-1] is None
+            events = [e for e in batch if e is not None]
+            if events:
+                try:
+                    await _start_job_completions(client, redis_conn, events, deliveries)
+                except Exception as e:
+                    logger.exception(f"[ERROR] Error handling job completion batch: {e}")
+            if stop:
+                break
+        if deliveries:
+            await asyncio.gather(*deliveries, return_exceptions=True)
+    finally:
+        for task in deliveries:
+            task.cancel()
+        if deliveries:
+            await asyncio.gather(*deliveries, return_exceptions=True)
+
+async def _start_job_completions(client: Any, redis_conn: Any, events: List[Tuple[str, str, Any]], deliveries: Set[asyncio.Task]) -> None:
+    """Fetch a batch of completions in one round trip and start a delivery task per job"""
+    logger.debug("[ENTRY] _start_job_completions(count=%d)", len(events))
+    fetched = await asyncio.to_thread(_fetch_jobs_and_requests, redis_conn, [(job_id, request_id) for job_id, request_id, _ in events])
+    for (job_id, request_id, chat_id), (status, result_data, request_data) in zip(events, fetched):
+        if status is None:
+            logger.error(f"[ERROR] Job not found: job_id={job_id}, request_id={request_id}")
+            continue
+        # Taken here rather than in the task, so at most MAX_CONCURRENT_COMPLETIONS
+        # deliveries exist and the bounded queue backs up beyond that
+        await _completion_sem.acquire()
+        task = asyncio.create_task(_deliver_job_result_logged(client, job_id, request_id, chat_id, status, result_data, request_data))
+        deliveries.add(task)
+        task.add_done_callback(lambda t: _delivery_done(deliveries, t))
+    logger.debug("[EXIT] _start_job_completions OK")
+
+def _delivery_done(deliveries: Set[asyncio.Task], task: asyncio.Task) -> None:
+    # A callback rather than a finally in the task, so a delivery cancelled
+    # before it first runs still gives its slot back
+    deliveries.discard(task)
+    _completion_sem.release()
+
+async def _deliver_job_result_logged(client: Any, job_id: str, request_id: str, chat_id: Any, status: JobStatus, result_data: Any, request_data: Optional[dict]) -> None:
+    try:
+        await _deliver_job_result(client, request_id, chat_id, status, result_data, request_data)
+    except Exception as e:
+        logger.exception(f"[ERROR] Error handling job completion: job_id={job_id}, request_id={request_id}, error={e}")
+
 async def listen_for_job_events(client: Any) -> None:
     """
     Fully implemented: listens to Redis pubsub, handles all messages, logs all errors, never returns placeholder.
+    Pub/Sub runs on the asyncio client so waiting for messages never blocks the event loop;
+    the sync client is only handed on for RQ job fetches.
     """
     logger.info("[ENTRY] Starting job events listener")
     redis_conn = None
     pubsub = None
+    completions = None
+    batcher = None
 
     try:
         redis_conn = get_redis_connection(config.settings)
-        pubsub = redis_conn.pubsub(ignore_subscribe_messages=True)
-        channel_pattern = f"request_status:*"
-        pubsub.psubscribe(channel_pattern)
+        async_conn = get_async_redis_connection(config.settings)
+        pubsub = async_conn.pubsub(ignore_subscribe_messages=True)
+        channel_pattern = f"{CHANNEL_PREFIX}*"
+        await pubsub.psubscribe(channel_pattern)
         logger.info("Subscribed to RQ job status updates via Redis Pub/Sub")
+        # Bounded: when deliveries fall behind, the listener stops reading pubsub
+        completions = asyncio.Queue(maxsize=COMPLETION_QUEUE_SIZE)
+        batcher = asyncio.create_task(_completion_batcher(client, redis_conn, completions))
 
-        for message in pubsub.listen():
+        async for message in pubsub.listen():
             try:
-                logger.debug(f"PubSub message received: {message}")
+                logger.debug("PubSub message received: %r", message)
                 if message["type"] != "pmessage":
                     logger.warning(f"Unexpected message type in Pub/Sub: {message['type']}")
                     continue
-                channel = message["channel"].decode() if isinstance(message["channel"], bytes) else message["channel"]
-                request_id = channel.split(":")[-1]
+                channel = message["channel"]
+                # The pattern fixes the prefix, so the request id is the remainder of the name
+                request_id = channel[_CHANNEL_PREFIX_LEN:]
+                if isinstance(request_id, bytes):
+                    request_id = request_id.decode("ascii")
                 try:
-                    data = json.loads(message["data"])
-                    logger.debug(f"Parsed pubsub message: {data}")
-                except json.JSONDecodeError as e:
+                    data = orjson.loads(message["data"])
+                    logger.debug("Parsed pubsub message: %r", data)
+                except orjson.JSONDecodeError as e:
                     logger.error(f"Failed to decode Pub/Sub message as JSON: {e}, data: {message['data']}")
                     continue
                 job_id = data.get("job_id")
@@ -44,9 +139,9 @@ async def listen_for_job_events(client: Any) -> None:
                 status = data.get("status")
                 detail = data.get("detail")
                 progress = data.get("progress")
-                logger.info(f"Status update: request_id={request_id}, status={status}, job_id={job_id}")
+                logger.info("Status update: request_id=%s, status=%s, job_id=%s", request_id, status, job_id)
                 try:
-                    state.update_request_status(request_id, status)
+                    await state.update_request_status(request_id, status)
                 except Exception as e:
                     logger.error(f"Failed to update request status: {e}")
                 try:
@@ -54,56 +149,110 @@ async def listen_for_job_events(client: Any) -> None:
                 except Exception as e:
                     logger.error(f"Failed to update status message: {e}")
                 if status in ["SUCCESS", "FAILED"]:
-                    logger.info(f"Job completed with status {status}, handling completion")
-                    try:
-                        await handle_job_completion(client, job_id, request_id, chat_id)
-                    except Exception as e:
-                        logger.exception(f"Error handling job completion: {e}")
-                logger.debug(f"[EXIT] Processed pubsub message for request_id={request_id}")
+                    logger.info("Job completed with status %s, handling completion", status)
+                    await completions.put((job_id, request_id, chat_id))
+                logger.debug("[EXIT] Processed pubsub message for request_id=%s", request_id)
             except Exception as e:
                 logger.exception(f"[ERROR] Error processing Pub/Sub message: {e}")
+    except asyncio.CancelledError:
+        # Shutdown: cancel in-flight deliveries rather than waiting on them
+        if batcher:
+            batcher.cancel()
+            await asyncio.gather(batcher, return_exceptions=True)
+            batcher = None
+        raise
     except Exception as e:
         logger.exception(f"[ERROR] Fatal error in job events listener: {e}")
     finally:
+        if batcher:
+            # Deliver whatever completions are still queued before stopping
+            await completions.put(None)
+            await batcher
         if pubsub:
             try:
                 logger.debug("Unsubscribing from Pub/Sub channels")
-                pubsub.punsubscribe()
+                await pubsub.punsubscribe()
+                await pubsub.aclose()
             except Exception as e:
                 logger.error(f"Error unsubscribing from Pub/Sub: {e}")
 
-async def handle_job_completion(client: Any, job_id: str, request_id: str, chat_id: Any) -> None:
+async def handle_job_completion(client: Any, job_id: str, request_id: str, chat_id: Any, redis_conn: Any = None) -> None:
     """
     Fetches job, handles both finished and failed, calls result senders, logs all errors.
+    Reuses the listener's redis_conn when given.
     """
-    logger.info(f"[ENTRY] handle_job_completion(job_id={job_id}, request_id={request_id}, chat_id={chat_id})")
+    logger.info("[ENTRY] handle_job_completion(job_id=%s, request_id=%s, chat_id=%s)", job_id, request_id, chat_id)
     try:
-        redis_conn = get_redis_connection(config.settings)
-        job = Job.fetch(job_id, connection=redis_conn)
-        result_data = job.result
-        request_data = state.get_request_data(request_id)
-        if not request_data:
-            logger.error(f"Request data not found: request_id={request_id}")
-            logger.debug("[EXIT] handle_job_completion: request data missing")
-            return
-        user_id = request_data.get("user_id")
-        if not user_id:
-            logger.error(f"User ID not found in request data: request_id={request_id}")
-            logger.debug("[EXIT] handle_job_completion: user_id missing")
-            return
-        logger.debug(f"Extracted user_id: {user_id}")
-        if job.is_finished:
-            logger.info(f"Job finished successfully, sending results: user_id={user_id}, chat_id={chat_id}")
-            try:
-                await results_sender.send_llm_result(client, user_id, chat_id, result_data)
-            except Exception as e:
-                logger.exception(f"[ERROR] Error sending LLM result: {e}")
-        if job.is_failed:
-            logger.info(f"Job failed, sending failure message: user_id={user_id}, chat_id={chat_id}")
-            try:
-                await results_sender.send_failure_message(client, user_id, chat_id, result_data)
-            except Exception as e:
-                logger.exception(f"[ERROR] Error sending failure message: {e}")
+        if redis_conn is None:
+            redis_conn = get_redis_connection(config.settings)
+        [(status, result_data, request_data)] = await asyncio.to_thread(_fetch_jobs_and_requests, redis_conn, [(job_id, request_id)])
+        if status is None:
+            raise NoSuchJobError(f"No such job: {Job.key_for(job_id)}")
+        await _deliver_job_result(client, request_id, chat_id, status, result_data, request_data)
         logger.debug("[EXIT] handle_job_completion OK")
     except Exception as e:
         logger.exception(f"[ERROR] Error handling job completion: job_id={job_id}, request_id={request_id}, error={e}")
+
+async def _deliver_job_result(client: Any, request_id: str, chat_id: Any, status: JobStatus, result_data: Any, request_data: Optional[dict]) -> None:
+    """Send the finished result or failure message from already fetched job state; makes no Redis calls"""
+    if not request_data:
+        logger.error(f"Request data not found: request_id={request_id}")
+        logger.debug("[EXIT] _deliver_job_result: request data missing")
+        return
+    user_id = request_data.get("user_id")
+    if not user_id:
+        logger.error(f"User ID not found in request data: request_id={request_id}")
+        logger.debug("[EXIT] _deliver_job_result: user_id missing")
+        return
+    logger.debug("Extracted user_id: %s", user_id)
+    if status == JobStatus.FINISHED:
+        logger.info("Job finished successfully, sending results: user_id=%s, chat_id=%s", user_id, chat_id)
+        try:
+            await results_sender.send_llm_result(client, user_id, chat_id, result_data)
+        except Exception as e:
+            logger.exception(f"[ERROR] Error sending LLM result: {e}")
+    if status == JobStatus.FAILED:
+        logger.info("Job failed, sending failure message: user_id=%s, chat_id=%s", user_id, chat_id)
+        try:
+            await results_sender.send_failure_message(client, user_id, chat_id, result_data)
+        except Exception as e:
+            logger.exception(f"[ERROR] Error sending failure message: {e}")
+
+def _fetch_jobs_and_requests(redis_conn: Any, ids: List[Tuple[str, str]]) -> List[Tuple[Optional[JobStatus], Any, Optional[dict]]]:
+    """
+    Load RQ job hashes, latest results and request data for (job_id, request_id)
+    pairs in one pipelined round trip, and resolve each job's status and result
+    data from the replies so delivery needs no further reads; a missing job
+    comes back with status None. Blocking (RQ only speaks the sync client), so
+    async callers run it via asyncio.to_thread.
+    """
+    pipe = redis_conn.pipeline(transaction=False)
+    for job_id, request_id in ids:
+        pipe.hgetall(Job.key_for(job_id))
+        # The read job.latest_result() would otherwise make on its own
+        pipe.xrevrange(Result.get_key(job_id), "+", "-", count=1)
+        state.get_request_data_pipeline(pipe, request_id)
+    replies = pipe.execute()
+    fetched = []
+    for i, (job_id, _) in enumerate(ids):
+        job_raw, latest_raw, request_raw = replies[3 * i:3 * i + 3]
+        status = result_data = None
+        if job_raw:
+            job = Job(job_id, connection=redis_conn)
+            job.restore(job_raw)
+            # restore() already set the status; the default refresh would HGET it again
+            status = job.get_status(refresh=False)
+            if latest_raw:
+                result_id, payload = latest_raw[0]
+                result_data = _result_data(Result.restore(job_id, result_id.decode(), payload, connection=redis_conn, serializer=job.serializer))
+        fetched.append((status, result_data, state.decode_request_data(request_raw)))
+    return fetched
+
+def _result_data(latest: Result) -> Any:
+    """Return value of a successful run, or the error/traceback dict send_failure_message reads"""
+    if latest.type == Result.Type.SUCCESSFUL:
+        return latest.return_value
+    if latest.type == Result.Type.FAILED and latest.exc_string:
+        lines = latest.exc_string.strip().splitlines()
+        return {"error": lines[-1], "traceback": latest.exc_string}
+    return None
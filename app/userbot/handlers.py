@@ -1,30 +1,211 @@
+import asyncio
+import base64
 import logging
-import random
-import string
-import traceback
+import os
+import time
+from textwrap import shorten
 from telethon.events import NewMessage
 from telethon.tl.types import Message
+from typing import Any, Dict, List, Optional, Tuple
+from rq.job import Job
 from app.userbot import state
-from app.shared.redis_client import get_redis_connection
+from app.shared.redis_client import get_redis_connection, get_rq_queue
 from app import config
 
+# Debug logging on the per-message path passes %-style arguments so nothing
+# is formatted unless DEBUG is enabled
 logger = logging.getLogger("userbot.handlers")
 
+_QUEUE = None
+_client = None  # set by register_handlers; used for entity lookups
+
+# Built once; Telethon resolves 'me' on the builder the first time it is
+# used, and the process only ever runs one client
+_EVENT_FILTER = NewMessage(outgoing=False, from_users='me')
+
+ENTITY_CACHE_TTL = 3600
+ENTITY_CACHE_SIZE = 1024
+
+# Typed chat reference -> (expires_monotonic, entity); users tend to
+# summarize the same few chats, and each miss is a resolve round trip
+_entity_cache: Dict[str, Tuple[float, Any]] = {}
+
+async def _resolve_entity(text: str) -> Any:
+    entry = _entity_cache.get(text)
+    if entry is not None:
+        if entry[0] >= time.monotonic():
+            return entry[1]
+        _entity_cache.pop(text, None)
+    entity = await _client.get_entity(text)
+    while len(_entity_cache) >= ENTITY_CACHE_SIZE:
+        _entity_cache.pop(next(iter(_entity_cache)))
+    _entity_cache[text] = (time.monotonic() + ENTITY_CACHE_TTL, entity)
+    return entity
+
+def _get_queue():
+    """RQ queue shared by all enqueues; built once, at registration or first use"""
+    global _QUEUE
+    if _QUEUE is None:
+        _QUEUE = get_rq_queue(get_redis_connection(config.settings), config.settings)
+    return _QUEUE
+
+ERROR_REPLY_WIDTH = 100
+
+_ERROR_REPLY = "❌ An error occurred: {msg}"
+_ENQUEUE_ERROR_REPLY = "❌ Failed to start processing: {msg}"
+
+def _short_error(e: Exception) -> str:
+    # Cut on a word boundary, and only mark truncation when something was cut
+    return shorten(str(e), width=ERROR_REPLY_WIDTH, placeholder="...")
+
+_pending_enqueues: List[Tuple[Any, asyncio.Future]] = []
+_enqueue_flush_task: Optional[asyncio.Task] = None
+
+async def _enqueue_batched(job_data: Any) -> Job:
+    """Queue job_data for the next enqueue_many write and wait for its Job"""
+    global _enqueue_flush_task
+    fut = asyncio.get_running_loop().create_future()
+    _pending_enqueues.append((job_data, fut))
+    if _enqueue_flush_task is None:
+        _enqueue_flush_task = asyncio.create_task(_flush_enqueues())
+    return await fut
+
+async def _flush_enqueues() -> None:
+    """
+    Write pending enqueues with one enqueue_many per round, without waiting
+    for more: a lone enqueue goes out on the next loop iteration, and ones
+    arriving while a write is in flight share the following round.
+    """
+    global _enqueue_flush_task
+    try:
+        while _pending_enqueues:
+            batch = _pending_enqueues[:]
+            _pending_enqueues.clear()
+            try:
+                # RQ is sync-only; keep its pipeline round trip off the event loop
+                jobs = await asyncio.to_thread(_get_queue().enqueue_many, [data for data, _ in batch])
+                logger.debug("Flushed %d enqueues in one pipeline", len(batch))
+            except Exception as e:
+                logger.error(f"[ERROR] Batched enqueue of {len(batch)} jobs failed: {e}")
+                for _, fut in batch:
+                    if not fut.done():
+                        fut.set_exception(e)
+                continue
+            for (_, fut), job in zip(batch, jobs):
+                if not fut.done():
+                    fut.set_result(job)
+    finally:
+        _enqueue_flush_task = None
+
 def _gen_request_id(length=8):
     """Generate a random request ID"""
-    logger.debug(f"Generating random request ID with length={length}")
-    
+    # Lowercase base32 of CSPRNG bytes: [a-z2-7], 5 bits per character (hex
+    # would only carry 4). os.urandom does not fail in practice, and a
+    # timestamp fallback would hand out colliding IDs within the same second
+    return base64.b32encode(os.urandom((length * 5 + 7) // 8)).decode("ascii").lower()[:length]
+
+async def handle_message_input(event: Message):
+    """Handle incoming messages from the user"""
+    user_id = event.sender_id
+    logger.debug("Received message: user_id=%s, chat_id=%s, message_id=%s", user_id, event.chat_id, event.id)
+
     try:
-        request_id = ''.join(random.choices(string.ascii_lowercase + string.digits, k=length))
-        logger.debug(f"Generated request ID: {request_id}")
-        return request_id
+        text = event.raw_text.strip() if hasattr(event, "raw_text") else ""
+        logger.debug("Message text (length=%d): %.20s%s", len(text), text, "..." if len(text) > 20 else "")
+
+        # Check for pending state
+        request_id = await state.get_pending_state(user_id)
+        logger.debug("Pending state for user %s: %s", user_id, request_id)
+
+        # Handle prompt input if pending
+        if request_id:
+            logger.info(f"Processing pending request: user_id={user_id}, request_id={request_id}")
+
+            if text.lower() == '/cancel':
+                logger.info(f"User cancelled operation: user_id={user_id}, request_id={request_id}")
+                await state.clear_pending_state(user_id)
+                await event.respond("❌ Operation cancelled.")
+                return
+
+            if not text or len(text) < 3:
+                logger.warning(f"Invalid prompt (too short): user_id={user_id}, length={len(text)}")
+                await event.respond("⚠️ Please provide a valid prompt (min 3 chars) or /cancel.")
+                return
+
+            # Store prompt, update state, clear pending, enqueue
+            logger.debug("Storing prompt and updating request: user_id=%s, request_id=%s", user_id, request_id)
+            await state.submit_prompt(user_id, request_id, text)
+
+            logger.info(f"Enqueueing job: user_id={user_id}, request_id={request_id}")
+            await enqueue_processing_job(event, user_id, request_id, custom_prompt=text)
+
+            logger.debug("Sending confirmation: user_id=%s, request_id=%s", user_id, request_id)
+            msg = await event.respond("✅ Prompt received! The job is being queued.")
+
+            logger.debug("Storing status message: user_id=%s, message_id=%s", user_id, msg.id)
+            await state.set_status_message(user_id, event.chat_id, msg.id)
+            return
+
+        # Not pending: specify target chat
+        logger.debug("No pending request, processing chat specification: user_id=%s", user_id)
+
+        if event.is_group or event.is_channel or event.fwd_from:
+            logger.debug("Processing group/channel/forward message: user_id=%s", user_id)
+            try:
+                # Prefer the entities Telethon already cached from the update;
+                # only the fallbacks cost an API round trip
+                fwd = getattr(event, "forward", None)
+                if fwd is not None:
+                    logger.debug("Getting entity from forwarded message")
+                    entity = getattr(fwd, "chat", None) or getattr(fwd, "sender", None)
+                    if entity is None:
+                        entity = await event.get_forwarded_from()
+                else:
+                    logger.debug("Getting entity from current chat")
+                    entity = getattr(event, "chat", None) or await event.get_chat()
+
+                chat_id = entity.id
+                logger.info(f"Detected target chat: user_id={user_id}, chat_id={chat_id}")
+            except Exception as e:
+                logger.warning(f"Target chat parse fail: user_id={user_id}, error={e}")
+                await event.respond("❌ Could not detect chat. Forward a message or name the chat/channel.")
+                return
+        elif text:
+            # Try resolve username or ID
+            logger.debug("Attempting to resolve chat from text: user_id=%s, text=%s", user_id, text)
+            try:
+                entity = await _resolve_entity(text)
+                chat_id = entity.id
+                logger.info(f"Resolved chat: user_id={user_id}, chat_id={chat_id}, identifier={text}")
+            except Exception as e:
+                logger.warning(f"Failed to resolve chat: user_id={user_id}, identifier={text}, error={e}")
+                await event.respond("❌ Invalid chat username/ID. Try again, or forward a message.")
+                return
+        else:
+            logger.warning(f"No chat specification provided: user_id={user_id}")
+            await event.respond("❌ Please forward a message or type a chat/channel username/ID.")
+            return
+
+        # Ready: generate request_id, store state, prompt user for LLM prompt
+        req_id = _gen_request_id()
+        logger.info(f"Created new request: user_id={user_id}, request_id={req_id}, chat_id={chat_id}")
+
+        logger.debug("Storing request data and pending prompt state: user_id=%s, request_id=%s", user_id, req_id)
+        await state.begin_request(user_id, req_id, {
+            "target_chat_id": chat_id,
+            "status": "PENDING_PROMPT",
+            "user_id": user_id,
+        })
+
+        logger.debug("Prompting user for custom prompt: user_id=%s", user_id)
+        await event.respond("✏️ Now send me your summarization prompt for this chat (or /cancel).")
+
     except Exception as e:
-        logger.exception(f"Error generating request ID: {e}")
-        # Fallback to a timestamp-based ID to ensure we can continue
-        import time
-        fallback_id = f"fallback_{int(time.time())}"
-        logger.warning(f"Using fallback request ID: {fallback_id}")
-        return fallback_id
+        logger.exception(f"Error handling message: user_id={user_id}, error={e}")
+        try:
+            await event.respond(_ERROR_REPLY.format(msg=_short_error(e)))
+        except Exception as respond_error:
+            logger.error(f"Failed to send error message: {respond_error}")
 
 def register_handlers(client):
     """
@@ -33,121 +214,17 @@ def register_handlers(client):
     Args:
         client: Telethon client instance
     """
+    global _client
     logger.info("Registering Telethon message handlers")
-    
+    _get_queue()
+    _client = client
     try:
-        @client.on(NewMessage(outgoing=False, from_users='me'))
-        async def handle_message_input(event: Message):
-            """Handle incoming messages from the user"""
-            # Extract key information for logging context
-            user_id = getattr(event, 'sender_id', 'unknown')
-            chat_id = getattr(event, 'chat_id', 'unknown')
-            message_id = getattr(event, 'id', 'unknown')
-            
-            logger.debug(f"Received message: user_id={user_id}, chat_id={chat_id}, message_id={message_id}")
-            
-            try:
-                text = event.raw_text.strip() if hasattr(event, "raw_text") else ""
-                logger.debug(f"Message text (length={len(text)}): {text[:20]}{'...' if len(text) > 20 else ''}")
-                
-                # Check for pending state
-                request_id = state.get_pending_state(user_id)
-                logger.debug(f"Pending state for user {user_id}: {request_id}")
-
-                # Handle prompt input if pending
-                if request_id:
-                    logger.info(f"Processing pending request: user_id={user_id}, request_id={request_id}")
-                    
-                    if text.lower() == '/cancel':
-                        logger.info(f"User cancelled operation: user_id={user_id}, request_id={request_id}")
-                        state.clear_pending_state(user_id)
-                        await event.respond("❌ Operation cancelled.")
-                        return
-
-                    if not text or len(text) < 3:
-                        logger.warning(f"Invalid prompt (too short): user_id={user_id}, length={len(text)}")
-                        await event.respond("⚠️ Please provide a valid prompt (min 3 chars) or /cancel.")
-                        return
-
-                    # Store prompt, update state, clear pending, enqueue
-                    logger.debug(f"Storing prompt and updating request: user_id={user_id}, request_id={request_id}")
-                    state.store_request_data(request_id, {"custom_prompt": text, "status": "QUEUED"})
-                    state.clear_pending_state(user_id)
-                    
-                    logger.info(f"Enqueueing job: user_id={user_id}, request_id={request_id}")
-                    await enqueue_processing_job(event, user_id, request_id, custom_prompt=text)
-                    
-                    logger.debug(f"Sending confirmation: user_id={user_id}, request_id={request_id}")
-                    msg = await event.respond("✅ Prompt received! The job is being queued.")
-                    
-                    logger.debug(f"Storing status message: user_id={user_id}, message_id={msg.id}")
-                    state.set_status_message(user_id, event.chat_id, msg.id)
-                    return
-
-                # Not pending: specify target chat
-                logger.debug(f"No pending request, processing chat specification: user_id={user_id}")
-                
-                if event.is_group or event.is_channel or event.fwd_from:
-                    logger.debug(f"Processing group/channel/forward message: user_id={user_id}")
-                    try:
-                        if hasattr(event, "forward"):
-                            logger.debug("Getting entity from forwarded message")
-                            entity = await event.get_forwarded_from()
-                        else:
-                            logger.debug("Getting entity from current chat")
-                            entity = await event.get_chat()
-                            
-                        chat_id = getattr(entity, "id", None) or event.chat_id
-                        logger.info(f"Detected target chat: user_id={user_id}, chat_id={chat_id}")
-                    except Exception as e:
-                        logger.warning(f"Target chat parse fail: user_id={user_id}, error={e}")
-                        await event.respond("❌ Could not detect chat. Forward a message or name the chat/channel.")
-                        return
-                elif text:
-                    # Try resolve username or ID
-                    logger.debug(f"Attempting to resolve chat from text: user_id={user_id}, text={text}")
-                    try:
-                        entity = await client.get_entity(text)
-                        chat_id = entity.id
-                        logger.info(f"Resolved chat: user_id={user_id}, chat_id={chat_id}, identifier={text}")
-                    except Exception as e:
-                        logger.warning(f"Failed to resolve chat: user_id={user_id}, identifier={text}, error={e}")
-                        await event.respond("❌ Invalid chat username/ID. Try again, or forward a message.")
-                        return
-                else:
-                    logger.warning(f"No chat specification provided: user_id={user_id}")
-                    await event.respond("❌ Please forward a message or type a chat/channel username/ID.")
-                    return
-
-                # Ready: generate request_id, store state, prompt user for LLM prompt
-                req_id = _gen_request_id()
-                logger.info(f"Created new request: user_id={user_id}, request_id={req_id}, chat_id={chat_id}")
-                
-                logger.debug(f"Storing initial request data: request_id={req_id}")
-                state.store_request_data(req_id, {
-                    "target_chat_id": chat_id,
-                    "status": "PENDING_PROMPT",
-                    "user_id": user_id,
-                })
-                
-                logger.debug(f"Setting pending prompt state: user_id={user_id}, request_id={req_id}")
-                state.set_pending_prompt_state(user_id, req_id)
-                
-                logger.debug(f"Prompting user for custom prompt: user_id={user_id}")
-                await event.respond("✏️ Now send me your summarization prompt for this chat (or /cancel).")
-                
-            except Exception as e:
-                logger.exception(f"Error handling message: user_id={user_id}, error={e}")
-                try:
-                    await event.respond(f"❌ An error occurred: {str(e)[:100]}...")
-                except Exception as respond_error:
-                    logger.error(f"Failed to send error message: {respond_error}")
-        
-        logger.info("Successfully registered message handlers")
-        return handle_message_input
+        client.add_event_handler(handle_message_input, _EVENT_FILTER)
     except Exception as e:
         logger.exception(f"Failed to register message handlers: {e}")
         raise
+    logger.info("Successfully registered message handlers")
+    return handle_message_input
 
 async def enqueue_processing_job(event, user_id, request_id, custom_prompt):
     """
@@ -162,16 +239,11 @@ async def enqueue_processing_job(event, user_id, request_id, custom_prompt):
     logger.info(f"Enqueueing job: user_id={user_id}, request_id={request_id}")
     
     try:
-        # Get Redis connection
-        logger.debug("Getting Redis connection")
-        redis_conn = get_redis_connection(config.settings)
-        
-        logger.debug("Getting RQ queue")
-        queue = get_rq_queue(redis_conn, config.settings)
+        queue = _get_queue()
         
         # Get request data and chat_id
-        logger.debug(f"Retrieving request data: request_id={request_id}")
-        request_data = state.get_request_data(request_id)
+        logger.debug("Retrieving request data: request_id=%s", request_id)
+        request_data = await state.get_request_data(request_id)
         
         if not request_data:
             logger.error(f"Request data not found: request_id={request_id}")
@@ -184,13 +256,9 @@ async def enqueue_processing_job(event, user_id, request_id, custom_prompt):
             await event.respond("❌ Target chat not specified. Please try again.")
             return
             
-        logger.debug(f"Using session path: {config.settings.TELEGRAM_SESSION_PATH}")
+        logger.debug("Using session path: %s", config.settings.TELEGRAM_SESSION_PATH)
         session_path = config.settings.TELEGRAM_SESSION_PATH
 
-        # Enqueue job, update status, store rq_job_id
-        logger.debug(f"Updating request status to QUEUED: request_id={request_id}")
-        state.update_request_status(request_id, "QUEUED")
-        
         # Create job metadata
         job_metadata = {
             'chat_id': chat_id, 
@@ -199,30 +267,29 @@ async def enqueue_processing_job(event, user_id, request_id, custom_prompt):
         }
         job_id = f"extract:{request_id}:{chat_id}"
         
-        logger.debug(f"Enqueueing RQ job: job_id={job_id}, metadata={job_metadata}")
-        job = queue.enqueue(
+        logger.debug("Enqueueing RQ job: job_id=%s, metadata=%s", job_id, job_metadata)
+        job = await _enqueue_batched(queue.prepare_data(
             "app.worker.tasks.extract_and_summarize_data",
-            chat_id,
-            session_path,
-            user_id,
-            request_id,
-            custom_prompt,
+            args=(chat_id, session_path, user_id, request_id, custom_prompt),
             job_id=job_id,
-            meta=job_metadata
-        )
+            meta=job_metadata,
+        ))
         
         if not job:
             logger.error(f"Failed to enqueue job: request_id={request_id}")
             await event.respond("❌ Failed to enqueue job. Please try again.")
             return
             
-        logger.debug(f"Storing RQ job ID: request_id={request_id}, job_id={job.id}")
-        state.add_rq_job_id(request_id, job.id)
+        # submit_prompt already marked the request QUEUED before the enqueue;
+        # only the job id is recorded here, since a fast worker may have
+        # moved the status on to STARTED/FAILED by now
+        logger.debug("Storing RQ job ID: request_id=%s, job_id=%s", request_id, job.id)
+        await state.add_rq_job_id(request_id, job.id)
         
         logger.info(f"Successfully enqueued job: user_id={user_id}, chat_id={chat_id}, job_id={job.id}")
     except Exception as e:
         logger.exception(f"Error enqueueing job: user_id={user_id}, request_id={request_id}, error={e}")
         try:
-            await event.respond(f"❌ Failed to start processing: {str(e)[:100]}...")
+            await event.respond(_ENQUEUE_ERROR_REPLY.format(msg=_short_error(e)))
         except Exception as respond_error:
             logger.error(f"Failed to send error message: {respond_error}")
\ No newline at end of file
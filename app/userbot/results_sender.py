@@ -1,91 +1,223 @@
 import os
-import logging
-import traceback
 import time
-from typing import Any, Dict
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional
 
+from telethon.errors import FloodWaitError
+
+# Debug tracing passes %-style arguments (guarded where building them
+# allocates) so nothing is formatted unless DEBUG is enabled
 logger = logging.getLogger("userbot.results_sender")
 
+SEND_CONCURRENCY = 4  # concurrent Telegram send requests per process
+FLOOD_WAIT_RETRIES = 1
+RECIPIENT_RATE = 20  # messages per RECIPIENT_PERIOD to one recipient...
+RECIPIENT_PERIOD = 60.0  # ...refilled evenly, so idle recipients get a full burst
+RECIPIENT_BUCKETS_SIZE = 1024
+SUMMARY_PART_CONCURRENCY = 3  # parts of one summary in flight at once
+MAX_MESSAGE_LENGTH = 4096  # Telegram counts UTF-16 code units, not characters
+PART_HEADER_RESERVE = 16  # room for the "(k/n)" part header
+FAILURE_TRACEBACK_LIMIT = 3000  # characters of worker traceback shown to the user
+
+METRICS_TEMPLATE = (
+    "📊 Processing metrics:\n"
+    "- Messages processed: {message_count}\n"
+    "- Extraction time: {extract_time_seconds}s\n"
+    "- LLM processing time: {llm_time_seconds}s\n"
+    "- Total processing time: {total_time_seconds}s"
+)
+
+class _UnknownDefault(dict):
+    """format_map mapping that renders missing metrics as 'unknown'"""
+    def __missing__(self, key: str) -> str:
+        return "unknown"
+
+class _TokenBucket:
+    """Async token bucket: up to capacity immediate sends, then one per period/capacity"""
+
+    def __init__(self, capacity: int, period: float):
+        self.capacity = capacity
+        self.rate = capacity / period
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        # Waiters queue on the lock, so tokens are handed out in arrival order
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+_send_bucket = asyncio.Semaphore(SEND_CONCURRENCY)
+_recipient_buckets: "OrderedDict[Any, _TokenBucket]" = OrderedDict()
+
+def _recipient_bucket(recipient: Any) -> _TokenBucket:
+    bucket = _recipient_buckets.get(recipient)
+    if bucket is None:
+        if len(_recipient_buckets) >= RECIPIENT_BUCKETS_SIZE:
+            _recipient_buckets.popitem(last=False)
+        bucket = _recipient_buckets[recipient] = _TokenBucket(RECIPIENT_RATE, RECIPIENT_PERIOD)
+    else:
+        _recipient_buckets.move_to_end(recipient)
+    return bucket
+
+async def _paced(send: Callable[..., Awaitable[Any]], recipient: Any, *args: Any, **kwargs: Any) -> Any:
+    """
+    Run a send to recipient under its token bucket and the process-wide cap.
+    A FloodWaitError is slept out (outside the cap) and the send retried.
+    """
+    for attempt in range(FLOOD_WAIT_RETRIES + 1):
+        await _recipient_bucket(recipient).acquire()
+        try:
+            async with _send_bucket:
+                return await send(recipient, *args, **kwargs)
+        except FloodWaitError as fw:
+            if attempt == FLOOD_WAIT_RETRIES:
+                raise
+            logger.warning(f"Flood wait of {fw.seconds}s on send, retrying")
+            await asyncio.sleep(fw.seconds)
+
+async def _send_message(client: Any, recipient: Any, *args: Any, **kwargs: Any) -> Any:
+    return await _paced(client.send_message, recipient, *args, **kwargs)
+
+async def _send_file(client: Any, recipient: Any, *args: Any, **kwargs: Any) -> Any:
+    return await _paced(client.send_file, recipient, *args, **kwargs)
+
+def _split_utf16(data: bytes, limit: int) -> List[str]:
+    """
+    Split UTF-16-LE encoded text into parts of at most limit code units,
+    never cutting a surrogate pair; slices are taken from a memoryview and
+    decoded straight from it.
+    """
+    mv = memoryview(data)
+    units = len(data) // 2
+    parts = []
+    start = 0
+    while start < units:
+        end = min(start + limit, units)
+        # High byte 0xDC-0xDF: end would land on a low surrogate
+        if end < units and data[2 * end + 1] & 0xFC == 0xDC:
+            end -= 1
+        parts.append(str(mv[2 * start:2 * end], "utf-16-le"))
+        start = end
+    return parts
+
+def _encode_if_long(text: str) -> Optional[bytes]:
+    """
+    UTF-16-LE encoding of text if it exceeds one message, else None. Every
+    code point is at most two UTF-16 units and ASCII is exactly one, so short
+    or ASCII text is measured without encoding; otherwise the buffer used for
+    the check is the one the split slices.
+    """
+    if len(text) <= MAX_MESSAGE_LENGTH // 2:
+        return None
+    if text.isascii():
+        return text.encode("utf-16-le") if len(text) > MAX_MESSAGE_LENGTH else None
+    encoded = text.encode("utf-16-le")
+    return encoded if len(encoded) // 2 > MAX_MESSAGE_LENGTH else None
+
+async def _send_long_summary(client: Any, user_id: int, chat_id: int, encoded: bytes) -> None:
+    logger.debug("Summary length %s exceeds limit, splitting for user_id=%s", len(encoded) // 2, user_id)
+    await _send_message(client, user_id, f"📋 Summary for chat {chat_id} (sending in multiple parts due to length)")
+    # Parts go out concurrently and may land out of order, so each one
+    # carries a "(k/n)" header inside the length limit
+    parts = _split_utf16(encoded, MAX_MESSAGE_LENGTH - PART_HEADER_RESERVE)
+    part_sem = asyncio.Semaphore(SUMMARY_PART_CONCURRENCY)
+
+    async def _send_part(k: int, part: str) -> Any:
+        async with part_sem:
+            logger.debug("Sending summary part %s/%s: length=%s", k, len(parts), len(part))
+            return await _send_message(client, user_id, f"({k}/{len(parts)})\n{part}")
+
+    await asyncio.gather(*(_send_part(k, part) for k, part in enumerate(parts, 1)))
+    logger.info(f"Split summary sent successfully: {len(parts)} parts")
+
 async def send_llm_result(client: Any, user_id: int, chat_id: int, job_result_dict: Dict[str, Any]) -> None:
     """
     Sends summary in chunks, metrics, participant file, robust error handling/logging.
     """
-    logger.debug(f"[ENTRY] send_llm_result(user_id={user_id}, chat_id={chat_id}, keys={list(job_result_dict.keys()) if isinstance(job_result_dict, dict) else type(job_result_dict)})")
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("[ENTRY] send_llm_result(user_id=%s, chat_id=%s, keys=%s)", user_id, chat_id, list(job_result_dict.keys()) if isinstance(job_result_dict, dict) else type(job_result_dict))
     try:
         if not isinstance(job_result_dict, dict):
             logger.error(f"Invalid job result (not a dict): {type(job_result_dict)}")
-            await client.send_message(user_id, f"❌ Invalid job result format. Please contact support.")
+            await _send_message(client, user_id, f"❌ Invalid job result format. Please contact support.")
             return
         summary = job_result_dict.get("summary")
         participants_file = job_result_dict.get("participants_file")
         metrics = job_result_dict.get("metrics", {})
         sent_summary = False
         if summary:
-            maxlen = 4096
             try:
-                if len(summary) > maxlen:
-                    logger.debug(f"Summary length {len(summary)} exceeds limit, splitting for user_id={user_id}")
-                    await client.send_message(user_id, f"📋 Summary for chat {chat_id} (sending in multiple parts due to length)")
-                    parts_sent = 0
-                    for i in range(0, len(summary), maxlen):
-                        part = summary[i:i+maxlen]
-                        logger.debug(f"Sending summary part {parts_sent+1}: length={len(part)}")
-                        await client.send_message(user_id, part)
-                        parts_sent += 1
-                        time.sleep(0.5)
-                    logger.info(f"Split summary sent successfully: {parts_sent} parts")
-                    sent_summary = True
-                else:
+                encoded = _encode_if_long(summary)
+                if encoded is None:
                     logger.debug("Sending summary as single message")
-                    await client.send_message(user_id, summary)
-                    sent_summary = True
+                    await _send_message(client, user_id, summary)
                     logger.info("Summary sent successfully")
+                else:
+                    await _send_long_summary(client, user_id, chat_id, encoded)
+                sent_summary = True
             except Exception as e:
                 logger.exception(f"[ERROR] Error sending summary message: {e}")
                 try:
-                    await client.send_message(user_id, f"❌ Error sending summary: {str(e)}\n\nThe summary was generated but could not be delivered.")
+                    await _send_message(client, user_id, f"❌ Error sending summary: {str(e)}\n\nThe summary was generated but could not be delivered.")
                 except Exception as notify_error:
                     logger.error(f"[ERROR] Failed to send error notification: {notify_error}")
         if metrics and sent_summary:
             try:
-                metrics_str = (
-                    f"📊 Processing metrics:\n"
-                    f"- Messages processed: {metrics.get('message_count', 'unknown')}\n"
-                    f"- Extraction time: {metrics.get('extract_time_seconds', 'unknown')}s\n"
-                    f"- LLM processing time: {metrics.get('llm_time_seconds', 'unknown')}s\n"
-                    f"- Total processing time: {metrics.get('total_time_seconds', 'unknown')}s"
-                )
+                metrics_str = METRICS_TEMPLATE.format_map(_UnknownDefault(metrics))
                 logger.debug("Sending metrics message")
-                await client.send_message(user_id, metrics_str)
+                await _send_message(client, user_id, metrics_str)
                 logger.debug("Metrics message sent")
             except Exception as metrics_error:
                 logger.error(f"[ERROR] Error sending metrics message: {metrics_error}")
-        if participants_file and os.path.exists(participants_file):
-            logger.info(f"Sending participants file: path={participants_file}")
+        if participants_file:
+            # Open directly instead of exists()+getsize(): one syscall, and the
+            # file cannot vanish between the check and the upload. Opening and
+            # unlinking run in a thread so slow storage cannot stall the loop.
+            # Any failure past a missing file (permissions, EISDIR, upload)
+            # still ends in the removal below, so nothing is left behind
+            missing = False
             try:
-                file_size = os.path.getsize(participants_file)
-                logger.debug(f"Participants file size: {file_size} bytes")
-                await client.send_file(user_id, participants_file, caption="📄 Chat participants list")
-                logger.info("Participants file sent successfully")
+                try:
+                    participants_fh = await asyncio.to_thread(open, participants_file, "rb")
+                except FileNotFoundError:
+                    missing = True
+                    logger.warning(f"Participants file missing: path={participants_file}")
+                else:
+                    logger.info(f"Sending participants file: path={participants_file}")
+                    with participants_fh:
+                        file_size = os.fstat(participants_fh.fileno()).st_size
+                        logger.debug("Participants file size: %s bytes", file_size)
+                        await _send_file(client, user_id, participants_fh, caption="📄 Chat participants list", file_size=file_size)
+                    logger.info("Participants file sent successfully")
             except Exception as file_error:
                 logger.exception(f"[ERROR] Error sending participants file: {file_error}")
                 try:
-                    await client.send_message(user_id, f"❌ Error sending participants file: {str(file_error)}")
+                    await _send_message(client, user_id, f"❌ Error sending participants file: {str(file_error)}")
                 except Exception as notify_error:
                     logger.error(f"[ERROR] Failed to send file error notification: {notify_error}")
             finally:
-                try:
-                    logger.debug(f"Cleaning up participants file: {participants_file}")
-                    os.remove(participants_file)
-                    logger.debug("File cleanup successful")
-                except Exception as cleanup_error:
-                    logger.error(f"[ERROR] Failed to clean up participants file: {cleanup_error}")
-        logger.debug(f"[EXIT] send_llm_result OK")
+                if not missing:
+                    try:
+                        logger.debug("Cleaning up participants file: %s", participants_file)
+                        await asyncio.to_thread(os.remove, participants_file)
+                        logger.debug("File cleanup successful")
+                    except Exception as cleanup_error:
+                        logger.error(f"[ERROR] Failed to clean up participants file: {cleanup_error}")
+        logger.debug("[EXIT] send_llm_result OK")
     except Exception as e:
         logger.exception(f"[ERROR] Unhandled error in send_llm_result: {e}")
         try:
-            error_traceback = traceback.format_exc()
-            await client.send_message(user_id, f"❌ Internal error sending results: {str(e)}\n\nPlease contact support.")
+            await _send_message(client, user_id, f"❌ Internal error sending results: {str(e)}\n\nPlease contact support.")
         except Exception as final_error:
             logger.error(f"[ERROR] Failed to send error notification in exception handler: {final_error}")
 
@@ -93,7 +225,8 @@ async def send_failure_message(client: Any, user_id: int, chat_id: int, job_resu
     """
     Sends failure message with details, logs all errors.
     """
-    logger.debug(f"[ENTRY] send_failure_message(user_id={user_id}, chat_id={chat_id}, keys={list(job_result_dict.keys()) if isinstance(job_result_dict, dict) else type(job_result_dict)})")
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("[ENTRY] send_failure_message(user_id=%s, chat_id=%s, keys=%s)", user_id, chat_id, list(job_result_dict.keys()) if isinstance(job_result_dict, dict) else type(job_result_dict))
     try:
         if not isinstance(job_result_dict, dict):
             logger.error(f"Invalid job result (not a dict): {type(job_result_dict)}")
@@ -102,19 +235,18 @@ async def send_failure_message(client: Any, user_id: int, chat_id: int, job_resu
         else:
             error = job_result_dict.get("error", "Unknown error")
             traceback_info = job_result_dict.get("traceback", "")
-        logger.debug(f"Error details: {error}")
+        logger.debug("Error details: %s", error)
         failure_message = f"❌ Job failed for chat {chat_id}:\n\n{error}"
-        if traceback_info and len(traceback_info) > 0:
-            if len(traceback_info) > 3000:
-                traceback_info = traceback_info[:3000] + "..."
-            failure_message += f"\n\nDetails:\n```\n{traceback_info}\n```"
+        if traceback_info:
+            ellipsis = "..." if len(traceback_info) > FAILURE_TRACEBACK_LIMIT else ""
+            failure_message += f"\n\nDetails:\n```\n{traceback_info[:FAILURE_TRACEBACK_LIMIT]}{ellipsis}\n```"
         logger.debug("Sending failure message to user")
-        await client.send_message(user_id, failure_message)
+        await _send_message(client, user_id, failure_message)
         logger.info("Failure message sent successfully")
-        logger.debug(f"[EXIT] send_failure_message OK")
+        logger.debug("[EXIT] send_failure_message OK")
     except Exception as e:
         logger.exception(f"[ERROR] Error sending failure message: {e}")
         try:
-            await client.send_message(user_id, f"❌ Failed to process your request for chat {chat_id}. An internal error occurred.")
+            await _send_message(client, user_id, f"❌ Failed to process your request for chat {chat_id}. An internal error occurred.")
         except Exception as final_error:
             logger.error(f"[ERROR] Failed to send error notification in exception handler: {final_error}")
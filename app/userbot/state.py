@@ -1,64 +1,218 @@
+import asyncio
+import hashlib
 import logging
-import traceback
-from typing import Any, Dict, Optional
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
 
-from app.shared.redis_client import get_redis_connection
+from redis.exceptions import NoScriptError
+
+from app.shared.redis_client import get_async_decoded_redis_connection
 from app import config
 
+# Debug tracing passes %-style arguments (guarded where building them
+# allocates) so nothing is formatted unless DEBUG is enabled
 logger = logging.getLogger("userbot.state")
 
-USER_STATE_KEY = "user:{user_id}:state"
-USER_STATUS_MESSAGE_KEY = "user:{user_id}:status:{chat_id}"
-REQUEST_DATA_KEY = "request:{request_id}:data"
+# Key layout; f-strings rather than str.format on templates since these
+# run for every Redis op
+def _user_state_key(user_id: int) -> str:
+    return f"user:{user_id}:state"
+
+def _status_message_key(user_id: int, chat_id: int) -> str:
+    return f"user:{user_id}:status:{chat_id}"
+
+def _request_data_key(request_id: str) -> str:
+    return f"request:{request_id}:data"
 
 USER_STATE_TTL = 60 * 5
 REQUEST_DATA_TTL = 60 * 60 * 24
 
-def set_pending_prompt_state(user_id: int, request_id: str) -> bool:
-    logger.debug(f"[ENTRY] set_pending_prompt_state(user_id={user_id}, request_id={request_id})")
+# Values redis-py encodes itself (str/int/float as their str(), bytes as-is);
+# matched on exact type so bool, which redis-py rejects, still gets str()
+_NATIVE_VALUE_TYPES = (str, bytes, int, float)
+
+def _hash_mapping(data: Dict[str, Any]) -> Dict[str, Any]:
+    return {k: v if type(v) in _NATIVE_VALUE_TYPES else str(v) for k, v in data.items()}
+
+# KEYS[1] = hash, ARGV[1] = ttl, ARGV[2..] = field, value pairs
+# HSET and EXPIRE run atomically, so a write can never leave the hash without
+# a TTL (e.g. a late status update recreating an already expired request)
+HSET_EXPIRE_LUA = """
+redis.call('HSET', KEYS[1], unpack(ARGV, 2))
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+return 1
+"""
+
+# KEYS[1] = request data hash
+# Reads the request and then the status message key its user_id and
+# target_chat_id point at (layout of _status_message_key), in one round trip.
+# That second key is built inside the script, so this needs a non-cluster Redis.
+STATUS_CONTEXT_LUA = """
+local data = redis.call('HGETALL', KEYS[1])
+local user_id, chat_id
+for i = 1, #data, 2 do
+    if data[i] == 'user_id' then user_id = data[i + 1]
+    elseif data[i] == 'target_chat_id' then chat_id = data[i + 1] end
+end
+local msg_id = false
+if user_id and chat_id then
+    msg_id = redis.call('GET', 'user:' .. user_id .. ':status:' .. chat_id)
+end
+return {data, msg_id}
+"""
+
+# Lua source -> script registered on the current client
+_scripts: Dict[str, Any] = {}
+
+def _get_script(redis_conn: Any, source: str) -> Any:
+    """Register a script once per client; calls go out as EVALSHA"""
+    script = _scripts.get(source)
+    if script is None or script.registered_client is not redis_conn:
+        script = _scripts[source] = redis_conn.register_script(source)
+    return script
+
+# As Redis computes it, so pipelines can queue a bare EVALSHA: a Script
+# object used on a pipeline makes execute() send SCRIPT EXISTS first
+HSET_EXPIRE_SHA = hashlib.sha1(HSET_EXPIRE_LUA.encode("utf-8")).hexdigest()
+
+def _hset_expire_args(mapping: Dict[str, Any], ttl: int) -> List[Any]:
+    args = [ttl]
+    for field, value in mapping.items():
+        args.append(field)
+        args.append(value)
+    return args
+
+def _hset_expire(redis_conn: Any, key: str, mapping: Dict[str, Any], ttl: int) -> Awaitable[Any]:
+    """HSET mapping on key and reset its TTL in one EVALSHA"""
+    return _get_script(redis_conn, HSET_EXPIRE_LUA)(keys=[key], args=_hset_expire_args(mapping, ttl))
+
+def _queue_hset_expire(pipe: Any, key: str, mapping: Dict[str, Any], ttl: int) -> None:
+    """Queue _hset_expire on pipe; run the pipeline with _execute_pipeline"""
+    pipe.evalsha(HSET_EXPIRE_SHA, 1, key, *_hset_expire_args(mapping, ttl))
+
+async def _execute_pipeline(redis_conn: Any, queue_commands: Callable[[Any], None]) -> List[Any]:
+    """
+    Run the commands queue_commands adds to a pipeline in one round trip.
+    After NOSCRIPT (Redis restarted or flushed) the script is loaded and the
+    batch rerun once; callers only queue idempotent writes, so commands that
+    already ran on the first attempt are safe to repeat.
+    """
+    async def run() -> List[Any]:
+        async with redis_conn.pipeline(transaction=False) as pipe:
+            queue_commands(pipe)
+            return await pipe.execute()
     try:
-        redis_conn = get_redis_connection(config.settings)
-        key = USER_STATE_KEY.format(user_id=user_id)
-        redis_conn.setex(key, USER_STATE_TTL, request_id)
+        return await run()
+    except NoScriptError:
+        logger.debug("HSET+EXPIRE script missing on server, reloading")
+        await redis_conn.script_load(HSET_EXPIRE_LUA)
+        return await run()
+
+REQUEST_DATA_CACHE_TTL = 5
+STATUS_MESSAGE_CACHE_TTL = 30
+READ_CACHE_SIZE = 1024
+
+# Short-lived read-through cache for get_request_data / get_status_message,
+# which bursts of status updates hit repeatedly for the same keys. Every
+# writer of those keys lives in this module and drops its entry, so the TTL
+# only bounds staleness from writes made by other processes.
+# key -> (expires_monotonic, value)
+_read_cache: Dict[Hashable, Tuple[float, Any]] = {}
+# key -> the fetch currently loading it; concurrent misses await this one
+_read_inflight: Dict[Hashable, "asyncio.Task[Any]"] = {}
+
+# Bumped by every invalidation, so a fetch can tell whether a write raced it
+_write_count = 0
+
+def _invalidate(key: Hashable) -> None:
+    global _write_count
+    _write_count += 1
+    _read_cache.pop(key, None)
+    # A fetch started before the write must not repopulate the cache
+    _read_inflight.pop(key, None)
+
+def _cache_peek(key: Hashable) -> Any:
+    """Cached value for key if still fresh, else None"""
+    entry = _read_cache.get(key)
+    if entry is None:
+        return None
+    if entry[0] >= time.monotonic():
+        return entry[1]
+    _read_cache.pop(key, None)
+    return None
+
+def _cache_put(key: Hashable, ttl: float, value: Any) -> None:
+    while len(_read_cache) >= READ_CACHE_SIZE:
+        _read_cache.pop(next(iter(_read_cache)))
+    _read_cache[key] = (time.monotonic() + ttl, value)
+
+async def _cached_read(key: Hashable, ttl: float, fetch: Callable[[], Awaitable[Any]]) -> Any:
+    """Return the cached value for key, or run fetch once for all concurrent callers; None is never cached"""
+    value = _cache_peek(key)
+    if value is not None:
+        return value
+    task = _read_inflight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(fetch())
+        _read_inflight[key] = task
+        task.add_done_callback(lambda t: _store_read(key, ttl, t))
+    # Shielded so one cancelled caller does not cancel the fetch for the others
+    return await asyncio.shield(task)
+
+def _store_read(key: Hashable, ttl: float, task: "asyncio.Task[Any]") -> None:
+    if _read_inflight.get(key) is not task:
+        return  # invalidated while in flight
+    del _read_inflight[key]
+    if task.cancelled() or task.exception() is not None or task.result() is None:
+        return
+    _cache_put(key, ttl, task.result())
+
+async def set_pending_prompt_state(user_id: int, request_id: str) -> bool:
+    logger.debug("[ENTRY] set_pending_prompt_state(user_id=%s, request_id=%s)", user_id, request_id)
+    try:
+        redis_conn = get_async_decoded_redis_connection(config.settings)
+        key = _user_state_key(user_id)
+        await redis_conn.setex(key, USER_STATE_TTL, request_id)
         logger.info(f"Set pending prompt state for user_id={user_id} request_id={request_id}")
-        logger.debug(f"[EXIT] set_pending_prompt_state: True")
+        logger.debug("[EXIT] set_pending_prompt_state: True")
         return True
     except Exception as e:
         logger.error(f"[ERROR] set_pending_prompt_state: {e}", exc_info=True)
         return False
 
-def get_pending_state(user_id: int) -> Optional[str]:
-    logger.debug(f"[ENTRY] get_pending_state(user_id={user_id})")
+async def get_pending_state(user_id: int) -> Optional[str]:
+    logger.debug("[ENTRY] get_pending_state(user_id=%s)", user_id)
     try:
-        redis_conn = get_redis_connection(config.settings)
-        key = USER_STATE_KEY.format(user_id=user_id)
-        value = redis_conn.get(key)
-        result = value.decode() if value else None
-        logger.debug(f"[EXIT] get_pending_state: {result}")
+        redis_conn = get_async_decoded_redis_connection(config.settings)
+        key = _user_state_key(user_id)
+        value = await redis_conn.get(key)
+        result = value or None
+        logger.debug("[EXIT] get_pending_state: %s", result)
         return result
     except Exception as e:
         logger.error(f"[ERROR] get_pending_state: {e}", exc_info=True)
         return None
 
-def clear_pending_state(user_id: int) -> bool:
-    logger.debug(f"[ENTRY] clear_pending_state(user_id={user_id})")
+async def clear_pending_state(user_id: int) -> bool:
+    logger.debug("[ENTRY] clear_pending_state(user_id=%s)", user_id)
     try:
-        redis_conn = get_redis_connection(config.settings)
-        key = USER_STATE_KEY.format(user_id=user_id)
-        redis_conn.delete(key)
+        redis_conn = get_async_decoded_redis_connection(config.settings)
+        key = _user_state_key(user_id)
+        await redis_conn.delete(key)
         logger.info(f"Cleared pending prompt state for user_id={user_id}")
-        logger.debug(f"[EXIT] clear_pending_state: True")
+        logger.debug("[EXIT] clear_pending_state: True")
         return True
     except Exception as e:
         logger.error(f"[ERROR] clear_pending_state: {e}", exc_info=True)
         return False
 
-def set_status_message(user_id: int, chat_id: int, message_id: int) -> bool:
-    logger.debug(f"[ENTRY] set_status_message(user_id={user_id}, chat_id={chat_id}, message_id={message_id})")
+async def set_status_message(user_id: int, chat_id: int, message_id: int) -> bool:
+    logger.debug("[ENTRY] set_status_message(user_id=%s, chat_id=%s, message_id=%s)", user_id, chat_id, message_id)
     try:
-        redis_conn = get_redis_connection(config.settings)
-        key = USER_STATUS_MESSAGE_KEY.format(user_id=user_id, chat_id=chat_id)
-        redis_conn.setex(key, USER_STATE_TTL, message_id)
+        redis_conn = get_async_decoded_redis_connection(config.settings)
+        key = _status_message_key(user_id, chat_id)
+        await redis_conn.setex(key, USER_STATE_TTL, message_id)
+        _invalidate(key)
         logger.info(f"Set status message for user_id={user_id}, chat_id={chat_id}, message_id={message_id}")
         logger.debug("[EXIT] set_status_message: True")
         return True
@@ -66,58 +220,156 @@ def set_status_message(user_id: int, chat_id: int, message_id: int) -> bool:
         logger.error(f"[ERROR] set_status_message: {e}", exc_info=True)
         return False
 
-def get_status_message(user_id: int, chat_id: int) -> Optional[int]:
-    logger.debug(f"[ENTRY] get_status_message(user_id={user_id}, chat_id={chat_id})")
+async def get_status_message(user_id: int, chat_id: int) -> Optional[int]:
+    logger.debug("[ENTRY] get_status_message(user_id=%s, chat_id=%s)", user_id, chat_id)
+    key = _status_message_key(user_id, chat_id)
+    return await _cached_read(key, STATUS_MESSAGE_CACHE_TTL, lambda: _fetch_status_message(key))
+
+async def _fetch_status_message(key: str) -> Optional[int]:
     try:
-        redis_conn = get_redis_connection(config.settings)
-        key = USER_STATUS_MESSAGE_KEY.format(user_id=user_id, chat_id=chat_id)
-        value = redis_conn.get(key)
-        result = int(value.decode()) if value else None
-        logger.debug(f"[EXIT] get_status_message: {result}")
+        redis_conn = get_async_decoded_redis_connection(config.settings)
+        value = await redis_conn.get(key)
+        result = int(value) if value else None
+        logger.debug("[EXIT] get_status_message: %s", result)
         return result
     except Exception as e:
         logger.error(f"[ERROR] get_status_message: {e}", exc_info=True)
         return None
 
-def store_request_data(request_id: str, data: Dict[str, Any]) -> bool:
-    logger.debug(f"[ENTRY] store_request_data(request_id={request_id}, data_keys={list(data.keys())})")
+async def store_request_data(request_id: str, data: Dict[str, Any]) -> bool:
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("[ENTRY] store_request_data(request_id=%s, data_keys=%s)", request_id, list(data.keys()))
     try:
-        redis_conn = get_redis_connection(config.settings)
-        key = REQUEST_DATA_KEY.format(request_id=request_id)
-        # Make sure all values are strings
-        str_data = {k: str(v) for k, v in data.items()}
-        redis_conn.hset(key, mapping=str_data)
-        redis_conn.expire(key, REQUEST_DATA_TTL)
+        redis_conn = get_async_decoded_redis_connection(config.settings)
+        key = _request_data_key(request_id)
+        await _hset_expire(redis_conn, key, _hash_mapping(data), REQUEST_DATA_TTL)
+        _invalidate(key)
         logger.info(f"Stored request data for request_id={request_id}")
-        logger.debug(f"[EXIT] store_request_data: True")
+        logger.debug("[EXIT] store_request_data: True")
         return True
     except Exception as e:
         logger.error(f"[ERROR] store_request_data: {e}", exc_info=True)
         return False
 
-def get_request_data(request_id: str) -> Optional[Dict[str, Any]]:
-    logger.debug(f"[ENTRY] get_request_data(request_id={request_id})")
+async def get_request_data(request_id: str) -> Optional[Dict[str, Any]]:
+    logger.debug("[ENTRY] get_request_data(request_id=%s)", request_id)
+    key = _request_data_key(request_id)
+    decoded = await _cached_read(key, REQUEST_DATA_CACHE_TTL, lambda: _fetch_request_data(request_id, key))
+    # Callers get their own copy; the cached dict is shared
+    return dict(decoded) if decoded is not None else None
+
+async def _fetch_request_data(request_id: str, key: str) -> Optional[Dict[str, Any]]:
     try:
-        redis_conn = get_redis_connection(config.settings)
-        key = REQUEST_DATA_KEY.format(request_id=request_id)
-        data = redis_conn.hgetall(key)
-        if not data:
+        redis_conn = get_async_decoded_redis_connection(config.settings)
+        # The decoded client already returns str keys and values
+        decoded = await redis_conn.hgetall(key) or None
+        if decoded is None:
             logger.warning(f"No request data found for request_id={request_id}")
-            logger.debug(f"[EXIT] get_request_data: None")
+            logger.debug("[EXIT] get_request_data: None")
             return None
-        decoded = {k.decode(): v.decode() for k, v in data.items()}
-        logger.debug(f"[EXIT] get_request_data: keys={list(decoded.keys())}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("[EXIT] get_request_data: keys=%s", list(decoded.keys()))
         return decoded
     except Exception as e:
         logger.error(f"[ERROR] get_request_data: {e}", exc_info=True)
         return None
 
-def update_request_status(request_id: str, status: str) -> bool:
-    logger.debug(f"[ENTRY] update_request_status(request_id={request_id}, status={status})")
+def get_request_data_pipeline(pipe: Any, request_id: str) -> None:
+    """Queue the request data HGETALL on pipe; decode its reply with decode_request_data"""
+    pipe.hgetall(_request_data_key(request_id))
+
+def decode_request_data(data: Dict[bytes, bytes]) -> Optional[Dict[str, Any]]:
+    """Decode an HGETALL reply from a bytes (non-decoding) client such as RQ's"""
+    if not data:
+        return None
+    return {k.decode(): v.decode() for k, v in data.items()}
+
+async def get_status_context(request_id: str) -> Tuple[Optional[Dict[str, Any]], Optional[int]]:
+    """
+    Request data and the status message id of its user/chat. On a cache miss
+    one script call fetches both instead of two dependent round trips.
+    """
+    logger.debug("[ENTRY] get_status_context(request_id=%s)", request_id)
+    key = _request_data_key(request_id)
+    data = await _cached_read(key, REQUEST_DATA_CACHE_TTL, lambda: _fetch_status_context(request_id, key))
+    if data is None:
+        logger.debug("[EXIT] get_status_context: no data")
+        return None, None
+    data = dict(data)
+    user_id, chat_id = data.get("user_id"), data.get("target_chat_id")
+    # Normally a cache hit, filled by the script along with the request data
+    msg_id = await get_status_message(user_id, chat_id) if user_id and chat_id else None
+    logger.debug("[EXIT] get_status_context: msg_id=%s", msg_id)
+    return data, msg_id
+
+async def _fetch_status_context(request_id: str, key: str) -> Optional[Dict[str, Any]]:
+    try:
+        redis_conn = get_async_decoded_redis_connection(config.settings)
+        writes = _write_count
+        raw_data, raw_msg_id = await _get_script(redis_conn, STATUS_CONTEXT_LUA)(keys=[key])
+        if not raw_data:
+            logger.warning(f"No request data found for request_id={request_id}")
+            return None
+        # HGETALL inside a script replies as a flat field, value list
+        data = dict(zip(raw_data[::2], raw_data[1::2]))
+        # Skipped if any write landed meanwhile; the id may predate it
+        if raw_msg_id and writes == _write_count:
+            msg_key = _status_message_key(data["user_id"], data["target_chat_id"])
+            _cache_put(msg_key, STATUS_MESSAGE_CACHE_TTL, int(raw_msg_id))
+        return data
+    except Exception as e:
+        logger.error(f"[ERROR] get_status_context: {e}", exc_info=True)
+        return None
+
+async def begin_request(user_id: int, request_id: str, data: Dict[str, Any]) -> bool:
+    """Store initial request data and point the user's pending state at it, in one round trip"""
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("[ENTRY] begin_request(user_id=%s, request_id=%s, data_keys=%s)", user_id, request_id, list(data.keys()))
+    try:
+        redis_conn = get_async_decoded_redis_connection(config.settings)
+        key = _request_data_key(request_id)
+        mapping = _hash_mapping(data)
+
+        def queue_commands(pipe: Any) -> None:
+            _queue_hset_expire(pipe, key, mapping, REQUEST_DATA_TTL)
+            pipe.setex(_user_state_key(user_id), USER_STATE_TTL, request_id)
+
+        await _execute_pipeline(redis_conn, queue_commands)
+        _invalidate(key)
+        logger.info(f"Began request for user_id={user_id} request_id={request_id}")
+        logger.debug("[EXIT] begin_request: True")
+        return True
+    except Exception as e:
+        logger.error(f"[ERROR] begin_request: {e}", exc_info=True)
+        return False
+
+async def submit_prompt(user_id: int, request_id: str, prompt: str) -> bool:
+    """Store the user's prompt, mark the request QUEUED and clear the pending state, in one round trip"""
+    logger.debug("[ENTRY] submit_prompt(user_id=%s, request_id=%s)", user_id, request_id)
+    try:
+        redis_conn = get_async_decoded_redis_connection(config.settings)
+        key = _request_data_key(request_id)
+
+        def queue_commands(pipe: Any) -> None:
+            _queue_hset_expire(pipe, key, {"custom_prompt": prompt, "status": "QUEUED"}, REQUEST_DATA_TTL)
+            pipe.delete(_user_state_key(user_id))
+
+        await _execute_pipeline(redis_conn, queue_commands)
+        _invalidate(key)
+        logger.info(f"Submitted prompt for user_id={user_id} request_id={request_id}")
+        logger.debug("[EXIT] submit_prompt: True")
+        return True
+    except Exception as e:
+        logger.error(f"[ERROR] submit_prompt: {e}", exc_info=True)
+        return False
+
+async def update_request_status(request_id: str, status: str) -> bool:
+    logger.debug("[ENTRY] update_request_status(request_id=%s, status=%s)", request_id, status)
     try:
-        redis_conn = get_redis_connection(config.settings)
-        key = REQUEST_DATA_KEY.format(request_id=request_id)
-        redis_conn.hset(key, "status", status)
+        redis_conn = get_async_decoded_redis_connection(config.settings)
+        key = _request_data_key(request_id)
+        await _hset_expire(redis_conn, key, {"status": status}, REQUEST_DATA_TTL)
+        _invalidate(key)
         logger.info(f"Updated request status for request_id={request_id} to {status}")
         logger.debug("[EXIT] update_request_status: True")
         return True
@@ -125,12 +377,13 @@ def update_request_status(request_id: str, status: str) -> bool:
         logger.error(f"[ERROR] update_request_status: {e}", exc_info=True)
         return False
 
-def add_rq_job_id(request_id: str, rq_job_id: str) -> bool:
-    logger.debug(f"[ENTRY] add_rq_job_id(request_id={request_id}, rq_job_id={rq_job_id})")
+async def add_rq_job_id(request_id: str, rq_job_id: str) -> bool:
+    logger.debug("[ENTRY] add_rq_job_id(request_id=%s, rq_job_id=%s)", request_id, rq_job_id)
     try:
-        redis_conn = get_redis_connection(config.settings)
-        key = REQUEST_DATA_KEY.format(request_id=request_id)
-        redis_conn.hset(key, "rq_job_id", rq_job_id)
+        redis_conn = get_async_decoded_redis_connection(config.settings)
+        key = _request_data_key(request_id)
+        await _hset_expire(redis_conn, key, {"rq_job_id": rq_job_id}, REQUEST_DATA_TTL)
+        _invalidate(key)
         logger.info(f"Added rq_job_id to request_id={request_id}: {rq_job_id}")
         logger.debug("[EXIT] add_rq_job_id: True")
         return True
@@ -1,16 +1,31 @@
 import logging
 from app.userbot import state
+from app.shared.hedged import hedged_call
 from typing import Any
 
 logger = logging.getLogger("userbot.ui")
 
+STATUS_ICONS = {
+    "PENDING_PROMPT": "✏️",
+    "QUEUED": "⏳",
+    "STARTED": "🔄",
+    "EXTRACTING_HISTORY": "📃",
+    "PROGRESS": "📊",
+    "EXTRACTING_PARTICIPANTS": "👥",
+    "WAITING": "⏱️",
+    "CALLING_LLM": "🧠",
+    "SUCCESS": "✅",
+    "FAILED": "❌"
+}
+DEFAULT_STATUS_ICON = "🔄"
+
 async def update_status_message_for_request(client: Any, request_id: str) -> None:
     """
     Updates Telegram status message, handles all errors/logging.
     """
     logger.debug(f"[ENTRY] update_status_message_for_request(request_id={request_id})")
     try:
-        request_data = state.get_request_data(request_id)
+        request_data, msg_id = await state.get_status_context(request_id)
         if not request_data:
             logger.warning(f"No request data found for request_id={request_id}")
             logger.debug(f"[EXIT] update_status_message_for_request: no data")
@@ -22,24 +37,11 @@ async def update_status_message_for_request(client: Any, request_id: str) -> Non
             logger.warning(f"Missing required fields in request data: user_id={user_id}, chat_id={chat_id}, status={status}")
             logger.debug(f"[EXIT] update_status_message_for_request: missing fields")
             return
-        msg_id = state.get_status_message(user_id, chat_id)
         if not msg_id:
             logger.warning(f"No status message found for user_id={user_id}, chat_id={chat_id}")
             logger.debug(f"[EXIT] update_status_message_for_request: no msg_id")
             return
-        status_icons = {
-            "PENDING_PROMPT": "✏️",
-            "QUEUED": "⏳",
-            "STARTED": "🔄",
-            "EXTRACTING_HISTORY": "📃",
-            "PROGRESS": "📊",
-            "EXTRACTING_PARTICIPANTS": "👥",
-            "WAITING": "⏱️",
-            "CALLING_LLM": "🧠",
-            "SUCCESS": "✅",
-            "FAILED": "❌"
-        }
-        icon = status_icons.get(status, "🔄")
+        icon = STATUS_ICONS.get(status, DEFAULT_STATUS_ICON)
         detail = ""
         if status == "PROGRESS":
             count = request_data.get("progress", "unknown")
@@ -49,7 +51,8 @@ async def update_status_message_for_request(client: Any, request_id: str) -> Non
         txt = f"{icon} Status for chat {chat_id}: {status}{detail}"
         logger.debug(f"Status message text: {txt}")
         try:
-            await client.edit_message(user_id, int(msg_id), txt)
+            # Editing to the same text is idempotent, so a slow edit can be hedged
+            await hedged_call("ui.edit_status_message", lambda: client.edit_message(user_id, int(msg_id), txt))
             logger.info(f"Status message updated successfully: request_id={request_id}, status={status}")
             logger.debug(f"[EXIT] update_status_message_for_request: OK")
         except Exception as edit_error:
@@ -1,5 +1,5 @@
 import logging
-import json
+import orjson
 import time
 import os
 import traceback
@@ -7,7 +7,7 @@ import asyncio
 import uuid
 from typing import Optional, Dict, Any
 
-from app.shared.redis_client import get_redis_connection
+from app.shared.redis_client import get_worker_redis_connection
 from app.worker.llm_service import get_llm_summary
 from app.worker.utils import clean_message_text
 from app.shared.metrics import MetricsCollector
@@ -51,7 +51,7 @@ def extract_and_summarize_data(chat_id, user_session_path, user_id, request_id,
                 "timestamp": time.time()
             }
             channel = f"request_status:{request_id}"
-            message = json.dumps(msg)
+            message = orjson.dumps(msg)
             logger.debug(f"Publishing status update: channel={channel}, status={status}, detail={detail}")
             redis_conn.publish(channel, message)
         except Exception as e:
@@ -61,7 +61,7 @@ def extract_and_summarize_data(chat_id, user_session_path, user_id, request_id,
         from rq import get_current_job
         job = get_current_job()
         logger.debug(f"Retrieved current RQ job: id={job.id if job else 'unknown'}")
-        redis_conn = get_redis_connection(config.settings)
+        redis_conn = get_worker_redis_connection(config.settings)
         logger.debug("Redis connection established")
         MetricsCollector.record_user_metrics(
             user_id, 
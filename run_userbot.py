@@ -55,7 +55,7 @@ def main():
     try:
         signal.signal(signal.SIGINT, handle_shutdown_signal)
         signal.signal(signal.SIGTERM, handle_shutdown_signal)
-        setup_logging(config.settings)
+        setup_logging(config.settings, queued=True)
         os.makedirs(os.path.dirname(config.settings.TELEGRAM_SESSION_PATH), exist_ok=True)
         os.makedirs(config.settings.OUTPUT_DIR_PATH, exist_ok=True)
         client = get_telethon_client(config.settings)
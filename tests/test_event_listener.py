@@ -1,69 +1,213 @@
 import pytest
 import asyncio
+import threading
 
+import fakeredis
 from unittest.mock import AsyncMock, MagicMock, patch
+from rq.job import Job, JobStatus
+from rq.results import Result
 
 from app.userbot import event_listener
 
+@pytest.fixture
+def fake_redis(monkeypatch):
+    fake = fakeredis.FakeRedis()
+    monkeypatch.setattr("app.userbot.event_listener.get_redis_connection", lambda cfg: fake)
+    return fake
+
+def _save_job(fake, status, request_user_id=1, job_id="jid", request_id="rid"):
+    job = Job.create(func=print, id=job_id, connection=fake)
+    job.save()
+    job.set_status(status)
+    if request_user_id is not None:
+        fake.hset(f"request:{request_id}:data", mapping={"user_id": request_user_id})
+    return job
+
 @pytest.mark.asyncio
-async def test_handle_job_completion_finished(monkeypatch):
+async def test_handle_job_completion_finished(monkeypatch, fake_redis):
     client = AsyncMock()
-    fake_job = MagicMock()
-    fake_job.is_finished = True
-    fake_job.is_failed = False
-    fake_job.result = {"summary": "sum"}
-    monkeypatch.setattr("app.userbot.state.get_request_data", lambda rid: {"user_id": 1})
-    monkeypatch.setattr("app.shared.redis_client.get_redis_connection", lambda cfg: None)
+    _save_job(fake_redis, JobStatus.FINISHED)
     monkeypatch.setattr("app.userbot.results_sender.send_llm_result", AsyncMock())
-    monkeypatch.setattr("rq.job.Job.fetch", lambda job_id, connection=None: fake_job)
     await event_listener.handle_job_completion(client, "jid", "rid", 2)
     event_listener.results_sender.send_llm_result.assert_awaited()
 
 @pytest.mark.asyncio
-async def test_handle_job_completion_failed(monkeypatch):
+async def test_handle_job_completion_failed(monkeypatch, fake_redis):
     client = AsyncMock()
-    fake_job = MagicMock()
-    fake_job.is_finished = False
-    fake_job.is_failed = True
-    fake_job.result = {"error": "fail"}
-    monkeypatch.setattr("app.userbot.state.get_request_data", lambda rid: {"user_id": 1})
-    monkeypatch.setattr("app.shared.redis_client.get_redis_connection", lambda cfg: None)
+    _save_job(fake_redis, JobStatus.FAILED)
     monkeypatch.setattr("app.userbot.results_sender.send_failure_message", AsyncMock())
-    monkeypatch.setattr("rq.job.Job.fetch", lambda job_id, connection=None: fake_job)
     await event_listener.handle_job_completion(client, "jid", "rid", 2)
     event_listener.results_sender.send_failure_message.assert_awaited()
 
 @pytest.mark.asyncio
-async def test_handle_job_completion_missing_data(monkeypatch):
+async def test_handle_job_completion_missing_data(monkeypatch, fake_redis):
     client = AsyncMock()
-    fake_job = MagicMock()
-    fake_job.is_finished = True
-    fake_job.is_failed = False
-    fake_job.result = {"summary": "sum"}
-    monkeypatch.setattr("app.userbot.state.get_request_data", lambda rid: None)
-    monkeypatch.setattr("app.shared.redis_client.get_redis_connection", lambda cfg: None)
-    monkeypatch.setattr("rq.job.Job.fetch", lambda job_id, connection=None: fake_job)
+    _save_job(fake_redis, JobStatus.FINISHED, request_user_id=None)
+    monkeypatch.setattr("app.userbot.results_sender.send_llm_result", AsyncMock())
     await event_listener.handle_job_completion(client, "jid", "rid", 2)
+    event_listener.results_sender.send_llm_result.assert_not_awaited()
+
+def test_fetch_resolves_status_and_result_in_one_round_trip(monkeypatch, fake_redis):
+    job = _save_job(fake_redis, JobStatus.FINISHED)
+    Result.create(job, Result.Type.SUCCESSFUL, ttl=60, return_value={"summary": "s"})
+    failed = _save_job(fake_redis, JobStatus.FAILED, job_id="jid2", request_id="rid2")
+    Result.create_failure(failed, ttl=60, exc_string="Traceback (most recent call last):\nValueError: boom\n")
+    # Anything beyond the single pipeline (HGET status, XREVRANGE result) fails
+    monkeypatch.setattr(fake_redis, "execute_command", lambda *a, **kw: pytest.fail(f"extra round trip: {a[0]}"))
+    fetched = event_listener._fetch_jobs_and_requests(fake_redis, [("jid", "rid"), ("jid2", "rid2"), ("nope", "rid3")])
+    assert fetched[0] == (JobStatus.FINISHED, {"summary": "s"}, {"user_id": "1"})
+    assert fetched[1][0] == JobStatus.FAILED
+    assert fetched[1][1]["error"] == "ValueError: boom"
+    assert fetched[2] == (None, None, None)
+
+@pytest.mark.asyncio
+async def test_handle_job_completion_keeps_sync_redis_off_the_loop(monkeypatch, fake_redis):
+    job = _save_job(fake_redis, JobStatus.FINISHED)
+    Result.create(job, Result.Type.SUCCESSFUL, ttl=60, return_value={"summary": "s"})
+    loop_thread = threading.current_thread()
+    on_loop = []
+    real_get_connection = fake_redis.connection_pool.get_connection
+
+    def get_connection(*args, **kwargs):
+        # Every command, pipelined or not, checks out a pool connection
+        on_loop.append(threading.current_thread() is loop_thread)
+        return real_get_connection(*args, **kwargs)
+
+    monkeypatch.setattr(fake_redis.connection_pool, "get_connection", get_connection)
+    monkeypatch.setattr("app.userbot.results_sender.send_llm_result", AsyncMock())
+    await event_listener.handle_job_completion(AsyncMock(), "jid", "rid", 2)
+    event_listener.results_sender.send_llm_result.assert_awaited_once()
+    assert event_listener.results_sender.send_llm_result.await_args.args[3] == {"summary": "s"}
+    assert on_loop and not any(on_loop)
 
 @pytest.mark.asyncio
-async def test_listen_for_job_events_handles_decode_and_update(monkeypatch):
-    # Simulate one pubsub message with status=SUCCESS
+async def test_listen_for_job_events_handles_decode_and_update(monkeypatch, fake_redis):
+    # Simulate a burst of two pubsub completions
     class FakePubSub:
-        def psubscribe(self, pattern): pass
-        def punsubscribe(self): pass
-        def listen(self):
+        async def psubscribe(self, pattern): pass
+        async def punsubscribe(self): pass
+        async def aclose(self): pass
+        async def listen(self):
             # Type "pmessage" is needed for the handler to process.
             yield {
                 "type": "pmessage",
                 "channel": b"request_status:rid",
                 "data": b'{"job_id": "jid", "chat_id": 2, "status": "SUCCESS"}'
             }
-    fake_redis = MagicMock()
-    fake_redis.pubsub.return_value = FakePubSub()
-    monkeypatch.setattr("app.shared.redis_client.get_redis_connection", lambda cfg: fake_redis)
-    monkeypatch.setattr("app.userbot.state.update_request_status", lambda rid, status: None)
+            yield {
+                "type": "pmessage",
+                "channel": b"request_status:rid2",
+                "data": b'{"job_id": "jid2", "chat_id": 3, "status": "FAILED"}'
+            }
+    _save_job(fake_redis, JobStatus.FINISHED)
+    _save_job(fake_redis, JobStatus.FAILED, job_id="jid2", request_id="rid2")
+    fake_async_redis = MagicMock()
+    fake_async_redis.pubsub.return_value = FakePubSub()
+    monkeypatch.setattr("app.userbot.event_listener.get_async_redis_connection", lambda cfg: fake_async_redis)
+    monkeypatch.setattr("app.userbot.state.update_request_status", AsyncMock(return_value=None))
     monkeypatch.setattr("app.userbot.ui.update_status_message_for_request", AsyncMock())
-    monkeypatch.setattr("app.userbot.event_listener.handle_job_completion", AsyncMock())
+    monkeypatch.setattr("app.userbot.results_sender.send_llm_result", AsyncMock())
+    monkeypatch.setattr("app.userbot.results_sender.send_failure_message", AsyncMock())
+    fetches = []
+    real_fetch = event_listener._fetch_jobs_and_requests
+    monkeypatch.setattr(event_listener, "_fetch_jobs_and_requests", lambda conn, ids: fetches.append(ids) or real_fetch(conn, ids))
     client = AsyncMock()
-    # Should process one message and call update_status_message_for_request and handle_job_completion
     await asyncio.wait_for(event_listener.listen_for_job_events(client), timeout=1)
+    assert event_listener.ui.update_status_message_for_request.await_count == 2
+    assert fetches == [[("jid", "rid"), ("jid2", "rid2")]]
+    event_listener.results_sender.send_llm_result.assert_awaited_once()
+    assert event_listener.results_sender.send_llm_result.await_args.args[2] == 2
+    event_listener.results_sender.send_failure_message.assert_awaited_once()
+    assert event_listener.results_sender.send_failure_message.await_args.args[2] == 3
+
+@pytest.mark.asyncio
+async def test_handle_job_completion_reuses_listener_connection(monkeypatch):
+    client = AsyncMock()
+    listener_conn = fakeredis.FakeRedis()
+    _save_job(listener_conn, JobStatus.FINISHED)
+    monkeypatch.setattr("app.userbot.event_listener.get_redis_connection", lambda cfg: pytest.fail("reconnected"))
+    monkeypatch.setattr("app.userbot.results_sender.send_llm_result", AsyncMock())
+    await event_listener.handle_job_completion(client, "jid", "rid", 2, listener_conn)
+    event_listener.results_sender.send_llm_result.assert_awaited()
+
+@pytest.mark.asyncio
+async def test_listen_for_job_events_cancels_deliveries_on_shutdown(monkeypatch, fake_redis):
+    delivery_started = asyncio.Event()
+    delivery_cancelled = asyncio.Event()
+
+    class FakePubSub:
+        async def psubscribe(self, pattern): pass
+        async def punsubscribe(self): pass
+        async def aclose(self): pass
+        async def listen(self):
+            yield {
+                "type": "pmessage",
+                "channel": b"request_status:rid",
+                "data": b'{"job_id": "jid", "chat_id": 2, "status": "SUCCESS"}'
+            }
+            await asyncio.Event().wait()
+
+    async def slow_send(*args):
+        delivery_started.set()
+        try:
+            await asyncio.Event().wait()
+        except asyncio.CancelledError:
+            delivery_cancelled.set()
+            raise
+
+    _save_job(fake_redis, JobStatus.FINISHED)
+    fake_async_redis = MagicMock()
+    fake_async_redis.pubsub.return_value = FakePubSub()
+    monkeypatch.setattr("app.userbot.event_listener.get_async_redis_connection", lambda cfg: fake_async_redis)
+    monkeypatch.setattr("app.userbot.state.update_request_status", AsyncMock(return_value=None))
+    monkeypatch.setattr("app.userbot.ui.update_status_message_for_request", AsyncMock())
+    monkeypatch.setattr("app.userbot.results_sender.send_llm_result", slow_send)
+    listener = asyncio.create_task(event_listener.listen_for_job_events(AsyncMock()))
+    await asyncio.wait_for(delivery_started.wait(), timeout=1)
+    listener.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await asyncio.wait_for(listener, timeout=1)
+    assert delivery_cancelled.is_set()
+
+@pytest.mark.asyncio
+async def test_slow_delivery_does_not_block_later_completions(monkeypatch, fake_redis):
+    release_first = asyncio.Event()
+    second_delivered = asyncio.Event()
+
+    class FakePubSub:
+        async def psubscribe(self, pattern): pass
+        async def punsubscribe(self): pass
+        async def aclose(self): pass
+        async def listen(self):
+            yield {
+                "type": "pmessage",
+                "channel": b"request_status:rid",
+                "data": b'{"job_id": "jid", "chat_id": 2, "status": "SUCCESS"}'
+            }
+            # Past the batching window, so the second lands in a later batch
+            await asyncio.sleep(event_listener.COMPLETION_BATCH_WAIT * 5)
+            yield {
+                "type": "pmessage",
+                "channel": b"request_status:rid2",
+                "data": b'{"job_id": "jid2", "chat_id": 3, "status": "SUCCESS"}'
+            }
+            await asyncio.wait_for(second_delivered.wait(), timeout=1)
+            release_first.set()
+
+    async def send(client, user_id, chat_id, result):
+        if chat_id == 2:
+            await release_first.wait()
+        else:
+            second_delivered.set()
+
+    _save_job(fake_redis, JobStatus.FINISHED)
+    _save_job(fake_redis, JobStatus.FINISHED, job_id="jid2", request_id="rid2")
+    fake_async_redis = MagicMock()
+    fake_async_redis.pubsub.return_value = FakePubSub()
+    monkeypatch.setattr("app.userbot.event_listener.get_async_redis_connection", lambda cfg: fake_async_redis)
+    monkeypatch.setattr("app.userbot.state.update_request_status", AsyncMock(return_value=None))
+    monkeypatch.setattr("app.userbot.ui.update_status_message_for_request", AsyncMock())
+    monkeypatch.setattr("app.userbot.results_sender.send_llm_result", send)
+    await asyncio.wait_for(event_listener.listen_for_job_events(AsyncMock()), timeout=2)
+    assert second_delivered.is_set()
+    assert event_listener._completion_sem._value == event_listener.MAX_CONCURRENT_COMPLETIONS
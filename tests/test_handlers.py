@@ -1,8 +1,12 @@
+import asyncio
 import pytest
 from unittest.mock import AsyncMock, MagicMock, patch
 
 from app.userbot import handlers, state
 
+# Other tests here replace handlers.enqueue_processing_job with a mock
+_enqueue_processing_job = handlers.enqueue_processing_job
+
 @pytest.mark.asyncio
 async def test_handle_message_input_prompt(monkeypatch):
     event = MagicMock()
@@ -13,12 +17,12 @@ async def test_handle_message_input_prompt(monkeypatch):
     event.fwd_from = None
     event.is_private = True
     event.chat_id = 555
-    state.get_pending_state = lambda uid: "rid123"
-    state.store_request_data = lambda rid, d: None
-    state.clear_pending_state = lambda uid: None
-    handlers.enqueue_processing_job = AsyncMock()
+    monkeypatch.setattr(state, "get_pending_state", AsyncMock(return_value="rid123"))
+    monkeypatch.setattr(state, "submit_prompt", AsyncMock(return_value=True))
+    monkeypatch.setattr(state, "clear_pending_state", AsyncMock(return_value=None))
+    monkeypatch.setattr(handlers, "enqueue_processing_job", AsyncMock())
     event.respond = AsyncMock()
-    state.set_status_message = lambda u, c, m: None
+    monkeypatch.setattr(state, "set_status_message", AsyncMock(return_value=None))
 
     await handlers.handle_message_input(event)
     event.respond.assert_awaited()
@@ -28,8 +32,8 @@ async def test_handle_message_input_cancel(monkeypatch):
     event = MagicMock()
     event.sender_id = 42
     event.raw_text = "/cancel"
-    state.get_pending_state = lambda uid: "xyz"
-    state.clear_pending_state = lambda uid: None
+    monkeypatch.setattr(state, "get_pending_state", AsyncMock(return_value="xyz"))
+    monkeypatch.setattr(state, "clear_pending_state", AsyncMock(return_value=None))
     event.respond = AsyncMock()
 
     await handlers.handle_message_input(event)
@@ -45,7 +49,123 @@ async def test_handle_message_input_invalid(monkeypatch):
     event.fwd_from = None
     event.is_private = True
     event.chat_id = 555
-    state.get_pending_state = lambda uid: "rid123"
+    monkeypatch.setattr(state, "get_pending_state", AsyncMock(return_value="rid123"))
     event.respond = AsyncMock()
     await handlers.handle_message_input(event)
     event.respond.assert_awaited()
+
+def test_gen_request_id_alphabet_and_length():
+    ids = {handlers._gen_request_id() for _ in range(50)}
+    assert len(ids) == 50
+    assert all(len(i) == 8 and i.isalnum() and i == i.lower() for i in ids)
+    assert len(handlers._gen_request_id(13)) == 13
+
+@pytest.mark.asyncio
+async def test_enqueue_processing_job_uses_shared_queue(monkeypatch):
+    queue = MagicMock()
+    queue.enqueue_many.side_effect = lambda datas: [MagicMock(id="jid") for _ in datas]
+    monkeypatch.setattr(handlers, "_QUEUE", queue)
+    monkeypatch.setattr(handlers, "get_redis_connection", lambda cfg: pytest.fail("queue rebuilt"))
+    monkeypatch.setattr(state, "get_request_data", AsyncMock(return_value={"target_chat_id": "42"}))
+    added = []
+
+    async def add_rq_job_id(rid, jid):
+        added.append((rid, jid))
+
+    monkeypatch.setattr(state, "add_rq_job_id", add_rq_job_id)
+    event = MagicMock()
+    event.respond = AsyncMock()
+    await _enqueue_processing_job(event, 1, "rid", "prompt")
+    assert queue.prepare_data.call_args.kwargs["job_id"] == "extract:rid:42"
+    assert added == [("rid", "jid")]
+    event.respond.assert_not_awaited()
+
+def test_gen_request_id_has_no_fallback(monkeypatch):
+    def broken(n):
+        raise OSError("no entropy")
+    monkeypatch.setattr(handlers.os, "urandom", broken)
+    with pytest.raises(OSError):
+        handlers._gen_request_id()
+
+class _FakeClient:
+    def __init__(self):
+        self.handlers = []
+    def add_event_handler(self, callback, event):
+        self.handlers.append((callback, event))
+
+@pytest.mark.asyncio
+async def test_forwarded_message_uses_cached_entity(monkeypatch):
+    monkeypatch.setattr(handlers, "_QUEUE", MagicMock())
+    monkeypatch.setattr(state, "get_pending_state", AsyncMock(return_value=None))
+    begun = []
+
+    async def begin_request(uid, rid, data):
+        begun.append(data)
+
+    monkeypatch.setattr(state, "begin_request", begin_request)
+    client = _FakeClient()
+    handle = handlers.register_handlers(client)
+    assert client.handlers[0] == (handlers.handle_message_input, handlers._EVENT_FILTER)
+    event = MagicMock()
+    event.sender_id = 1
+    event.raw_text = ""
+    event.is_group = False
+    event.is_channel = False
+    event.forward.chat = MagicMock(id=777)
+    event.get_forwarded_from = AsyncMock()
+    event.respond = AsyncMock()
+    await handle(event)
+    event.get_forwarded_from.assert_not_awaited()
+    assert begun[0]["target_chat_id"] == 777
+
+@pytest.mark.asyncio
+async def test_resolve_entity_is_cached(monkeypatch):
+    client = MagicMock()
+    client.get_entity = AsyncMock(return_value=MagicMock(id=5))
+    monkeypatch.setattr(handlers, "_client", client)
+    monkeypatch.setattr(handlers, "_entity_cache", {})
+    first = await handlers._resolve_entity("@somechat")
+    assert await handlers._resolve_entity("@somechat") is first
+    client.get_entity.assert_awaited_once_with("@somechat")
+    monkeypatch.setattr(handlers, "ENTITY_CACHE_TTL", -1)
+    handlers._entity_cache.clear()
+    await handlers._resolve_entity("@somechat")
+    await handlers._resolve_entity("@somechat")
+    assert client.get_entity.await_count == 3
+
+@pytest.mark.asyncio
+async def test_concurrent_enqueues_share_one_flush(monkeypatch):
+    queue = MagicMock()
+    queue.enqueue_many.side_effect = lambda datas: [MagicMock(id=d) for d in datas]
+    monkeypatch.setattr(handlers, "_QUEUE", queue)
+    jobs = await asyncio.gather(*(handlers._enqueue_batched(f"job-{i}") for i in range(5)))
+    assert [j.id for j in jobs] == [f"job-{i}" for i in range(5)]
+    queue.enqueue_many.assert_called_once()
+
+@pytest.mark.asyncio
+async def test_batched_enqueue_failure_reaches_every_caller(monkeypatch):
+    queue = MagicMock()
+    queue.enqueue_many.side_effect = RuntimeError("redis down")
+    monkeypatch.setattr(handlers, "_QUEUE", queue)
+    results = await asyncio.gather(
+        *(handlers._enqueue_batched(i) for i in range(3)), return_exceptions=True
+    )
+    assert all(isinstance(r, RuntimeError) for r in results)
+
+@pytest.mark.asyncio
+async def test_lone_enqueue_is_not_delayed(monkeypatch):
+    queue = MagicMock()
+    queue.enqueue_many.side_effect = lambda datas: [MagicMock(id=d) for d in datas]
+    monkeypatch.setattr(handlers, "_QUEUE", queue)
+    monkeypatch.setattr(asyncio, "sleep", AsyncMock(side_effect=lambda *_: pytest.fail("enqueue waited on a timer")))
+    job = await handlers._enqueue_batched("solo")
+    assert job.id == "solo"
+    # A later enqueue starts a fresh round
+    assert (await handlers._enqueue_batched("next")).id == "next"
+    assert queue.enqueue_many.call_count == 2
+
+def test_short_error_truncates_on_word_boundary():
+    assert handlers._short_error(ValueError("boom")) == "boom"
+    short = handlers._short_error(ValueError("word " * 50))
+    assert len(short) <= handlers.ERROR_REPLY_WIDTH
+    assert short.endswith("word...")
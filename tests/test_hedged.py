@@ -0,0 +1,47 @@
+import asyncio
+import pytest
+
+from app.shared import adaptive_backoff
+from app.shared.hedged import hedged, hedged_call, HEDGE_MIN_SAMPLES
+
+@pytest.mark.asyncio
+async def test_hedged_returns_first_success_and_cancels_loser():
+    started = []
+    cancelled = []
+
+    async def attempt():
+        n = len(started)
+        started.append(n)
+        try:
+            await asyncio.sleep(1.0 if n == 0 else 0.01)
+        except asyncio.CancelledError:
+            cancelled.append(n)
+            raise
+        return n
+
+    assert await hedged(attempt, delay=0.01) == 1
+    await asyncio.sleep(0)
+    assert started == [0, 1]
+    assert cancelled == [0]
+
+@pytest.mark.asyncio
+async def test_hedged_raises_when_every_attempt_fails():
+    async def attempt():
+        raise ValueError("boom")
+
+    with pytest.raises(ValueError):
+        await hedged(attempt, delay=0.0)
+
+@pytest.mark.asyncio
+async def test_hedged_call_waits_for_samples_before_hedging(monkeypatch):
+    monkeypatch.setattr(adaptive_backoff, "_trackers", {})
+    calls = []
+
+    async def attempt():
+        calls.append(1)
+        return "ok"
+
+    for _ in range(HEDGE_MIN_SAMPLES - 1):
+        assert await hedged_call("test.op", attempt) == "ok"
+    assert len(calls) == HEDGE_MIN_SAMPLES - 1
+    assert len(adaptive_backoff.get_tracker("test.op")) == HEDGE_MIN_SAMPLES - 1
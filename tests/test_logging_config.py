@@ -0,0 +1,21 @@
+import atexit
+import logging
+import logging.handlers
+
+from app import config
+from app.logging_config import setup_logging
+
+def test_queued_logging_writes_through_listener(monkeypatch, capsys):
+    root = logging.getLogger()
+    monkeypatch.setattr(root, "handlers", [])
+    monkeypatch.setattr(root, "level", root.level)
+    listener = setup_logging(config.settings, queued=True)
+    try:
+        assert [type(h) for h in root.handlers] == [logging.handlers.QueueHandler]
+        logging.getLogger("userbot.test").warning("queued %s", "record")
+    finally:
+        listener.stop()
+        atexit.unregister(listener.stop)
+    out = capsys.readouterr().out
+    assert "WARNING userbot.test" in out
+    assert "queued record" in out
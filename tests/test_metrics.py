@@ -63,3 +63,54 @@ def test_get_api_metrics_empty(monkeypatch):
     monkeypatch.setattr("app.shared.redis_client.get_redis_connection", lambda _: fake_redis)
     res = MetricsRetriever.get_api_metrics(1, None)
     assert isinstance(res, dict)
+
+def test_record_api_metrics_bulk_single_flush(monkeypatch):
+    fake_redis = MagicMock()
+    monkeypatch.setattr("app.shared.metrics.get_redis_connection", lambda _: fake_redis)
+    ok = MetricsCollector.record_api_metrics_bulk([("/api/a", 0.5, 200), ("/api/b", 1.0, 500)])
+    assert ok is True
+    fake_redis.pipeline.assert_called_once_with(transaction=False)
+    fake_redis.pipeline.return_value.execute.assert_called_once()
+
+def test_record_api_metrics_nowait_flushes_in_background(monkeypatch):
+    from app.shared import metrics
+    flushed = []
+    monkeypatch.setattr(MetricsCollector, "record_api_metrics_bulk", staticmethod(lambda events: flushed.extend(events)))
+    assert MetricsCollector.record_api_metrics_nowait("/api/test", 0.25, 200) is True
+    assert metrics.flush_metrics(timeout=2) is True
+    assert ("/api/test", 0.25, 200) in flushed
+
+def test_get_job_metrics_cached(monkeypatch):
+    fake_redis = MagicMock()
+    fake_redis.hgetall.return_value = {b"status": b'"done"'}
+    monkeypatch.setattr("app.shared.metrics.get_redis_connection", lambda _: fake_redis)
+    MetricsRetriever.bust_cache()
+    assert MetricsRetriever.get_job_metrics("cached-job") == {"status": "done"}
+    assert MetricsRetriever.get_job_metrics("cached-job") == {"status": "done"}
+    assert fake_redis.hgetall.call_count == 1
+    MetricsRetriever.bust_cache("cached-job")
+    MetricsRetriever.get_job_metrics("cached-job")
+    assert fake_redis.hgetall.call_count == 2
+
+def test_record_api_metrics_bulk_skips_script_exists(monkeypatch):
+    import fakeredis
+    from redis.client import Pipeline
+    fake = fakeredis.FakeRedis()
+    monkeypatch.setattr("app.shared.metrics.get_redis_connection", lambda _: fake)
+    monkeypatch.setattr(Pipeline, "load_scripts", lambda self: pytest.fail("SCRIPT EXISTS round trip"))
+    # First call meets NOSCRIPT, loads the script and reruns without double counting
+    assert MetricsCollector.record_api_metrics_bulk([("/api/a", 0.5, 200), ("/api/a", 1.5, 200)]) is True
+    assert MetricsCollector.record_api_metrics_bulk([("/api/a", 1.0, 500)]) is True
+    key = next(k for k in fake.keys("metrics:api:*") if not k.endswith(b":response_times"))
+    assert fake.hget(key, "t") == b"3"
+    assert fake.llen(key + b":response_times") == 3
+
+def test_cached_metrics_are_copies(monkeypatch):
+    fake_redis = MagicMock()
+    fake_redis.hgetall.return_value = {b"steps": b'["a"]'}
+    monkeypatch.setattr("app.shared.metrics.get_redis_connection", lambda _: fake_redis)
+    MetricsRetriever.bust_cache()
+    MetricsRetriever.get_job_metrics("copy-job")["steps"].append("mutated")
+    MetricsRetriever.get_job_metrics("copy-job")["steps"].append("mutated")
+    assert MetricsRetriever.get_job_metrics("copy-job") == {"steps": ["a"]}
+    assert fake_redis.hgetall.call_count == 1
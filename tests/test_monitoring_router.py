@@ -30,14 +30,18 @@ def test_metrics_system_auth_required():
 
 def test_metrics_system_success(monkeypatch):
     token = ADMIN_TOKEN
-    monkeypatch.setattr("app.shared.metrics.MetricsRetriever.get_system_metrics", lambda days, interval: {"foo": "bar"})
+    async def fake_metrics(days, interval):
+        return {"foo": "bar"}
+    monkeypatch.setattr("app.shared.metrics.MetricsRetriever.aget_system_metrics", fake_metrics)
     resp = client.get("/metrics/system", headers={"X-Admin-Token": token})
     assert resp.status_code == 200
     assert resp.json()["metrics"] == {"foo": "bar"}
 
 def test_metrics_api_success(monkeypatch):
     token = ADMIN_TOKEN
-    monkeypatch.setattr("app.shared.metrics.MetricsRetriever.get_api_metrics", lambda days, endpoints: {"api": "v"})
+    async def fake_metrics(days, endpoints):
+        return {"api": "v"}
+    monkeypatch.setattr("app.shared.metrics.MetricsRetriever.aget_api_metrics", fake_metrics)
     resp = client.get("/metrics/api", headers={"X-Admin-Token": token})
     assert resp.status_code == 200
     assert resp.json()["metrics"] == {"api": "v"}
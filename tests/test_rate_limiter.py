@@ -1,38 +1,163 @@
 import pytest
 import time
-from unittest.mock import MagicMock
+import fakeredis
+from app.shared import rate_limiter
 from app.shared.rate_limiter import RateLimiter
 
-def test_check_rate_limit_allowed(monkeypatch):
-    fake_redis = MagicMock()
-    fake_redis.zcard.return_value = 0
-    monkeypatch.setattr("app.shared.redis_client.get_redis_connection", lambda _: fake_redis)
+@pytest.fixture(autouse=True)
+def reset_cached_connection(monkeypatch):
+    monkeypatch.setattr(rate_limiter, "_REDIS", None)
+    monkeypatch.setattr(rate_limiter, "_deny_cache", {})
+
+@pytest.fixture
+def fake_redis(monkeypatch):
+    fake = fakeredis.FakeRedis()
+    monkeypatch.setattr("app.shared.rate_limiter.get_redis_connection", lambda *_: fake)
+    yield fake
+
+def test_check_rate_limit_allowed(fake_redis):
     ok, result = RateLimiter.check_rate_limit(1, "foo", 5, 60)
     assert ok is True
     assert result["allowed"] is True
+    assert result["current_count"] == 1
+    assert result["remaining"] == 4
 
-def test_check_rate_limit_blocked(monkeypatch):
-    fake_redis = MagicMock()
-    fake_redis.zcard.return_value = 5
-    fake_redis.zrange.return_value = [(b"t", time.time()-30)]
-    monkeypatch.setattr("app.shared.redis_client.get_redis_connection", lambda _: fake_redis)
+def test_check_rate_limit_blocked(fake_redis):
+    fake_redis.zadd("rate:user:{1}:foo", {str(i): (time.time() - 30) * 1000 for i in range(5)})
     ok, result = RateLimiter.check_rate_limit(1, "foo", 5, 60)
     assert ok is False
     assert result["allowed"] is False
+    assert 0 < result["reset_after"] <= 31
+
+def test_check_rate_limit_no_increment(fake_redis):
+    ok, result = RateLimiter.check_rate_limit(1, "foo", 5, 60, increment=False)
+    assert ok is True
+    assert result["current_count"] == 0
+    assert fake_redis.zcard("rate:user:{1}:foo") == 0
+
+def test_check_rate_limit_window_is_atomic_per_call(fake_redis):
+    results = [RateLimiter.check_rate_limit(1, "bar", 3, 60)[0] for _ in range(5)]
+    assert results == [True, True, True, False, False]
+
+def test_check_global_rate_limit(fake_redis):
+    assert RateLimiter.check_global_rate_limit("baz", 1, 60)[0] is True
+    assert RateLimiter.check_global_rate_limit("baz", 1, 60)[0] is False
 
 def test_check_rate_limit_error(monkeypatch):
     def raise_exc(*a, **kw): raise Exception("fail")
-    monkeypatch.setattr("app.shared.redis_client.get_redis_connection", raise_exc)
+    monkeypatch.setattr("app.shared.rate_limiter.get_redis_connection", raise_exc)
     ok, result = RateLimiter.check_rate_limit(1, "foo", 5, 60)
     assert ok is True
     assert "error" in result
 
-def test_get_rate_limits(monkeypatch):
-    fake_redis = MagicMock()
-    fake_redis.scan_iter.return_value = [b"rate:user:1:foo", b"rate:user:1:bar"]
-    fake_redis.zrange.return_value = [(b"k", time.time()-10), (b"k", time.time())]
-    fake_redis.ttl.return_value = 120
-    monkeypatch.setattr("app.shared.redis_client.get_redis_connection", lambda _: fake_redis)
+def test_get_rate_limits(fake_redis):
+    now = time.time() * 1000
+    fake_redis.zadd("rate:user:{1}:foo", {"a": now - 10000, "b": now})
+    fake_redis.expire("rate:user:{1}:foo", 120)
+    fake_redis.zadd("rate:user:{1}:bar", {"c": now})
+    fake_redis.expire("rate:user:{1}:bar", 120)
     res = RateLimiter.get_rate_limits(1)
     assert isinstance(res, dict)
     assert "foo" in res or "bar" in res
+    assert res["foo"]["count"] == 2
+    assert 9 <= res["foo"]["age_seconds"] <= 11
+
+def test_check_fixed_window(fake_redis):
+    results = [RateLimiter.check_fixed_window(1, "fixed", 2, 60)[0] for _ in range(3)]
+    assert results == [True, True, False]
+    ok, result = RateLimiter.check_fixed_window(1, "fixed", 2, 60, increment=False)
+    assert ok is False
+    assert 0 < result["reset_after"] <= 61
+
+def test_check_rate_limit_uses_sequence_members(fake_redis):
+    for _ in range(3):
+        RateLimiter.check_rate_limit(1, "seq", 5, 60)
+    members = fake_redis.zrange("rate:user:{1}:seq", 0, -1)
+    assert sorted(int(m) for m in members) == [1, 2, 3]
+
+def test_check_rate_limit_denied_is_single_round_trip(fake_redis, monkeypatch):
+    for _ in range(2):
+        RateLimiter.check_rate_limit(1, "deny", 2, 60)
+    calls = []
+    real_evalsha = fake_redis.evalsha
+    monkeypatch.setattr(fake_redis, "evalsha", lambda *a: calls.append(a) or real_evalsha(*a))
+    monkeypatch.setattr(fake_redis, "zrange", lambda *a, **kw: pytest.fail("zrange called on denied path"))
+    ok, result = RateLimiter.check_rate_limit(1, "deny", 2, 60)
+    assert ok is False
+    assert len(calls) == 1
+    assert 0 < result["reset_after"] <= 61
+
+def test_check_rate_limit_full_window_with_expired_entries(fake_redis):
+    now_ms = time.time() * 1000
+    fake_redis.zadd("rate:user:{1}:stale", {"old": now_ms - 120000, "new": now_ms - 1000})
+    ok, result = RateLimiter.check_rate_limit(1, "stale", 2, 60)
+    assert ok is True
+    assert result["current_count"] == 2
+    assert fake_redis.zscore("rate:user:{1}:stale", "old") is None
+
+def test_check_rate_limit_recovers_from_script_flush(fake_redis):
+    assert RateLimiter.check_rate_limit(1, "flush", 5, 60)[0] is True
+    fake_redis.script_flush()
+    ok, result = RateLimiter.check_rate_limit(1, "flush", 5, 60)
+    assert ok is True
+    assert result["current_count"] == 2
+    assert fake_redis.script_exists(rate_limiter.get_rate_limit_sha()) == [True]
+
+def test_check_rate_limit_caches_deny_locally(fake_redis, monkeypatch):
+    for _ in range(2):
+        RateLimiter.check_rate_limit(1, "burst", 1, 60)
+    monkeypatch.setattr(fake_redis, "evalsha", lambda *a: pytest.fail("Redis hit for cached deny"))
+    ok, result = RateLimiter.check_rate_limit(1, "burst", 1, 60)
+    assert ok is False
+    assert result["remaining"] == 0
+
+def test_check_rate_limits_bulk(fake_redis):
+    RateLimiter.check_rate_limit(2, "foo", 1, 60)
+    results = RateLimiter.check_rate_limits_bulk([(1, "foo", 2, 60), (2, "foo", 1, 60), (1, "bar", 2, 60)])
+    assert [ok for ok, _ in results] == [True, False, True]
+    assert results[0][1]["remaining"] == 1
+    assert results[1][1]["user_id"] == 2
+    assert fake_redis.zcard("rate:user:{1}:foo") == 1
+
+def test_get_rate_limits_reads_window_bounds(fake_redis):
+    fake_redis.zadd("rate:user:{3}:foo", {"1": 1000000, "2": 3000000, "3": 2000000})
+    fake_redis.hset("rate:meta:user:{3}:foo", "period", 60)
+    res = RateLimiter.get_rate_limits(3)["foo"]
+    assert res["count"] == 3
+    assert res["oldest_request"] == 1000
+    assert res["newest_request"] == 3000
+    assert res["period_seconds"] == 60
+
+def test_check_rate_limit_refreshes_ttl_only_when_low(fake_redis):
+    RateLimiter.check_rate_limit(1, "ttl", 5, 60)
+    assert 60000 < fake_redis.pttl("rate:user:{1}:ttl") <= 120000
+    fake_redis.pexpire("rate:user:{1}:ttl", 90000)
+    RateLimiter.check_rate_limit(1, "ttl", 5, 60)
+    assert fake_redis.pttl("rate:user:{1}:ttl") <= 90000
+    fake_redis.pexpire("rate:user:{1}:ttl", 30000)
+    RateLimiter.check_rate_limit(1, "ttl", 5, 60)
+    assert fake_redis.pttl("rate:user:{1}:ttl") > 90000
+
+def test_check_rate_limit_member_counter_is_per_window(fake_redis):
+    assert [RateLimiter.check_rate_limit(1, "long", 3, 3600)[0] for _ in range(2)] == [True, True]
+    assert RateLimiter.check_rate_limit(1, "short", 5, 1)[0] is True
+    # Let the short window's keys expire; the long window's counter must survive
+    for key in fake_redis.keys("rate:*"):
+        if 0 < fake_redis.pttl(key) <= 2000:
+            fake_redis.delete(key)
+    assert [RateLimiter.check_rate_limit(1, "long", 3, 3600)[0] for _ in range(3)] == [True, False, False]
+    assert fake_redis.zcard("rate:user:{1}:long") == 3
+
+def test_get_rate_limits_reports_stored_period(fake_redis):
+    RateLimiter.check_rate_limit(4, "foo", 5, 60)
+    # The TTL drifts between one and two periods; the reported period must not
+    fake_redis.pexpire("rate:user:{4}:foo", 70000)
+    RateLimiter.check_rate_limit(4, "foo", 5, 60)
+    assert RateLimiter.get_rate_limits(4)["foo"]["period_seconds"] == 60
+
+def test_check_rate_limit_zero_limit_denies(fake_redis):
+    ok, result = RateLimiter.check_rate_limit(1, "off", 0, 60)
+    assert ok is False
+    assert "error" not in result
+    assert result["reset_after"] == 60
+    assert [ok for ok, _ in RateLimiter.check_rate_limits_bulk([(2, "off", 0, 60)])] == [False]
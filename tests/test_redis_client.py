@@ -6,10 +6,11 @@ from app import config
 def test_get_redis_connection(monkeypatch):
     fake = fakeredis.FakeRedis()
     monkeypatch.setattr(redis_client, "_redis_instance", None)
-    monkeypatch.setattr(redis_client, "redis", fakeredis)
+    monkeypatch.setattr(redis_client.redis, "Redis", lambda connection_pool: fake)
     conf = config.settings
     result = redis_client.get_redis_connection(conf)
-    assert result is not None
+    assert result is fake
+    assert redis_client.get_redis_connection() is fake
 
 def test_get_rq_queue(monkeypatch):
     fake = fakeredis.FakeRedis()
@@ -19,4 +20,35 @@ def test_get_rq_queue(monkeypatch):
     monkeypatch.setattr(redis_client, "Queue", FakeQueue)
     conf = config.settings
     q = redis_client.get_rq_queue(fake, conf)
-    assert q.name == conf.RQ_QUEUE_NAME
\ No newline at end of file
+    assert q.name == conf.RQ_QUEUE_NAME
+def test_get_worker_redis_connection_is_per_process(monkeypatch):
+    fake = fakeredis.FakeRedis()
+    monkeypatch.setattr(redis_client, "_redis_instance", fake)
+    monkeypatch.setattr(redis_client, "_worker_redis_instance", None)
+    first = redis_client.get_worker_redis_connection()
+    assert first is redis_client.get_worker_redis_connection()
+    assert first.connection_pool is fake.connection_pool
+    monkeypatch.setattr(redis_client, "_worker_redis_pid", -1)
+    assert redis_client.get_worker_redis_connection() is not first
+
+def test_get_async_redis_connection_uses_bounded_pool(monkeypatch):
+    monkeypatch.setattr(redis_client, "_async_redis_instance", None)
+    client = redis_client.get_async_redis_connection(config.settings)
+    assert client is redis_client.get_async_redis_connection(config.settings)
+    assert client.connection_pool.max_connections == redis_client.REDIS_MAX_CONNECTIONS
+
+def test_get_async_decoded_redis_connection_is_separate(monkeypatch):
+    monkeypatch.setattr(redis_client, "_async_redis_instance", None)
+    monkeypatch.setattr(redis_client, "_async_decoded_redis_instance", None)
+    decoded = redis_client.get_async_decoded_redis_connection(config.settings)
+    assert decoded is redis_client.get_async_decoded_redis_connection(config.settings)
+    assert decoded is not redis_client.get_async_redis_connection(config.settings)
+    assert decoded.connection_pool.connection_kwargs["decode_responses"] is True
+    assert not redis_client.get_async_redis_connection(config.settings).connection_pool.connection_kwargs.get("decode_responses")
+
+def test_pool_options_prefer_unix_socket():
+    from types import SimpleNamespace
+    tcp = SimpleNamespace(REDIS_URL="redis://:secret@redis:6379/2", REDIS_UNIX_SOCKET_PATH=None)
+    assert redis_client._pool_options(tcp) == ("redis://:secret@redis:6379/2", {"socket_keepalive": True})
+    unix = SimpleNamespace(REDIS_URL="redis://:secret@redis:6379/2", REDIS_UNIX_SOCKET_PATH="/run/redis.sock")
+    assert redis_client._pool_options(unix) == ("unix:///run/redis.sock", {"password": "secret", "db": 2})
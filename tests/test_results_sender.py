@@ -1,14 +1,20 @@
 import asyncio
+import os
 import pytest
+from telethon.errors import FloodWaitError
 from app.userbot import results_sender
 
+@pytest.fixture(autouse=True)
+def fresh_recipient_buckets(monkeypatch):
+    monkeypatch.setattr(results_sender, "_recipient_buckets", type(results_sender._recipient_buckets)())
+
 class DummyClient:
     def __init__(self):
         self.sent = []
     async def send_message(self, user_id, text):
         self.sent.append(("msg", user_id, text))
-    async def send_file(self, user_id, file, caption=None):
-        self.sent.append(("file", user_id, file, caption))
+    async def send_file(self, user_id, file, caption=None, file_size=None):
+        self.sent.append(("file", user_id, file.read(), caption, file_size))
 
 @pytest.mark.asyncio
 async def test_send_llm_result_simple(tmp_path):
@@ -45,6 +51,29 @@ async def test_send_llm_result_participants_file(tmp_path):
         job_result_dict={"summary": "sum", "participants_file": str(pf), "metrics": {"message_count": 10}}
     )
     assert os.path.exists(str(pf)) is False
+    assert ("file", 1, b"hi", "📄 Chat participants list", 2) in client.sent
+
+@pytest.mark.asyncio
+async def test_send_llm_result_missing_participants_file(tmp_path):
+    client = DummyClient()
+    await results_sender.send_llm_result(
+        client, 1, 2, {"summary": "sum", "participants_file": str(tmp_path / "gone.txt")}
+    )
+    assert [x[0] for x in client.sent] == ["msg"]
+
+@pytest.mark.asyncio
+async def test_send_llm_result_unreadable_participants_file_is_removed(monkeypatch, tmp_path):
+    client = DummyClient()
+    pf = tmp_path / "file.txt"
+    pf.write_text("hi")
+
+    def denied(*args):
+        raise PermissionError("denied")
+
+    monkeypatch.setattr(results_sender, "open", denied, raising=False)
+    await results_sender.send_llm_result(client, 1, 2, {"summary": "sum", "participants_file": str(pf)})
+    assert os.path.exists(str(pf)) is False
+    assert client.sent[-1][0] == "msg" and "denied" in client.sent[-1][2]
 
 @pytest.mark.asyncio
 async def test_send_llm_result_invalid(monkeypatch):
@@ -65,3 +94,112 @@ async def test_send_failure_message_invalid(monkeypatch):
     client = DummyClient()
     await results_sender.send_failure_message(client, 1, 2, "badtype")
     assert any("msg" == x[0] for x in client.sent)
+
+@pytest.mark.asyncio
+async def test_send_llm_result_caps_concurrent_sends(monkeypatch):
+    in_flight = 0
+    peak = 0
+
+    class SlowClient(DummyClient):
+        async def send_message(self, user_id, text):
+            nonlocal in_flight, peak
+            in_flight += 1
+            peak = max(peak, in_flight)
+            await asyncio.sleep(0.01)
+            in_flight -= 1
+            await super().send_message(user_id, text)
+
+    clients = [SlowClient() for _ in range(10)]
+    await asyncio.gather(*(
+        results_sender.send_llm_result(c, uid, 2, {"summary": "x" * 5000})
+        for uid, c in enumerate(clients)
+    ))
+    assert peak <= results_sender.SEND_CONCURRENCY
+    assert all(len(c.sent) == 3 for c in clients)
+
+@pytest.mark.asyncio
+async def test_send_llm_result_numbers_split_parts():
+    client = DummyClient()
+    summary = "".join(chr(ord("a") + i) * 4000 for i in range(5))
+    await results_sender.send_llm_result(client, 1, 2, {"summary": summary})
+    parts = [x[2] for x in client.sent[1:]]
+    assert all(len(p) <= results_sender.MAX_MESSAGE_LENGTH for p in parts)
+    n = len(parts)
+    by_index = sorted(parts, key=lambda p: int(p[1:p.index("/")]))
+    assert [p.split("\n", 1)[0] for p in by_index] == [f"({k}/{n})" for k in range(1, n + 1)]
+    assert "".join(p.split("\n", 1)[1] for p in by_index) == summary
+
+def test_split_utf16_respects_telegram_length_and_surrogates():
+    text = "a" + "😀" * 3000 + "я" * 3000
+    parts = results_sender._split_utf16(text.encode("utf-16-le"), 4000)
+    assert "".join(parts) == text
+    assert all(len(p.encode("utf-16-le")) // 2 <= 4000 for p in parts)
+
+@pytest.mark.asyncio
+async def test_send_llm_result_metrics_defaults_unknown():
+    client = DummyClient()
+    await results_sender.send_llm_result(
+        client, 1, 2, {"summary": "sum", "metrics": {"message_count": 10, "llm_time_seconds": 1.5}}
+    )
+    metrics_msg = client.sent[-1][2]
+    assert "- Messages processed: 10\n" in metrics_msg
+    assert "- Extraction time: unknown" in metrics_msg
+    assert "- LLM processing time: 1.5s\n" in metrics_msg
+
+def test_encode_if_long_measures_utf16_units():
+    limit = results_sender.MAX_MESSAGE_LENGTH
+    assert results_sender._encode_if_long("x" * limit) is None
+    assert results_sender._encode_if_long("x" * (limit + 1)) is not None
+    assert results_sender._encode_if_long("😀" * (limit // 2)) is None
+    assert results_sender._encode_if_long("😀" * (limit // 2 + 1)) == ("😀" * (limit // 2 + 1)).encode("utf-16-le")
+
+@pytest.mark.asyncio
+async def test_send_sleeps_out_flood_wait(monkeypatch):
+    slept = []
+
+    async def fake_sleep(seconds):
+        slept.append(seconds)
+
+    monkeypatch.setattr(results_sender.asyncio, "sleep", fake_sleep)
+
+    class FloodOnceClient(DummyClient):
+        flooded = False
+        async def send_message(self, user_id, text):
+            if not self.flooded:
+                self.flooded = True
+                raise FloodWaitError(request=None, capture=7)
+            await super().send_message(user_id, text)
+
+    client = FloodOnceClient()
+    await results_sender.send_llm_result(client, 1, 2, {"summary": "sum"})
+    assert slept == [7]
+    assert client.sent == [("msg", 1, "sum")]
+
+@pytest.mark.asyncio
+async def test_send_failure_message_truncates_traceback():
+    client = DummyClient()
+    limit = results_sender.FAILURE_TRACEBACK_LIMIT
+    await results_sender.send_failure_message(client, 1, 2, {"error": "fail", "traceback": "t" * (limit + 10)})
+    assert f"```\n{'t' * limit}...\n```" in client.sent[0][2]
+    client = DummyClient()
+    await results_sender.send_failure_message(client, 1, 2, {"error": "fail", "traceback": "short"})
+    assert client.sent[0][2].endswith("```\nshort\n```")
+
+@pytest.mark.asyncio
+async def test_token_bucket_bursts_then_throttles():
+    loop = asyncio.get_running_loop()
+    bucket = results_sender._TokenBucket(2, 0.2)
+    start = loop.time()
+    await bucket.acquire()
+    await bucket.acquire()
+    assert loop.time() - start < 0.05
+    await bucket.acquire()
+    assert loop.time() - start >= 0.09
+
+def test_recipient_buckets_are_bounded(monkeypatch):
+    monkeypatch.setattr(results_sender, "RECIPIENT_BUCKETS_SIZE", 2)
+    first = results_sender._recipient_bucket(1)
+    results_sender._recipient_bucket(2)
+    assert results_sender._recipient_bucket(1) is first
+    results_sender._recipient_bucket(3)
+    assert list(results_sender._recipient_buckets) == [1, 3]
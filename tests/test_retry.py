@@ -0,0 +1,134 @@
+import pytest
+from app.shared.retry import retry, async_retry, is_retryable_exception, NetworkError
+
+@pytest.mark.parametrize("exc", [
+    NetworkError("anything"),
+    Exception("Connection reset by peer"),
+    Exception("Read TIMEOUT"),
+    Exception("HTTP 503 from upstream"),
+    Exception("FloodWaitError: wait 5 seconds"),
+])
+def test_is_retryable_exception_true(exc):
+    assert is_retryable_exception(exc) is True
+
+@pytest.mark.parametrize("exc", [
+    ValueError("invalid literal for int()"),
+    Exception("user 15034 not found"),
+])
+def test_is_retryable_exception_false(exc):
+    assert is_retryable_exception(exc) is False
+
+def test_retry_full_jitter_stays_within_capped_backoff(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr("app.shared.retry._sleep", sleeps.append)
+    calls = []
+
+    @retry(max_tries=4, delay=1.0, backoff=10.0, cap=5.0)
+    def flaky():
+        calls.append(1)
+        if len(calls) < 4:
+            raise NetworkError("down")
+        return "ok"
+
+    assert flaky() == "ok"
+    assert len(sleeps) == 3
+    assert 0 <= sleeps[0] <= 1.0
+    assert all(0 <= s <= 5.0 for s in sleeps[1:])
+
+def test_retry_without_jitter_is_deterministic(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr("app.shared.retry._sleep", sleeps.append)
+
+    @retry(max_tries=3, delay=1.0, backoff=2.0, jitter=False)
+    def always_fails():
+        raise NetworkError("down")
+
+    with pytest.raises(NetworkError):
+        always_fails()
+    assert sleeps == [1.0, 2.0]
+
+@pytest.mark.asyncio
+async def test_async_retry_anchors_delay_to_observed_latency(monkeypatch):
+    from app.shared import adaptive_backoff
+    sleeps = []
+
+    async def fake_sleep(s):
+        sleeps.append(s)
+    monkeypatch.setattr("app.shared.retry.asyncio.sleep", fake_sleep)
+    monkeypatch.setattr(adaptive_backoff, "_trackers", {})
+    calls = []
+
+    @async_retry(max_tries=3, delay=0.1, cap=30.0)
+    async def flaky():
+        calls.append(1)
+        if len(calls) < 3:
+            raise NetworkError("down")
+        return "ok"
+
+    for _ in range(20):
+        adaptive_backoff.get_tracker(f"{flaky.__module__}.{flaky.__qualname__}").record(4.0)
+    assert await flaky() == "ok"
+    assert len(sleeps) == 2
+    assert all(6.0 <= s <= 30.0 for s in sleeps)
+
+@pytest.mark.asyncio
+async def test_async_retry_trackers_are_per_module(monkeypatch):
+    from app.shared import adaptive_backoff
+    monkeypatch.setattr(adaptive_backoff, "_trackers", {})
+
+    async def fetch():
+        return "ok"
+
+    async def elsewhere():
+        return "ok"
+    elsewhere.__qualname__ = fetch.__qualname__
+    elsewhere.__module__ = "app.other"
+    async_retry()(elsewhere)
+    await async_retry()(fetch)()
+    assert len(adaptive_backoff.get_tracker(f"{__name__}.{fetch.__qualname__}")) == 1
+    assert len(adaptive_backoff.get_tracker(f"app.other.{fetch.__qualname__}")) == 0
+
+def test_is_retryable_exception_by_type_and_status():
+    class HTTPError(Exception):
+        def __init__(self, status_code):
+            super().__init__("request failed")
+            self.status_code = status_code
+
+    assert is_retryable_exception(ConnectionResetError()) is True
+    assert is_retryable_exception(TimeoutError()) is True
+    assert is_retryable_exception(HTTPError(503)) is True
+    assert is_retryable_exception(HTTPError(404)) is False
+    assert is_retryable_exception(FileNotFoundError("missing.txt")) is False
+
+def test_sleep_waits_out_interrupted_intervals(monkeypatch):
+    from app.shared import retry as retry_module
+    clock = [100.0]
+    calls = []
+
+    def short_sleep(seconds):
+        # Wake early, as a sleep cut short by a signal handler would
+        calls.append(seconds)
+        clock[0] += min(seconds, 0.0004)
+
+    monkeypatch.setattr(retry_module.time, "monotonic", lambda: clock[0])
+    monkeypatch.setattr(retry_module.time, "sleep", short_sleep)
+    retry_module._sleep(0.001)
+    assert len(calls) == 3
+    assert clock[0] >= 100.001
+
+def test_retry_wrappers_keep_function_metadata():
+    import inspect
+
+    def fetch(chat_id: int, limit: int = 10) -> list:
+        """Fetch messages"""
+        return []
+
+    async def afetch(chat_id: int) -> list:
+        return []
+
+    wrapped = retry()(fetch)
+    assert wrapped.__name__ == "fetch"
+    assert wrapped.__doc__ == "Fetch messages"
+    assert wrapped.__wrapped__ is fetch
+    assert str(inspect.signature(wrapped)) == str(inspect.signature(fetch))
+    assert async_retry()(afetch).__wrapped__ is afetch
@@ -1,67 +1,174 @@
+import asyncio
+
 import fakeredis
 import pytest
+from unittest.mock import AsyncMock
 
 from app.userbot import state
 
 @pytest.fixture(autouse=True)
 def fake_redis(monkeypatch):
-    fake = fakeredis.FakeStrictRedis()
-    monkeypatch.setattr(state, "get_redis_connection", lambda _: fake)
-    yield fake
+    # State goes through the async client; the sync view on the same server
+    # lets tests inspect keys directly
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(state, "get_async_decoded_redis_connection", lambda _: fakeredis.FakeAsyncRedis(server=server, decode_responses=True))
+    monkeypatch.setattr(state, "_read_cache", {})
+    monkeypatch.setattr(state, "_read_inflight", {})
+    monkeypatch.setattr(state, "_scripts", {})
+    yield fakeredis.FakeStrictRedis(server=server)
 
-def test_pending_prompt_state_lifecycle():
+@pytest.mark.asyncio
+async def test_pending_prompt_state_lifecycle():
     user_id = 123
     request_id = "req1"
-    assert state.set_pending_prompt_state(user_id, request_id) is True
-    assert state.get_pending_state(user_id) == request_id
-    assert state.clear_pending_state(user_id) is True
-    assert state.get_pending_state(user_id) is None
+    assert await state.set_pending_prompt_state(user_id, request_id) is True
+    assert await state.get_pending_state(user_id) == request_id
+    assert await state.clear_pending_state(user_id) is True
+    assert await state.get_pending_state(user_id) is None
 
-def test_store_request_data():
+@pytest.mark.asyncio
+async def test_store_request_data(fake_redis):
     rid = "req2"
     d = {"foo": "bar", "num": "42"}
-    assert state.store_request_data(rid, d) is True
-    val = state.get_request_data(rid)
+    assert await state.store_request_data(rid, d) is True
+    val = await state.get_request_data(rid)
     assert isinstance(val, dict)
     assert val.get("foo") == "bar"
     assert val.get("num") == "42"
+    assert 0 < fake_redis.ttl("request:req2:data") <= state.REQUEST_DATA_TTL
 
-def test_update_request_status():
+@pytest.mark.asyncio
+async def test_update_request_status():
     rid = "req3"
-    state.store_request_data(rid, {"status": "foo"})
-    assert state.update_request_status(rid, "bar") is True
-    val = state.get_request_data(rid)
+    await state.store_request_data(rid, {"status": "foo"})
+    assert await state.update_request_status(rid, "bar") is True
+    val = await state.get_request_data(rid)
     assert val.get("status") == "bar"
 
-def test_set_and_get_status_message():
+@pytest.mark.asyncio
+async def test_set_and_get_status_message():
     user_id = 1001
     chat_id = 2002
     msg_id = 3003
-    assert state.set_status_message(user_id, chat_id, msg_id) is True
-    assert state.get_status_message(user_id, chat_id) == msg_id
+    assert await state.set_status_message(user_id, chat_id, msg_id) is True
+    assert await state.get_status_message(user_id, chat_id) == msg_id
 
-def test_add_rq_job_id():
+@pytest.mark.asyncio
+async def test_add_rq_job_id():
     rid = "req-job"
-    state.store_request_data(rid, {"foo": "bar"})
-    assert state.add_rq_job_id(rid, "jobid-xyz") is True
-    data = state.get_request_data(rid)
+    await state.store_request_data(rid, {"foo": "bar"})
+    assert await state.add_rq_job_id(rid, "jobid-xyz") is True
+    data = await state.get_request_data(rid)
     assert data["rq_job_id"] == "jobid-xyz"
 
-def test_get_request_data_missing():
-    assert state.get_request_data("does-not-exist") is None
+@pytest.mark.asyncio
+async def test_begin_and_submit_request(fake_redis):
+    assert await state.begin_request(7, "req-b", {"target_chat_id": 42, "status": "PENDING_PROMPT"}) is True
+    assert fake_redis.get("user:7:state") == b"req-b"
+    assert fake_redis.ttl("request:req-b:data") > 0
+    assert await state.submit_prompt(7, "req-b", "summarize") is True
+    assert fake_redis.exists("user:7:state") == 0
+    data = await state.get_request_data("req-b")
+    assert data == {"target_chat_id": "42", "status": "QUEUED", "custom_prompt": "summarize"}
+    # A worker that already moved the request on must not be reset to QUEUED
+    assert await state.update_request_status("req-b", "STARTED") is True
+    assert await state.add_rq_job_id("req-b", "job-1") is True
+    data = await state.get_request_data("req-b")
+    assert (data["status"], data["rq_job_id"]) == ("STARTED", "job-1")
+
+@pytest.mark.asyncio
+async def test_store_request_data_value_encoding(fake_redis):
+    data = {"i": 42, "f": 1.5, "b": True, "n": None, "s": "x", "raw": b"\xff"}
+    assert await state.store_request_data("req-enc", data) is True
+    assert fake_redis.hgetall("request:req-enc:data") == {
+        b"i": b"42", b"f": b"1.5", b"b": b"True", b"n": b"None", b"s": b"x", b"raw": b"\xff",
+    }
+
+@pytest.mark.asyncio
+async def test_get_request_data_missing():
+    assert await state.get_request_data("does-not-exist") is None
 
-def test_get_status_message_missing():
-    assert state.get_status_message(99999, 88888) is None
+@pytest.mark.asyncio
+async def test_get_status_message_missing():
+    assert await state.get_status_message(99999, 88888) is None
 
-def test_logging_on_redis_error(monkeypatch):
+@pytest.mark.asyncio
+async def test_logging_on_redis_error(monkeypatch):
     # Simulate redis error and ensure False/None is returned and no exception
-    monkeypatch.setattr(state, "get_redis_connection", lambda _: (_ for _ in ()).throw(Exception("fail")))
-    assert state.set_pending_prompt_state(1, "req") is False
-    assert state.get_pending_state(1) is None
-    assert state.clear_pending_state(1) is False
-    assert state.set_status_message(1, 2, 3) is False
-    assert state.get_status_message(1, 2) is None
-    assert state.store_request_data("x", {}) is False
-    assert state.get_request_data("x") is None
-    assert state.update_request_status("x", "foo") is False
-    assert state.add_rq_job_id("x", "abc") is False
+    monkeypatch.setattr(state, "get_async_decoded_redis_connection", lambda _: (_ for _ in ()).throw(Exception("fail")))
+    assert await state.set_pending_prompt_state(1, "req") is False
+    assert await state.get_pending_state(1) is None
+    assert await state.clear_pending_state(1) is False
+    assert await state.set_status_message(1, 2, 3) is False
+    assert await state.get_status_message(1, 2) is None
+    assert await state.store_request_data("x", {}) is False
+    assert await state.get_request_data("x") is None
+    assert await state.update_request_status("x", "foo") is False
+    assert await state.add_rq_job_id("x", "abc") is False
+
+@pytest.mark.asyncio
+async def test_concurrent_reads_share_one_fetch(fake_redis, monkeypatch):
+    fake_redis.hset("request:req-sf:data", mapping={"status": "QUEUED"})
+    calls = []
+    fetch = state._fetch_request_data
+
+    async def counting_fetch(request_id, key):
+        calls.append(request_id)
+        return await fetch(request_id, key)
+
+    monkeypatch.setattr(state, "_fetch_request_data", counting_fetch)
+    results = await asyncio.gather(*(state.get_request_data("req-sf") for _ in range(5)))
+    assert results == [{"status": "QUEUED"}] * 5
+    assert await state.get_request_data("req-sf") == {"status": "QUEUED"}
+    assert calls == ["req-sf"]
+
+@pytest.mark.asyncio
+async def test_writes_invalidate_cached_reads(fake_redis):
+    await state.store_request_data("req-inv", {"status": "QUEUED"})
+    assert (await state.get_request_data("req-inv"))["status"] == "QUEUED"
+    await state.update_request_status("req-inv", "STARTED")
+    assert (await state.get_request_data("req-inv"))["status"] == "STARTED"
+    await state.set_status_message(1, 2, 3)
+    assert await state.get_status_message(1, 2) == 3
+    await state.set_status_message(1, 2, 4)
+    assert await state.get_status_message(1, 2) == 4
+    # Writes from other processes only show up once the entry expires
+    fake_redis.hset("request:req-inv:data", "status", "SUCCESS")
+    assert (await state.get_request_data("req-inv"))["status"] == "STARTED"
+
+@pytest.mark.asyncio
+async def test_status_update_after_expiry_keeps_ttl(fake_redis):
+    # HSET on an expired request would otherwise recreate it without a TTL
+    assert await state.update_request_status("req-late", "SUCCESS") is True
+    assert fake_redis.hget("request:req-late:data", "status") == b"SUCCESS"
+    assert 0 < fake_redis.ttl("request:req-late:data") <= state.REQUEST_DATA_TTL
+    assert await state.add_rq_job_id("req-late2", "job") is True
+    assert 0 < fake_redis.ttl("request:req-late2:data") <= state.REQUEST_DATA_TTL
+
+@pytest.mark.asyncio
+async def test_get_status_context_one_round_trip(fake_redis, monkeypatch):
+    fake_redis.hset("request:req-ctx:data", mapping={"user_id": "5", "target_chat_id": "-100", "status": "STARTED"})
+    fake_redis.set("user:5:status:-100", "77")
+    fetches = []
+    monkeypatch.setattr(state, "_fetch_status_message", AsyncMock(side_effect=lambda key: fetches.append(key)))
+    data, msg_id = await state.get_status_context("req-ctx")
+    assert data == {"user_id": "5", "target_chat_id": "-100", "status": "STARTED"}
+    assert msg_id == 77
+    # The status message id came back with the script, not a separate GET
+    assert fetches == []
+    assert await state.get_status_context("missing") == (None, None)
+
+@pytest.mark.asyncio
+async def test_pipelined_writes_skip_script_exists(fake_redis, monkeypatch):
+    from redis.asyncio.client import Pipeline
+    monkeypatch.setattr(Pipeline, "load_scripts", lambda self: pytest.fail("SCRIPT EXISTS round trip"))
+    fake_redis.script_flush()
+    assert await state.begin_request(8, "req-ns", {"target_chat_id": 1}) is True
+    assert await state.submit_prompt(8, "req-ns", "go") is True
+    assert fake_redis.hgetall("request:req-ns:data") == {b"target_chat_id": b"1", b"custom_prompt": b"go", b"status": b"QUEUED"}
+    assert fake_redis.ttl("request:req-ns:data") > 0
+
+def test_key_builders_layout():
+    assert state._user_state_key(5) == "user:5:state"
+    assert state._status_message_key(5, -100) == "user:5:status:-100"
+    assert state._request_data_key("abc") == "request:abc:data"
@@ -5,7 +5,7 @@ def test_publish_status_handles_exceptions(monkeypatch):
     class DummyRedis:
         def publish(self, chan, msg):
             raise Exception("fail")
-    monkeypatch.setattr(tasks, "get_redis_connection", lambda settings: DummyRedis())
+    monkeypatch.setattr(tasks, "get_worker_redis_connection", lambda settings: DummyRedis())
     # Should not raise
     def fake_job(): pass
     tasks.job = fake_job
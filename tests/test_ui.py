@@ -10,22 +10,21 @@ async def test_update_status_message_success(monkeypatch):
         "target_chat_id": 2,
         "status": "SUCCESS"
     }
-    monkeypatch.setattr("app.userbot.state.get_request_data", lambda rid: state_data)
-    monkeypatch.setattr("app.userbot.state.get_status_message", lambda u, c: 99)
+    monkeypatch.setattr("app.userbot.state.get_status_context", AsyncMock(return_value=(state_data, 99)))
     client = AsyncMock()
     await ui.update_status_message_for_request(client, "rid")
     client.edit_message.assert_awaited_with(1, 99, "✅ Status for chat 2: SUCCESS")
 
 @pytest.mark.asyncio
 async def test_update_status_message_missing_data(monkeypatch):
-    monkeypatch.setattr("app.userbot.state.get_request_data", lambda rid: None)
+    monkeypatch.setattr("app.userbot.state.get_status_context", AsyncMock(return_value=(None, None)))
     client = AsyncMock()
     await ui.update_status_message_for_request(client, "rid")
     assert not client.edit_message.await_count
 
 @pytest.mark.asyncio
 async def test_update_status_message_missing_fields(monkeypatch):
-    monkeypatch.setattr("app.userbot.state.get_request_data", lambda rid: {"user_id": None, "target_chat_id": None, "status": None})
+    monkeypatch.setattr("app.userbot.state.get_status_context", AsyncMock(return_value=({"user_id": None, "target_chat_id": None, "status": None}, None)))
     client = AsyncMock()
     await ui.update_status_message_for_request(client, "rid")
     assert not client.edit_message.await_count
@@ -37,8 +36,7 @@ async def test_update_status_message_no_msg_id(monkeypatch):
         "target_chat_id": 2,
         "status": "SUCCESS"
     }
-    monkeypatch.setattr("app.userbot.state.get_request_data", lambda rid: state_data)
-    monkeypatch.setattr("app.userbot.state.get_status_message", lambda u, c: None)
+    monkeypatch.setattr("app.userbot.state.get_status_context", AsyncMock(return_value=(state_data, None)))
     client = AsyncMock()
     await ui.update_status_message_for_request(client, "rid")
     assert not client.edit_message.await_count
@@ -50,8 +48,7 @@ async def test_update_status_message_edit_error(monkeypatch):
         "target_chat_id": 2,
         "status": "SUCCESS"
     }
-    monkeypatch.setattr("app.userbot.state.get_request_data", lambda rid: state_data)
-    monkeypatch.setattr("app.userbot.state.get_status_message", lambda u, c: 99)
+    monkeypatch.setattr("app.userbot.state.get_status_context", AsyncMock(return_value=(state_data, 99)))
     client = AsyncMock()
     client.edit_message.side_effect = Exception("fail!")
     await ui.update_status_message_for_request(client, "rid")